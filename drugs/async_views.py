@@ -0,0 +1,53 @@
+from pharmacy_marketplce.async_views import authenticate, json_response
+from pharmacy_marketplce.conditional import make_etag, not_modified, set_validators
+from . import facets, fragments
+from .cache import CATALOG, aget_or_compute, amake_key
+from .views import InvalidListParams, list_key_parts, list_page_builder, list_stale_key, parse_list_params
+
+
+async def list_drugs(request):
+    _, response = await authenticate(request, required=False)
+    if response is not None:
+        return response
+    try:
+        page_size, cursor, lookups = parse_list_params(request.GET)
+    except InvalidListParams as e:
+        return json_response({'error': str(e)}, status=400)
+    cache_key = await amake_key('drugs-page', [CATALOG], *list_key_parts(lookups, cursor, page_size))
+    etag = make_etag(cache_key)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    try:
+        body = await aget_or_compute(
+            cache_key, list_page_builder(lookups, cursor, page_size), timeout=600,  # 10 minutes
+            stale_key=list_stale_key(lookups, cursor, page_size),
+        )
+    except Exception as e:
+        return json_response({'error': 'An error occurred.', 'message': str(e)}, status=500)
+    return set_validators(fragments.json_response(body), etag)
+
+
+async def drug_detail(request, pk):
+    _, response = await authenticate(request, required=False)
+    if response is not None:
+        return response
+    try:
+        fragment = await fragments.aget_fragment(pk)
+    except Exception as e:
+        return json_response({'error': 'An error occurred.', 'message': str(e)}, status=500)
+    if fragment is None:
+        return json_response({'error': 'Drug not found.'}, status=404)
+    body, etag, last_modified = fragment
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+    return set_validators(fragments.json_response(body), etag, last_modified)
+
+
+async def drug_categories(request):
+    _, response = await authenticate(request, required=False)
+    if response is not None:
+        return response
+    categories = sorted((await facets.aget_counts())['category'])
+    return json_response(categories)
@@ -0,0 +1,181 @@
+import math
+import random
+import threading
+import time
+from collections import Counter
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+from pharmacy_marketplce.replicas import cache_timeout
+
+# The catalog caches go through the two-tier (in-process + Redis) backend.
+CACHE_ALIAS = 'tiered'
+cache = ConnectionProxy(caches, CACHE_ALIAS)
+
+CATALOG = 'catalog'
+
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+LOCK_MAX_WAIT = 2
+STALE_TIMEOUT = 60 * 60 * 24
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def seller_namespace(seller_id):
+    return f'seller:{seller_id}'
+
+
+def category_namespace(category):
+    return f'category:{quote(category)}'
+
+
+def drug_namespace(drug_id):
+    return f'drug:{drug_id}'
+
+
+def drug_namespaces(drug):
+    return [CATALOG, drug_namespace(drug.pk), seller_namespace(drug.seller_id), category_namespace(drug.category)]
+
+
+def _version_key(namespace):
+    return f'ver:{namespace}'
+
+
+def _initial_version():
+    # Never restart from 1, otherwise an evicted version key could bring old entries back to life.
+    return int(time.time() * 1000)
+
+
+def get_versions(namespaces):
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(namespaces):
+    """get_versions() for async views. Only a namespace without a version yet needs the sync path."""
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = await cache.aget_many(keys)
+    if len(versions) < len(keys):
+        return await sync_to_async(get_versions)(namespaces)
+    return [versions[key] for key in keys]
+
+
+def bump(*namespaces):
+    for namespace in set(namespaces):
+        key = _version_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_version(), timeout=None)
+
+
+def make_key(prefix, namespaces, *parts):
+    """
+    Builds a cache key that embeds the current version of every namespace it depends on.
+    Bumping any of those namespaces makes the key unreachable; the old entry simply expires.
+    """
+    versions = '.'.join(str(version) for version in get_versions(namespaces))
+    return ':'.join([prefix, versions, *(str(part) for part in parts)])
+
+
+async def amake_key(prefix, namespaces, *parts):
+    versions = '.'.join(str(version) for version in await aget_versions(namespaces))
+    return ':'.join([prefix, versions, *(str(part) for part in parts)])
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_stats():
+    with _stats_lock:
+        return {name: _stats[name] for name in ('hits', 'misses', 'stale', 'lock_waits', 'early_refreshes')}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _should_refresh_early(delta, expires_at, beta):
+    # XFetch: the closer to expiry and the slower the recompute, the more likely a request refreshes early.
+    return time.time() - delta * beta * math.log(1 - random.random()) >= expires_at
+
+
+def _compute_and_store(key, compute, timeout, stale_key):
+    timeout = cache_timeout(timeout)
+    start = time.time()
+    value = compute()
+    entry = (value, time.time() - start, start + timeout)
+    cache.set(key, entry, timeout=timeout)
+    if stale_key:
+        cache.set(stale_key, entry, timeout=cache_timeout(STALE_TIMEOUT))
+    return value
+
+
+def get_or_compute(key, compute, timeout=600, stale_key=None, beta=1.0):
+    """
+    Single-flight read-through cache. Only the request holding the lock runs compute(); the others get the
+    stale copy under stale_key if there is one, or wait for the fresh value. Entries are refreshed early
+    with XFetch so that a hot key is usually rebuilt before it expires.
+    """
+    lock_key = f'lock:{key}'
+    entry = cache.get(key)
+    if entry is not None:
+        value, delta, expires_at = entry
+        if _should_refresh_early(delta, expires_at, beta) and cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+            _count('early_refreshes')
+            try:
+                return _compute_and_store(key, compute, timeout, stale_key)
+            finally:
+                cache.delete(lock_key)
+        _count('hits')
+        return value
+
+    _count('misses')
+    if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        try:
+            return _compute_and_store(key, compute, timeout, stale_key)
+        finally:
+            cache.delete(lock_key)
+
+    if stale_key:
+        stale = cache.get(stale_key)
+        if stale is not None:
+            _count('stale')
+            return stale[0]
+
+    _count('lock_waits')
+    deadline = time.time() + LOCK_MAX_WAIT
+    while time.time() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    # The lock holder is too slow or died; compute without the lock rather than failing the request.
+    return _compute_and_store(key, compute, timeout, stale_key)
+
+
+async def aget_or_compute(key, compute, timeout=600, stale_key=None, beta=1.0):
+    """
+    get_or_compute() for async views. A fresh hit is served without leaving the event loop; misses and early
+    refreshes take the lock and run the sync compute() in a worker thread, so single-flight works as before.
+    """
+    entry = await cache.aget(key)
+    if entry is not None:
+        value, delta, expires_at = entry
+        if not _should_refresh_early(delta, expires_at, beta):
+            _count('hits')
+            return value
+    return await sync_to_async(get_or_compute)(key, compute, timeout=timeout, stale_key=stale_key, beta=beta)
@@ -0,0 +1,79 @@
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import fragments
+from .models import DrugChange
+
+
+class ChangesPruned(Exception):
+    pass
+
+
+def record(drug_ids, action):
+    """
+    Appends one change per drug. Called right after the write, inside its transaction when it has one, so that
+    rolled back writes leave no changes behind.
+    """
+    now = timezone.now()
+    DrugChange.objects.bulk_create(
+        [DrugChange(drug_id=drug_id, action=action, changed_at=now) for drug_id in drug_ids]
+    )
+
+
+def latest():
+    """The sequence number to start syncing from after downloading the whole catalog."""
+    return DrugChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def prune(before):
+    """Deletes changes older than before, always keeping the latest one so pruned cursors can be told apart."""
+    newest = latest()
+    return DrugChange.objects.filter(changed_at__lt=before, id__lt=newest).delete()[0]
+
+
+def _settled_before():
+    return timezone.now() - datetime.timedelta(seconds=settings.DRUG_CHANGES_SETTLE_SECONDS)
+
+
+def feed(since, page_size):
+    """
+    The changes after sequence number `since` as JSON bytes:
+
+        {"results": [{"seq": 12, "action": "updated", "id": 3, "drug": {...DrugSerializer...}}, ...],
+         "next": 12, "more": false}
+
+    Only the last change of each drug in the batch is returned, with the drug as it is now, so a batch costs
+    O(changes) whatever the catalog size. A drug deleted since then is reported as deleted. Raises ChangesPruned
+    when changes after `since` have already been pruned, in which case the client has to download the catalog
+    again.
+    """
+    oldest = DrugChange.objects.order_by('id').values_list('id', flat=True).first()
+    if oldest is not None and since < oldest - 1:
+        raise ChangesPruned('Changes after this sequence number were pruned; download the catalog again.')
+    settled_before = _settled_before()
+    rows = list(
+        DrugChange.objects.filter(id__gt=since)
+        .order_by('id').values_list('id', 'drug_id', 'action', 'changed_at')[:page_size + 1]
+    )
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    # The page ends before the first change that has not settled, not just without it: a lower sequence number
+    # can still commit after a higher one, and a cursor moved past it would never return it.
+    for index, (seq, drug_id, action, changed_at) in enumerate(rows):
+        if changed_at > settled_before:
+            rows, more = rows[:index], False
+            break
+    last = {drug_id: (seq, action) for seq, drug_id, action, changed_at in rows}
+    drugs = fragments.get_fragments(
+        [drug_id for drug_id, (seq, action) in last.items() if action != DrugChange.ACTION_DELETED]
+    )
+    results = []
+    for drug_id, (seq, action) in sorted(last.items(), key=lambda item: item[1][0]):
+        drug = drugs.get(drug_id)
+        if drug is None:
+            action, drug = DrugChange.ACTION_DELETED, b'null'
+        results.append(fragments.encode({'seq': seq, 'action': action, 'id': drug_id})[:-1] + b',"drug":' + drug + b'}')
+    cursor = fragments.encode({'next': rows[-1][0] if rows else since, 'more': more})
+    return b'{"results":[' + b','.join(results) + b'],' + cursor[1:]
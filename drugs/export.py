@@ -0,0 +1,133 @@
+import csv
+import datetime
+import decimal
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Drug
+
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+CHUNK_SIZE = 2000
+FLUSH_SIZE = 64 * 1024
+
+DRUG_COLUMNS = (
+    'id', 'drug_name', 'description', 'price', 'image', 'created_at', 'quantity', 'expiration_date', 'brand',
+    'category', 'manufacturer_country', 'manufacturer', 'active_substance', 'type', 'dozens', 'seller_id',
+)
+
+
+class InvalidExport(Exception):
+    pass
+
+
+def _value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+class _Buffer:
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, value):
+        self.parts.append(value)
+        self.size += len(value)
+
+    def drain(self):
+        data, self.parts, self.size = ''.join(self.parts), [], 0
+        return data
+
+
+def encode_rows(columns, rows, fmt):
+    """
+    Yields the rows (tuples in columns order) encoded as CSV with a header or as NDJSON. Lines are grouped into
+    chunks of about FLUSH_SIZE characters so a large export is not sent one tiny write per row.
+    """
+    buffer = _Buffer()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        write = lambda row: writer.writerow([_value(value) for value in row])
+    else:
+        write = lambda row: buffer.write(json.dumps(dict(zip(columns, map(_value, row))), ensure_ascii=False) + '\n')
+    for row in rows:
+        write(row)
+        if buffer.size >= FLUSH_SIZE:
+            yield buffer.drain()
+    data = buffer.drain()
+    if data:
+        yield data
+
+
+async def aencode_rows(columns, rows, fmt):
+    """
+    encode_rows() for ASGI servers. Django buffers a sync iterator whole before sending it under ASGI, so every
+    chunk is produced in the request's sync thread, the one holding its database connection, and sent right away.
+    """
+    chunks = encode_rows(columns, rows, fmt)
+    next_chunk = sync_to_async(next)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
+
+
+def parse_format(params):
+    # Not "format": DRF reserves that query parameter for picking a renderer.
+    fmt = params.get('output') or 'csv'
+    if fmt not in FORMATS:
+        raise InvalidExport(f'output must be one of {", ".join(FORMATS)}.')
+    return fmt
+
+
+def _day_start(name, value):
+    try:
+        day = datetime.date.fromisoformat(value)
+    except ValueError:
+        raise InvalidExport(f'{name} must be a date in YYYY-MM-DD format.')
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def parse_date_range(params):
+    """
+    Turns the optional created_after / created_before parameters (YYYY-MM-DD, both inclusive) into lookups.
+    The bounds are datetimes rather than a __date lookup so the created_at indexes still apply.
+    """
+    lookups = {}
+    if params.get('created_after'):
+        lookups['created_at__gte'] = _day_start('created_after', params['created_after'])
+    if params.get('created_before'):
+        lookups['created_at__lt'] = _day_start('created_before', params['created_before']) + datetime.timedelta(days=1)
+    return lookups
+
+
+def parse_seller(params):
+    if not params.get('seller'):
+        return None
+    try:
+        return int(params['seller'])
+    except ValueError:
+        raise InvalidExport('seller must be a user id.')
+
+
+def drug_rows(seller_id=None, **lookups):
+    # The order of the (created_at, id) and (seller, created_at) indexes, so the rows stream without a sort.
+    queryset = Drug.objects.filter(**lookups).order_by('created_at', 'id')
+    if seller_id is not None:
+        queryset = queryset.filter(seller_id=seller_id)
+    return queryset.values_list(*DRUG_COLUMNS).iterator(chunk_size=CHUNK_SIZE)
+
+
+def streaming_response(request, columns, rows, fmt, filename):
+    asynchronous = isinstance(getattr(request, '_request', request), ASGIRequest)
+    content = (aencode_rows if asynchronous else encode_rows)(columns, rows, fmt)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
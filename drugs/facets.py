@@ -0,0 +1,96 @@
+from collections import Counter
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F
+
+from .cache import aget_or_compute, amake_key, bump, make_key, get_or_compute
+from .models import Drug, DrugFacetCount
+
+FACETS = [facet for facet, _ in DrugFacetCount.FACET_CHOICES]
+FACETS_NAMESPACE = 'facets'
+UPSERT_BATCH_SIZE = 300  # 3 parameters per row, SQLite allows 999
+
+
+def facet_values(drug):
+    return {facet: getattr(drug, facet) for facet in FACETS}
+
+
+def diff(old_values, new_values):
+    """Counter of (facet, value) -> delta between two facet_values() dicts; either side may be None."""
+    deltas = Counter()
+    for facet in FACETS:
+        old = old_values[facet] if old_values else None
+        new = new_values[facet] if new_values else None
+        if old == new:
+            continue
+        if old is not None:
+            deltas[(facet, old)] -= 1
+        if new is not None:
+            deltas[(facet, new)] += 1
+    return deltas
+
+
+def _upsert(deltas):
+    table = connection.ops.quote_name(DrugFacetCount._meta.db_table)
+    values = ', '.join(['(%s, %s, %s)'] * len(deltas))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (facet, value, count) VALUES {values} '
+            f'ON CONFLICT (facet, value) DO UPDATE SET count = {table}.count + excluded.count',
+            [param for (facet, value), delta in deltas.items() for param in (facet, value, delta)],
+        )
+
+
+def _bump_after_commit():
+    # Inside a transaction, e.g. an import batch, a read before the commit would cache the old counts under the new
+    # version. Outside of one, on_commit() runs it at once.
+    transaction.on_commit(lambda: bump(FACETS_NAMESPACE))
+
+
+def apply(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    if connection.vendor in ('sqlite', 'postgresql'):
+        # A few upserts for the whole batch instead of an UPDATE (and maybe an INSERT) per value.
+        items = list(deltas.items())
+        for start in range(0, len(items), UPSERT_BATCH_SIZE):
+            _upsert(dict(items[start:start + UPSERT_BATCH_SIZE]))
+        _bump_after_commit()
+        return
+    for (facet, value), delta in deltas.items():
+        if DrugFacetCount.objects.filter(facet=facet, value=value).update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                DrugFacetCount.objects.create(facet=facet, value=value, count=delta)
+        except IntegrityError:
+            # Created concurrently by another writer between our UPDATE and INSERT.
+            DrugFacetCount.objects.filter(facet=facet, value=value).update(count=F('count') + delta)
+    _bump_after_commit()
+
+
+def rebuild():
+    with transaction.atomic():
+        DrugFacetCount.objects.all().delete()
+        DrugFacetCount.objects.bulk_create([
+            DrugFacetCount(facet=facet, value=row[facet], count=row['count'])
+            for facet in FACETS
+            for row in Drug.objects.order_by().values(facet).annotate(count=Count('id'))
+        ])
+    _bump_after_commit()
+
+
+def _load_counts():
+    counts = {facet: {} for facet in FACETS}
+    for facet, value, count in DrugFacetCount.objects.filter(count__gt=0).values_list('facet', 'value', 'count'):
+        counts[facet][value] = count
+    return counts
+
+
+def get_counts():
+    return get_or_compute(make_key('drug-facets', [FACETS_NAMESPACE]), _load_counts, timeout=600)
+
+
+async def aget_counts():
+    return await aget_or_compute(await amake_key('drug-facets', [FACETS_NAMESPACE]), _load_counts, timeout=600)
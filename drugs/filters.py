@@ -0,0 +1,54 @@
+import datetime
+import decimal
+import hashlib
+
+from .facets import FACETS
+
+
+class InvalidFilter(Exception):
+    pass
+
+
+def _decimal(name, value):
+    try:
+        value = decimal.Decimal(value)
+    except decimal.InvalidOperation:
+        raise InvalidFilter(f'{name} must be a number.')
+    # Decimal() also parses NaN and Infinity, which the database cannot compare prices with.
+    if not value.is_finite():
+        raise InvalidFilter(f'{name} must be a number.')
+    return value
+
+
+def _date(name, value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise InvalidFilter(f'{name} must be a date in YYYY-MM-DD format.')
+
+
+RANGE_FILTERS = {
+    'min_price': ('price__gte', _decimal),
+    'max_price': ('price__lte', _decimal),
+    'expires_after': ('expiration_date__gte', _date),
+    'expires_before': ('expiration_date__lte', _date),
+}
+
+
+def parse_filters(params):
+    """Turns list query parameters into queryset lookups; raises InvalidFilter on malformed values."""
+    lookups = {}
+    for facet in FACETS:
+        if params.get(facet):
+            lookups[facet] = params[facet]
+    for name, (lookup, parse) in RANGE_FILTERS.items():
+        if params.get(name):
+            lookups[lookup] = parse(name, params[name])
+    return lookups
+
+
+def filters_digest(lookups):
+    if not lookups:
+        return 'all'
+    raw = '&'.join(f'{lookup}={value}' for lookup, value in sorted(lookups.items()))
+    return hashlib.md5(raw.encode()).hexdigest()
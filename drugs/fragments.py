@@ -0,0 +1,140 @@
+from django.http import HttpResponse
+
+from pharmacy_marketplce.conditional import make_etag
+from pharmacy_marketplce.metrics import timed_serialize
+from pharmacy_marketplce.replicas import cache_timeout
+from pharmacy_marketplce.renderers import FastJSONRenderer
+
+from .cache import cache, aget_versions, bump, drug_namespace, get_versions
+from . import representation
+from .models import Drug
+from .serializers import DrugSerializer
+
+# Fragments are keyed by the drug's namespace version, so a change makes the old one unreachable.
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+# Bumped whenever DrugSerializer's output changes, so fragments and bodies cached by the previous release are not
+# served, and their ETags no longer match.
+FORMAT = 2
+
+_renderer = FastJSONRenderer()
+
+
+def encode(data):
+    """JSON bytes exactly as DRF's JSONRenderer would produce them for this data."""
+    return b'null' if data is None else _renderer.render(data)
+
+
+def _format_keys(drug_ids, versions):
+    return {drug_id: f'drug-json:{FORMAT}:{drug_id}:{version}' for drug_id, version in zip(drug_ids, versions)}
+
+
+def _keys(drug_ids):
+    return _format_keys(drug_ids, get_versions([drug_namespace(drug_id) for drug_id in drug_ids]))
+
+
+async def _akeys(drug_ids):
+    return _format_keys(drug_ids, await aget_versions([drug_namespace(drug_id) for drug_id in drug_ids]))
+
+
+@timed_serialize
+def render(drugs):
+    """{drug id: (JSON bytes, updated_at)}, the form fragments are cached in."""
+    return {
+        drug.pk: (encode(data), drug.updated_at) for drug, data in zip(drugs, DrugSerializer(drugs, many=True).data)
+    }
+
+
+@timed_serialize
+def render_rows(rows):
+    """Like render(), from .values(*representation.drugs.columns) rows instead of model instances."""
+    plan = representation.drugs.plan()
+    return {row['id']: (encode(representation.drugs.one(row, plan)), row['updated_at']) for row in rows}
+
+
+def store(drugs):
+    """Renders and caches the fragments of freshly saved drugs, so the next read does not have to."""
+    drugs = list(drugs)
+    if not drugs:
+        return
+    bump(*[drug_namespace(drug.pk) for drug in drugs])
+    keys = _keys([drug.pk for drug in drugs])
+    cache.set_many({keys[drug_id]: entry for drug_id, entry in render(drugs).items()}, timeout=FRAGMENT_TIMEOUT)
+
+
+def _rows(drug_ids):
+    # Unordered: the fragments are keyed by id, so Meta.ordering would only add a sort.
+    return Drug.objects.filter(pk__in=drug_ids).order_by().values(*representation.drugs.columns)
+
+
+def _get_entries(drug_ids, keys):
+    cached = cache.get_many(list(keys.values()))
+    entries = {drug_id: cached[key] for drug_id, key in keys.items() if key in cached}
+    missing = [drug_id for drug_id in drug_ids if drug_id not in entries]
+    if missing:
+        rendered = render_rows(_rows(missing))
+        cache.set_many(
+            {keys[drug_id]: entry for drug_id, entry in rendered.items()}, timeout=cache_timeout(FRAGMENT_TIMEOUT),
+        )
+        entries.update(rendered)
+    return entries
+
+
+async def _aget_entries(drug_ids, keys):
+    cached = await cache.aget_many(list(keys.values()))
+    entries = {drug_id: cached[key] for drug_id, key in keys.items() if key in cached}
+    missing = [drug_id for drug_id in drug_ids if drug_id not in entries]
+    if missing:
+        rendered = render_rows([row async for row in _rows(missing)])
+        await cache.aset_many(
+            {keys[drug_id]: entry for drug_id, entry in rendered.items()}, timeout=cache_timeout(FRAGMENT_TIMEOUT),
+        )
+        entries.update(rendered)
+    return entries
+
+
+def get_fragments(drug_ids):
+    """
+    Returns {drug id: JSON bytes as DrugSerializer + JSONRenderer would render it} for the ids that exist. Cached
+    fragments come from one get_many; the missing ones are loaded with one query, rendered and cached.
+    """
+    drug_ids = list(dict.fromkeys(drug_ids))
+    if not drug_ids:
+        return {}
+    return {drug_id: body for drug_id, (body, updated_at) in _get_entries(drug_ids, _keys(drug_ids)).items()}
+
+
+async def aget_fragments(drug_ids):
+    drug_ids = list(dict.fromkeys(drug_ids))
+    if not drug_ids:
+        return {}
+    entries = await _aget_entries(drug_ids, await _akeys(drug_ids))
+    return {drug_id: body for drug_id, (body, updated_at) in entries.items()}
+
+
+def _with_etag(entry, key):
+    return None if entry is None else (entry[0], make_etag(key), entry[1])
+
+
+def get_fragment(drug_id):
+    """(JSON bytes, ETag, updated_at) of one drug, or None if it does not exist."""
+    keys = _keys([drug_id])
+    return _with_etag(_get_entries([drug_id], keys).get(drug_id), keys[drug_id])
+
+
+async def aget_fragment(drug_id):
+    keys = await _akeys([drug_id])
+    return _with_etag((await _aget_entries([drug_id], keys)).get(drug_id), keys[drug_id])
+
+
+def join(drug_ids, fragments=None):
+    """A JSON array of the drugs in drug_ids order; ids that no longer exist are left out."""
+    fragments = get_fragments(drug_ids) if fragments is None else fragments
+    return b'[' + b','.join(fragments[drug_id] for drug_id in drug_ids if drug_id in fragments) + b']'
+
+
+def page(drug_ids, next_page):
+    return b'{"results":' + join(drug_ids) + b',"next":' + encode(next_page) + b'}'
+
+
+def json_response(body, status=200):
+    return HttpResponse(body, status=status, content_type='application/json')
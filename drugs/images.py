@@ -0,0 +1,171 @@
+import hashlib
+import io
+import logging
+import posixpath
+import queue
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Drug, DrugChange
+
+logger = logging.getLogger(__name__)
+
+# name -> (width, height, format, quality, crop). Cropped variants are exactly width x height, the others keep the
+# aspect ratio and fit inside the box. Changing a spec changes the file name, so stale derivatives are never reused.
+VARIANTS = {
+    'thumbnail': (160, 160, 'JPEG', 80, True),
+    'thumbnail_webp': (160, 160, 'WEBP', 75, True),
+    'medium_webp': (640, 640, 'WEBP', 80, False),
+}
+if 'AVIF' in Image.SAVE:
+    # Only with a plugin such as pillow-avif-plugin installed; Pillow itself cannot write AVIF yet.
+    VARIANTS['medium_avif'] = (640, 640, 'AVIF', 60, False)
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'AVIF': 'avif'}
+DERIVED_DIR = 'derived'
+
+
+def variant_path(original_name, digest, name):
+    width, height, fmt, quality, crop = VARIANTS[name]
+    spec = f'{width}x{height}{"c" if crop else ""}q{quality}'
+    directory = posixpath.join(posixpath.dirname(original_name), DERIVED_DIR, digest[:2], digest)
+    return posixpath.join(directory, f'{name}-{spec}.{EXTENSIONS[fmt]}')
+
+
+def render(image, name):
+    width, height, fmt, quality, crop = VARIANTS[name]
+    if crop:
+        image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+    else:
+        image = image.copy()
+        image.thumbnail((width, height), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, fmt, quality=quality, optimize=fmt == 'JPEG')
+    return output.getvalue()
+
+
+def _load(data):
+    image = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder downscale while decoding; the largest derivative is far smaller than most uploads.
+    largest = max(max(width, height) for width, height, *_ in VARIANTS.values())
+    image.draft('RGB', (largest * 2, largest * 2))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_variants(image_name, storage=default_storage):
+    """
+    Creates the derivatives of a stored image and returns {variant name: storage path}. Files are addressed by the
+    hash of the original, so the same upload used by several drugs is processed and stored once.
+    """
+    with storage.open(image_name, 'rb') as original:
+        data = original.read()
+    digest = hashlib.sha256(data).hexdigest()
+    paths = {name: variant_path(image_name, digest, name) for name in VARIANTS}
+    missing = [name for name, path in paths.items() if not storage.exists(path)]
+    if missing:
+        image = _load(data)
+        for name in missing:
+            storage.save(paths[name], ContentFile(render(image, name)))
+    return paths
+
+
+def _store_variants(queryset, variants):
+    from .changes import record
+    from .signals import drugs_updated
+
+    with transaction.atomic():
+        drugs = list(queryset.only('id', 'seller_id', 'category'))
+        updated = queryset.update(image_variants=variants, updated_at=timezone.now())
+        if updated:
+            record([drug.pk for drug in drugs], DrugChange.ACTION_UPDATED)
+    if updated:
+        drugs_updated.send(sender=Drug, drugs=drugs)
+    return len(drugs)
+
+
+def process_drug(drug_id):
+    drug = Drug.objects.filter(pk=drug_id).only('id', 'image', 'seller_id', 'category').first()
+    if drug is None or not drug.image:
+        return None
+    try:
+        variants = generate_variants(drug.image.name)
+    except (OSError, Image.DecompressionBombError) as e:
+        logger.warning('Could not create image variants for drug %s (%s): %s', drug_id, drug.image.name, e)
+        return None
+    # Only store the result if the image was not replaced while we were working on it.
+    _store_variants(Drug.objects.filter(pk=drug_id, image=drug.image.name), variants)
+    return variants
+
+
+def process_image(image_name, only_missing=True):
+    """Creates the variants of one stored image and attaches them to every drug using it. Returns the drug count."""
+    try:
+        variants = generate_variants(image_name)
+    except (OSError, Image.DecompressionBombError) as e:
+        logger.warning('Could not create image variants for %s: %s', image_name, e)
+        return 0
+    drugs = Drug.objects.filter(image=image_name)
+    if only_missing:
+        drugs = drugs.filter(image_variants={})
+    return _store_variants(drugs, variants)
+
+
+class ImageWorker:
+    """Background threads that process queued drug ids, keeping image work off the request path."""
+
+    def __init__(self, threads=1):
+        self.threads = threads
+        self.queue = queue.Queue()
+        self.started = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            for i in range(self.threads):
+                threading.Thread(target=self.run, name=f'drug-images-{i}', daemon=True).start()
+            self.started = True
+
+    def run(self):
+        while True:
+            drug_id = self.queue.get()
+            try:
+                process_drug(drug_id)
+            except Exception:
+                logger.exception('Image processing failed for drug %s', drug_id)
+            finally:
+                close_old_connections()
+                self.queue.task_done()
+
+    def enqueue(self, drug_id):
+        self.start()
+        self.queue.put(drug_id)
+
+
+worker = ImageWorker(threads=max(1, getattr(settings, 'DRUG_IMAGE_WORKERS', 1)))
+
+
+def enqueue(drug_ids):
+    """Schedules image processing; with DRUG_IMAGE_WORKERS = 0 it happens right away in the calling thread."""
+    for drug_id in drug_ids:
+        if getattr(settings, 'DRUG_IMAGE_WORKERS', 1) == 0:
+            process_drug(drug_id)
+        else:
+            worker.enqueue(drug_id)
+
+
+def variant_urls(variants, storage=default_storage):
+    return {name: storage.url(path) for name, path in (variants or {}).items()}
@@ -0,0 +1,252 @@
+import codecs
+import csv
+import datetime
+import decimal
+import json
+import time
+from collections import Counter
+
+from django.db import connection, models, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import facets
+from .cache import CATALOG, bump, seller_namespace, category_namespace
+from .models import Drug, DrugChange, DrugSearchToken
+from .search import tokens_for
+from .validators import check_expiration_date, check_price, check_count, check_letters
+
+FORMATS = ('csv', 'jsonl')
+# No image: a file could otherwise point a drug at any path in the storage. Images are uploaded per drug.
+STRING_FIELDS = ('drug_name', 'description', 'category', 'manufacturer_country', 'manufacturer', 'active_substance', 'type', 'brand')
+REQUIRED_FIELDS = ('drug_name', 'description', 'price', 'quantity', 'category', 'manufacturer_country', 'manufacturer', 'active_substance', 'dozens', 'expiration_date')
+MAX_LENGTHS = {field: Drug._meta.get_field(field).max_length for field in STRING_FIELDS if field != 'description'}
+DEFAULT_IMAGE = Drug._meta.get_field('image').default
+PRICE_QUANTUM = decimal.Decimal('0.01')
+PRICE_LIMIT = decimal.Decimal(10) ** (Drug._meta.get_field('price').max_digits - Drug._meta.get_field('price').decimal_places)
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'failed': self.failed,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second),
+        }
+
+
+def check_utf8(file, chunk_size=1 << 20):
+    """Raises UnicodeDecodeError unless the whole binary file is UTF-8, then rewinds it; imports check first."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while chunk := file.read(chunk_size):
+        decoder.decode(chunk)
+    decoder.decode(b'', final=True)
+    file.seek(0)
+
+
+def read_rows(stream, fmt):
+    """Yields (line number, row dict) pairs from a text stream without loading it into memory."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else {'__error__': 'Line is not a JSON object.'}
+    else:
+        raise ValueError(f'Unknown format {fmt!r}, expected one of {", ".join(FORMATS)}.')
+
+
+def _parse_price(value):
+    try:
+        price = decimal.Decimal(str(value).strip()).quantize(PRICE_QUANTUM)
+    except decimal.InvalidOperation:
+        raise serializers.ValidationError('Price must be a number.')
+    if not price.is_finite():
+        raise serializers.ValidationError('Price must be a number.')
+    if abs(price) >= PRICE_LIMIT:
+        raise serializers.ValidationError(f'Price must be less than {PRICE_LIMIT}.')
+    return check_price(price)
+
+
+def _parse_count(value, label):
+    try:
+        value = int(str(value).strip())
+    except ValueError:
+        raise serializers.ValidationError(f'{label} must be an integer.')
+    return check_count(value, label)
+
+
+def _parse_date(value, today):
+    try:
+        value = datetime.date.fromisoformat(str(value).strip())
+    except ValueError:
+        raise serializers.ValidationError('Expiration date must be a date in YYYY-MM-DD format.')
+    return check_expiration_date(value, today)
+
+
+def validate_row(row, today):
+    """Applies the DrugSerializer rules to one raw row. Returns (field values, errors)."""
+    if '__error__' in row:
+        return None, {'row': row['__error__']}
+    values, errors = {}, {}
+    for field in STRING_FIELDS:
+        value = row.get(field)
+        if value is None or value == '':
+            continue
+        value = str(value).strip()
+        if field in MAX_LENGTHS and len(value) > MAX_LENGTHS[field]:
+            errors[field] = f'Ensure this field has no more than {MAX_LENGTHS[field]} characters.'
+        values[field] = value
+    for field in REQUIRED_FIELDS:
+        if row.get(field) in (None, ''):
+            errors[field] = 'This field is required.'
+
+    checks = {
+        'price': lambda: _parse_price(row['price']),
+        'quantity': lambda: _parse_count(row['quantity'], 'Quantity'),
+        'dozens': lambda: _parse_count(row['dozens'], 'Dozens'),
+        'expiration_date': lambda: _parse_date(row['expiration_date'], today),
+        'manufacturer_country': lambda: check_letters(values['manufacturer_country'], 'Manufacturer country'),
+        'manufacturer': lambda: check_letters(values['manufacturer'], 'Manufacturer'),
+        'category': lambda: check_letters(values['category'], 'Category'),
+    }
+    for field, check in checks.items():
+        if field in errors:
+            continue
+        try:
+            values[field] = check()
+        except serializers.ValidationError as e:
+            errors[field] = str(e.detail[0])
+    values.setdefault('type', '')
+    values.setdefault('brand', '')
+    return values, errors
+
+
+def _converter(field, ops):
+    if isinstance(field, models.JSONField):
+        return lambda value: field.get_db_prep_value(value, ops.connection)
+    if isinstance(field, models.DecimalField):
+        return lambda value: ops.adapt_decimalfield_value(value, field.max_digits, field.decimal_places)
+    if isinstance(field, models.DateTimeField):
+        return ops.adapt_datetimefield_value
+    if isinstance(field, models.DateField):
+        return ops.adapt_datefield_value
+    return None
+
+
+def fast_insert(model, fields, rows, returning=False):
+    """
+    Inserts rows (tuples of python values in fields order) with multi-row INSERT statements.
+
+    This skips the per-object, per-field work bulk_create does, which dominates large imports. Returns the new
+    primary keys when returning is set.
+    """
+    if returning and not connection.features.can_return_rows_from_bulk_insert:
+        objs = model.objects.bulk_create([model(**dict(zip(fields, row))) for row in rows])
+        return [obj.pk for obj in objs]
+    opts = model._meta
+    model_fields = [opts.get_field(name) for name in fields]
+    converters = [_converter(field, connection.ops) for field in model_fields]
+    if any(converters):
+        rows = [
+            tuple(convert(value) if convert else value for convert, value in zip(converters, row))
+            for row in rows
+        ]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in model_fields)
+    placeholder = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    suffix = f' RETURNING {quote(opts.pk.column)}' if returning else ''
+    per_statement = max(1, connection.ops.bulk_batch_size(model_fields, rows))
+    ids = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), per_statement):
+            chunk = rows[start:start + per_statement]
+            sql = f'INSERT INTO {quote(opts.db_table)} ({columns}) VALUES {", ".join([placeholder] * len(chunk))}{suffix}'
+            cursor.execute(sql, [value for row in chunk for value in row])
+            if returning:
+                ids.extend(row[0] for row in cursor.fetchall())
+    return ids
+
+
+DRUG_INSERT_FIELDS = ('seller', 'created_at', 'updated_at', *STRING_FIELDS, 'price', 'quantity', 'dozens', 'expiration_date', 'image', 'image_variants')
+
+
+def write_batch(batch, seller):
+    """Inserts validated drug values for one seller, with their search tokens, changes and facet counts."""
+    created_at = timezone.now()
+    rows = [
+        (seller.pk, created_at, created_at, *(values.get(field, '') for field in STRING_FIELDS),
+         values['price'], values['quantity'], values['dozens'], values['expiration_date'], DEFAULT_IMAGE, {})
+        for values in batch
+    ]
+    with transaction.atomic():
+        ids = fast_insert(Drug, DRUG_INSERT_FIELDS, rows, returning=True)
+        tokens = [
+            (drug_id, token, weight)
+            for drug_id, values in zip(ids, batch)
+            for token, weight in tokens_for(values).items()
+        ]
+        fast_insert(DrugSearchToken, ('drug', 'token', 'weight'), tokens)
+        fast_insert(
+            DrugChange, ('drug_id', 'action', 'changed_at'),
+            [(drug_id, DrugChange.ACTION_CREATED, created_at) for drug_id in ids],
+        )
+        deltas = Counter()
+        for values in batch:
+            deltas.update((facet, values[facet]) for facet in facets.FACETS)
+        facets.apply(deltas)
+    # The raw inserts skip post_save, so the catalog caches are invalidated here once per batch.
+    bump(CATALOG, seller_namespace(seller.pk), *{category_namespace(values['category']) for values in batch})
+    return len(ids)
+
+
+def import_drugs(stream, seller, fmt='csv', batch_size=2000, on_error=None):
+    """
+    Streams drugs from a CSV or JSON lines text stream into the catalog of the given seller.
+
+    Rows are validated with the DrugSerializer rules and written with a few multi-row INSERTs per batch, so
+    memory use depends on batch_size only. Invalid rows are skipped and passed to on_error(line, errors).
+    """
+    result = ImportResult()
+    today = datetime.date.today()
+    batch = []
+    for line_number, row in read_rows(stream, fmt):
+        result.rows += 1
+        values, errors = validate_row(row, today)
+        if errors:
+            result.failed += 1
+            if on_error:
+                on_error(line_number, errors)
+            continue
+        batch.append(values)
+        if len(batch) >= batch_size:
+            result.created += write_batch(batch, seller)
+            batch = []
+    if batch:
+        result.created += write_batch(batch, seller)
+    result.finished = time.perf_counter()
+    return result
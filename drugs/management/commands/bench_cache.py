@@ -0,0 +1,76 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.utils.connection import ConnectionProxy
+
+from drugs import cache as catalog_cache, fragments
+from drugs.models import Drug
+
+
+class Command(BaseCommand):
+    help = 'Compares catalog read latency with the catalog caches on one cache alias versus another.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--aliases', nargs='+', default=['default', catalog_cache.CACHE_ALIAS])
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--hot-drugs', type=int, default=50, help='Detail requests pick among this many drugs.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def urls(self, count, hot_drugs, rng):
+        ids = list(Drug.objects.order_by('-created_at').values_list('id', flat=True)[:hot_drugs])
+        if not ids:
+            raise CommandError('The catalog is empty; import or create some drugs first.')
+        # Mostly detail pages of popular drugs, with the first list page mixed in.
+        return ['/drugs/' if rng.random() < 0.2 else f'/drugs/{rng.choice(ids)}/' for _ in range(count)]
+
+    def run(self, alias, urls):
+        client = Client()
+        original = catalog_cache.cache
+        catalog_cache.cache = ConnectionProxy(caches, alias)
+        backend = caches[alias]
+        try:
+            catalog_cache.cache.clear()
+            if hasattr(backend, 'reset_stats'):
+                backend.reset_stats()
+            for url in set(urls):
+                client.get(url)  # warm up, so both runs measure cache hits
+            lookups = self.time_lookups()
+            timings = []
+            for url in urls:
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} returned {response.status_code}')
+        finally:
+            catalog_cache.cache = original
+        timings.sort()
+        quantiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(
+            f'{alias:>10}: {len(timings) / (sum(timings) / 1000):.0f} req/s, p50 {quantiles[49]:.2f} ms, '
+            f'p95 {quantiles[94]:.2f} ms, p99 {quantiles[98]:.2f} ms; cached list page lookup {lookups:.3f} ms'
+        )
+        if hasattr(backend, 'stats'):
+            stats = backend.stats()
+            self.stdout.write(
+                f'{"":>10}  L1 hit rate {stats["l1_hit_rate"]:.1%}, L2 hit rate {stats["l2_hit_rate"]:.1%}, '
+                f'{stats["l1_entries"]} L1 entries, {stats.get("l1_evictions", 0)} evictions'
+            )
+
+    def time_lookups(self, times=1000):
+        # The cache part of a /drugs/ hit alone: namespace versions plus the page entry.
+        start = time.perf_counter()
+        for _ in range(times):
+            key = catalog_cache.make_key('drugs-page', [catalog_cache.CATALOG], fragments.FORMAT, 'all', 'first', settings.DRUGS_PAGE_SIZE)
+            catalog_cache.cache.get(key)
+        return (time.perf_counter() - start) * 1000 / times
+
+    def handle(self, *args, **options):
+        urls = self.urls(options['requests'], options['hot_drugs'], random.Random(options['seed']))
+        for alias in options['aliases']:
+            self.run(alias, urls)
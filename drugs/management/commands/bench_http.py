@@ -0,0 +1,29 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pharmacy_marketplce import loadgen
+
+
+class Command(BaseCommand):
+    help = ('Load tests a running server with keep-alive GET requests and reports requests/sec and latency '
+            'percentiles, e.g. to compare manage.py runserver (WSGI) with uvicorn (ASGI).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Paths requested in turn, e.g. /drugs/ /drugs/1/')
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--connections', type=int, default=500)
+        parser.add_argument('--duration', type=float, default=20)
+        parser.add_argument('--warmup', type=float, default=3, help='Seconds of load before measuring.')
+        parser.add_argument('--header', action='append', default=[], help='Extra header, e.g. "Authorization: Bearer ..."')
+
+    def handle(self, *args, **options):
+        try:
+            if options['warmup']:
+                asyncio.run(loadgen.run(options['url'], options['paths'], min(options['connections'], 50),
+                                        options['warmup'], options['header']))
+            result = asyncio.run(loadgen.run(options['url'], options['paths'], options['connections'],
+                                             options['duration'], options['header']))
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f'{options["connections"]} connections: {result.summary()}')
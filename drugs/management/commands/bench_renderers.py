@@ -0,0 +1,73 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from drugs import representation
+from drugs.models import Drug
+from pharmacy_marketplce.parsers import FastJSONParser
+from pharmacy_marketplce.renderers import FastJSONRenderer
+from users.models import CustomUser, OrderItemModel, OrderModel
+from users.serializers import represent_orders
+
+
+class Command(BaseCommand):
+    help = 'Compares JSONRenderer/JSONParser with the orjson based ones on drug list and order list payloads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=200, help='Drugs in the list page payload.')
+        parser.add_argument('--orders', type=int, default=50, help='Orders in the order list payload.')
+        parser.add_argument('--items', type=int, default=5, help='Items per order.')
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def best(self, iterations, function, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                function()
+            timings.append((time.perf_counter() - start) * 1000 / iterations)
+        return min(timings)
+
+    def drug_page(self, page_size):
+        rows = Drug.objects.order_by('-created_at', '-id').values(*representation.drugs.columns)[:page_size]
+        results = representation.drugs.many(rows)
+        if len(results) < page_size:
+            raise CommandError(f'Only {len(results)} drugs in the catalog; import more or pass a smaller --page-size.')
+        return {'results': results, 'next': 'Y3JlYXRlZF9hdD0yMDI0LTA2LTA1VDEyOjI4OjAxWiZpZD00Mg=='}
+
+    def order_list(self, orders, items):
+        # Orders of a throwaway buyer, rolled back once the payload is built.
+        drugs = list(Drug.objects.order_by('id')[:items])
+        with transaction.atomic():
+            buyer = CustomUser.objects.create(username='bench-renderers-buyer', phone='+000bench', role='buyer')
+            created = OrderModel.objects.bulk_create([OrderModel(user=buyer, total_price=10) for _ in range(orders)])
+            OrderItemModel.objects.bulk_create([
+                OrderItemModel(order=order, drug=drug, quantity=2, price=drug.price)
+                for order in created for drug in drugs
+            ])
+            payload = represent_orders(OrderModel.objects.filter(user=buyer))
+            transaction.set_rollback(True)
+        return payload
+
+    def compare(self, name, data, iterations):
+        body = JSONRenderer().render(data)
+        if FastJSONRenderer().render(data) != body:
+            raise CommandError(f'The renderers disagree on the {name} payload.')
+        results = []
+        for classes in ((JSONRenderer, FastJSONRenderer), (JSONParser, FastJSONParser)):
+            if classes[0] is JSONParser:
+                timings = [self.best(iterations, lambda: cls().parse(io.BytesIO(body))) for cls in classes]
+            else:
+                timings = [self.best(iterations, lambda: cls().render(data)) for cls in classes]
+            results.append(f'{classes[0].__name__} {timings[0]:.3f} ms, {classes[1].__name__} {timings[1]:.3f} ms '
+                           f'({timings[0] / timings[1]:.1f}x)')
+        self.stdout.write(f'{name} ({len(body) / 1024:.0f} KB):\n  ' + '\n  '.join(results))
+
+    def handle(self, *args, **options):
+        self.compare('drug list page', self.drug_page(options['page_size']), options['iterations'])
+        orders = self.order_list(options['orders'], options['items'])
+        self.compare('order list', orders, options['iterations'])
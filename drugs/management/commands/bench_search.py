@@ -0,0 +1,69 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from drugs.importer import write_batch
+from drugs.models import Drug
+from drugs.search import search, SEARCH_FIELDS
+from drugs.synthetic import Vocabulary
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Measures drug search latency, optionally filling the catalog with synthetic drugs first. Do not run against production data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drugs', type=int, default=0, help='Make sure the catalog has at least this many drugs.')
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def populate(self, count, rng):
+        seller, _ = CustomUser.objects.get_or_create(
+            username='bench-seller', defaults={'phone': '+000000000000', 'role': 'seller', 'business_name': 'Bench'},
+        )
+        vocabulary = Vocabulary(rng)
+        for start in range(0, count, 5000):
+            write_batch([vocabulary.drug(rng) for _ in range(min(5000, count - start))], seller)
+            self.stdout.write(f'  {min(start + 5000, count)}/{count} drugs created', ending='\r')
+        self.stdout.write('')
+
+    def sample_queries(self, count, rng):
+        rows = list(Drug.objects.order_by('?').values(*SEARCH_FIELDS)[:count])
+        queries = []
+        for row in rows:
+            kind = rng.random()
+            name = row['drug_name'].split()[0].lower()
+            if kind < 0.4:
+                queries.append(name)
+            elif kind < 0.7:
+                queries.append(name[:rng.randint(3, max(3, len(name) - 1))])
+            elif kind < 0.9:
+                queries.append(f"{row['brand']} {row['active_substance'][:4]}".lower())
+            else:
+                queries.append(f"{row['category']} {name}".lower())
+        return queries
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        missing = options['drugs'] - Drug.objects.count()
+        if missing > 0:
+            self.stdout.write(f'Creating {missing} synthetic drugs...')
+            self.populate(missing, rng)
+
+        queries = self.sample_queries(options['queries'], rng)
+        if not queries:
+            self.stdout.write(self.style.WARNING('The catalog is empty, nothing to measure.'))
+            return
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            search(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        quantiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+        self.stdout.write(
+            f'{Drug.objects.count()} drugs, {len(timings)} queries: '
+            f'p50 {quantiles[49]:.2f} ms, p95 {quantiles[94]:.2f} ms, p99 {quantiles[98]:.2f} ms, max {timings[-1]:.2f} ms'
+        )
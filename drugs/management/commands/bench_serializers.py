@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from drugs import representation
+from drugs.models import Drug
+from drugs.serializers import DrugSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compares DrugSerializer with the .values() based representation on the first N drugs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5, help='The best of this many runs is reported.')
+
+    def best(self, repeat, function):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            timings.append((time.perf_counter() - start) * 1000)
+        return min(timings), result
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        drugs = Drug.objects.order_by('id')[:rows]
+        instances = list(drugs)
+        if len(instances) < rows:
+            raise CommandError(f'Only {len(instances)} drugs in the catalog; import more or pass a smaller --rows.')
+        values = list(drugs.values(*representation.drugs.columns))
+
+        serializer, expected = self.best(repeat, lambda: DrugSerializer(instances, many=True).data)
+        fast, data = self.best(repeat, lambda: representation.drugs.many(values))
+        if [dict(item) for item in expected] != data:
+            raise CommandError('The fast representation does not match DrugSerializer.')
+        self.stdout.write(f'serialize {rows} drugs:       DrugSerializer {serializer:8.1f} ms, '
+                          f'values rows {fast:8.1f} ms ({serializer / fast:.1f}x)')
+
+        serializer, _ = self.best(repeat, lambda: DrugSerializer(list(drugs), many=True).data)
+        fast, _ = self.best(repeat, lambda: representation.drugs.many(drugs.values(*representation.drugs.columns)))
+        self.stdout.write(f'query and serialize:        DrugSerializer {serializer:8.1f} ms, '
+                          f'values rows {fast:8.1f} ms ({serializer / fast:.1f}x)')
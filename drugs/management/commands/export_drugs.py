@@ -0,0 +1,39 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from drugs import export
+
+
+class Command(BaseCommand):
+    help = 'Streams the drug catalog to a CSV or NDJSON file without loading it into memory.'
+    columns = export.DRUG_COLUMNS
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Output file, or - for standard output.')
+        parser.add_argument('--output', choices=export.FORMATS, default='csv')
+        parser.add_argument('--seller', help='Only export rows of this seller (user id).')
+        parser.add_argument('--created-after', help='YYYY-MM-DD, inclusive.')
+        parser.add_argument('--created-before', help='YYYY-MM-DD, inclusive.')
+
+    def rows(self, seller_id, lookups):
+        return export.drug_rows(seller_id, **lookups)
+
+    def handle(self, *args, **options):
+        try:
+            seller_id = export.parse_seller(options)
+            lookups = export.parse_date_range(options)
+        except export.InvalidExport as e:
+            raise CommandError(str(e))
+        path = options['path']
+        out = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        started = time.perf_counter()
+        try:
+            for chunk in export.encode_rows(self.columns, self.rows(seller_id, lookups), options['output']):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if out is not sys.stdout:
+            self.stdout.write(self.style.SUCCESS(f'Exported to {path} in {time.perf_counter() - started:.2f}s.'))
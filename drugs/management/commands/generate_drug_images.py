@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from drugs import images
+from drugs.models import Drug
+
+
+class Command(BaseCommand):
+    help = 'Creates the thumbnails and compressed variants of drug images that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Process every drug, not only those without variants.')
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        drugs = Drug.objects.exclude(image='')
+        if not options['all']:
+            drugs = drugs.filter(image_variants={})
+        # Drugs often share an image (the default one at least), so work per distinct file rather than per drug.
+        names = list(drugs.order_by().values_list('image', flat=True).distinct())
+
+        def process(name):
+            try:
+                return images.process_image(name, only_missing=not options['all'])
+            finally:
+                close_old_connections()
+
+        started = time.perf_counter()
+        if options['workers'] <= 1:
+            updated = sum(images.process_image(name, only_missing=not options['all']) for name in names)
+        else:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                updated = sum(executor.map(process, names))
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {len(names)} images for {updated} drugs in {time.perf_counter() - started:.2f}s.'
+        ))
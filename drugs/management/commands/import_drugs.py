@@ -0,0 +1,61 @@
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from drugs.importer import check_utf8, import_drugs, FORMATS
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Imports drugs for a seller from a CSV or JSON lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for standard input.')
+        parser.add_argument('--seller', required=True, help='Username of the seller that owns the drugs.')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--errors', help='Write rejected rows to this CSV file (line, field, message).')
+
+    def handle(self, *args, **options):
+        try:
+            seller = CustomUser.objects.get(username=options['seller'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"Seller {options['seller']!r} does not exist.")
+        if seller.role not in ('seller', 'admin'):
+            raise CommandError(f"{seller.username!r} is a {seller.role}, not a seller.")
+
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        if path != '-':
+            with open(path, 'rb') as file:
+                try:
+                    check_utf8(file)
+                except UnicodeDecodeError as e:
+                    raise CommandError(f'{path} is not UTF-8 encoded: {e}')
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        report = open(options['errors'], 'w', newline='', encoding='utf-8') if options['errors'] else None
+        writer = csv.writer(report) if report else None
+
+        def on_error(line, errors):
+            if writer:
+                for field, message in errors.items():
+                    writer.writerow([line, field, message])
+            elif self.verbosity > 1:
+                self.stderr.write(f'line {line}: {json.dumps(errors)}')
+
+        try:
+            if writer:
+                writer.writerow(['line', 'field', 'message'])
+            result = import_drugs(stream, seller, fmt=fmt, batch_size=options['batch_size'], on_error=on_error)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if report:
+                report.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.created} drugs imported, {result.failed} rows rejected, '
+            f'{result.rows} rows in {result.elapsed:.2f}s ({result.rows_per_second:.0f} rows/s).'
+        ))
@@ -0,0 +1,17 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from drugs import changes
+
+
+class Command(BaseCommand):
+    help = 'Deletes catalog changes older than the given number of days. Clients further behind must resync.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+
+    def handle(self, *args, **options):
+        deleted = changes.prune(timezone.now() - datetime.timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} changes.'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from drugs import facets
+from drugs.models import DrugFacetCount
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the drug facet counts from the catalog.'
+
+    def handle(self, *args, **options):
+        facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Stored {DrugFacetCount.objects.count()} facet values.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from drugs.models import DrugSearchToken
+from drugs.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the drug search token index from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {DrugSearchToken.objects.count()} search tokens.'))
@@ -0,0 +1,39 @@
+import sqlite3
+import time
+from contextlib import closing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = ('Copies the SQLite primary into the SQLite replicas of DATABASE_REPLICA_URLS, to try replica routing '
+            'locally. The copy is a consistent snapshot made with the SQLite backup API.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Copy again every this many seconds, which plays the replication lag; 0 copies once.')
+
+    def handle(self, *args, **options):
+        aliases = ['default', *settings.DATABASE_REPLICAS]
+        if len(aliases) == 1:
+            raise CommandError('No replicas configured; set DATABASE_REPLICA_URLS.')
+        for alias in aliases:
+            if connections[alias].vendor != 'sqlite' or connections[alias].is_in_memory_db():
+                raise CommandError(f'Database {alias!r} is not an SQLite file.')
+        primary = connections['default'].settings_dict['NAME']
+        while True:
+            start = time.monotonic()
+            for alias in settings.DATABASE_REPLICAS:
+                self.copy(primary, connections[alias].settings_dict['NAME'])
+            self.stdout.write(f'Copied to {len(settings.DATABASE_REPLICAS)} replica(s) in '
+                              f'{(time.monotonic() - start) * 1000:.0f} ms.')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def copy(self, source, target):
+        # Into the replica file itself rather than a swapped in new file, which persistent connections would miss.
+        with closing(sqlite3.connect(source)) as src, closing(sqlite3.connect(target, timeout=30)) as dst:
+            src.backup(dst)
@@ -0,0 +1,65 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:48
+
+import re
+
+import django.db.models.deletion
+
+from django.db import migrations, models
+
+# A copy of drugs.search as of this migration, so that later changes to the search code do not change it.
+SEARCH_FIELDS = {
+    'drug_name': 8,
+    'active_substance': 4,
+    'brand': 4,
+    'manufacturer': 2,
+    'category': 1,
+}
+TOKEN_MAX_LENGTH = 100
+BATCH_SIZE = 1000
+
+_token_re = re.compile(r'\w+')
+
+
+def tokens_for(values):
+    weights = {}
+    for field, weight in SEARCH_FIELDS.items():
+        for token in {token[:TOKEN_MAX_LENGTH] for token in _token_re.findall((values.get(field) or '').lower())}:
+            weights[token] = weights.get(token, 0) + weight
+    return weights
+
+
+def index_existing_drugs(apps, schema_editor):
+    Drug = apps.get_model('drugs', 'Drug')
+    DrugSearchToken = apps.get_model('drugs', 'DrugSearchToken')
+    batch = []
+    for row in Drug.objects.values('id', *SEARCH_FIELDS).iterator(chunk_size=BATCH_SIZE):
+        batch.extend(
+            DrugSearchToken(drug_id=row['id'], token=token, weight=weight) for token, weight in tokens_for(row).items()
+        )
+        if len(batch) >= BATCH_SIZE:
+            DrugSearchToken.objects.bulk_create(batch)
+            batch = []
+    DrugSearchToken.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DrugSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=100)),
+                ('weight', models.PositiveSmallIntegerField(default=1)),
+                ('drug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='drugs.drug')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'drug', 'weight'], name='drugs_drugs_token_986cfe_idx')],
+            },
+        ),
+        migrations.RunPython(index_existing_drugs, migrations.RunPython.noop),
+    ]
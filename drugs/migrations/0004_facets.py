@@ -0,0 +1,69 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:53
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+FACETS = ['category', 'type', 'manufacturer_country', 'brand']
+
+
+def count_existing_facets(apps, schema_editor):
+    Drug = apps.get_model('drugs', 'Drug')
+    DrugFacetCount = apps.get_model('drugs', 'DrugFacetCount')
+    DrugFacetCount.objects.bulk_create([
+        DrugFacetCount(facet=facet, value=row[facet], count=row['count'])
+        for facet in FACETS
+        for row in Drug.objects.order_by().values(facet).annotate(count=Count('id'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0003_drugsearchtoken'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DrugFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('category', 'Category'), ('type', 'Type'), ('manufacturer_country', 'Manufacturer country'), ('brand', 'Brand')], max_length=30)),
+                ('value', models.CharField(max_length=100)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['facet', 'value'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['category', 'created_at'], name='drugs_drug_categor_523656_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['type', 'created_at'], name='drugs_drug_type_5902d3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['manufacturer_country', 'created_at'], name='drugs_drug_manufac_6ab125_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['brand', 'created_at'], name='drugs_drug_brand_59cf2c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['price'], name='drugs_drug_price_fc0d78_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['expiration_date'], name='drugs_drug_expirat_85818f_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='drugfacetcount',
+            constraint=models.UniqueConstraint(fields=('facet', 'value'), name='unique_drug_facet_value'),
+        ),
+        migrations.RunPython(count_existing_facets, migrations.RunPython.noop),
+    ]
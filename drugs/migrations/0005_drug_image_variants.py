@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0004_facets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drug',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
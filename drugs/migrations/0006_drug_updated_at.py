@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-18 16:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_created_at(apps, schema_editor):
+    Drug = apps.get_model('drugs', 'Drug')
+    Drug.objects.update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0005_drug_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drug',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0007_drugchange'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['created_at', 'id'], name='drugs_drug_created_26c0a5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['seller', 'created_at'], name='drugs_drug_seller__409e3a_idx'),
+        ),
+        # The seller index is dropped only once the composite index replacing it exists.
+        migrations.AlterField(
+            model_name='drug',
+            name='seller',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -6,7 +6,10 @@ class Drug(models.Model):
     description = models.TextField(blank=False,)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='images/drugs', default='images/drugs/default.jpg')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Queryset updates bypass auto_now, so they set it themselves.
+    updated_at = models.DateTimeField(auto_now=True)
     quantity = models.IntegerField(default=0)
     expiration_date = models.DateField(blank=False,)
     brand = models.CharField(max_length=100)
@@ -16,10 +19,83 @@ class Drug(models.Model):
     active_substance = models.CharField(max_length=100)
     type = models.CharField(max_length=100)
     dozens = models.IntegerField(default=0, blank=False,)
-    seller = models.ForeignKey('users.CustomUser', on_delete=models.CASCADE)
+    # Indexed by (seller, created_at) below, which serves seller lookups as well.
+    seller = models.ForeignKey('users.CustomUser', on_delete=models.CASCADE, db_index=False)
 
     def __str__(self):
         return self.drug_name
     
     class Meta:
-        ordering = ['created_at']
\ No newline at end of file
+        ordering = ['created_at']
+        indexes = [
+            # The keyset pagination order, unfiltered and per seller.
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['seller', 'created_at']),
+            models.Index(fields=['category', 'created_at']),
+            models.Index(fields=['type', 'created_at']),
+            models.Index(fields=['manufacturer_country', 'created_at']),
+            models.Index(fields=['brand', 'created_at']),
+            models.Index(fields=['price']),
+            models.Index(fields=['expiration_date']),
+        ]
+
+class DrugSearchToken(models.Model):
+    token = models.CharField(max_length=100)
+    drug = models.ForeignKey(Drug, related_name='search_tokens', on_delete=models.CASCADE)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    def __str__(self):
+        return f'{self.token} -> {self.drug_id}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['token', 'drug', 'weight']),
+        ]
+
+
+class DrugFacetCount(models.Model):
+    FACET_CHOICES = [
+        ('category', 'Category'),
+        ('type', 'Type'),
+        ('manufacturer_country', 'Manufacturer country'),
+        ('brand', 'Brand'),
+    ]
+
+    facet = models.CharField(max_length=30, choices=FACET_CHOICES)
+    value = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.facet}={self.value}: {self.count}'
+
+    class Meta:
+        ordering = ['facet', 'value']
+        constraints = [
+            models.UniqueConstraint(fields=['facet', 'value'], name='unique_drug_facet_value'),
+        ]
+
+
+class DrugChange(models.Model):
+    """
+    Append-only log of catalog writes; the id is the sequence number clients sync from. drug_id is not a foreign
+    key, so the tombstones of deleted drugs stay.
+    """
+    ACTION_CREATED = 'created'
+    ACTION_UPDATED = 'updated'
+    ACTION_DELETED = 'deleted'
+
+    ACTION_CHOICES = [
+        (ACTION_CREATED, 'Created'),
+        (ACTION_UPDATED, 'Updated'),
+        (ACTION_DELETED, 'Deleted'),
+    ]
+
+    drug_id = models.IntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    changed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'#{self.pk} {self.action} drug {self.drug_id}'
+
+    class Meta:
+        ordering = ['id']
@@ -0,0 +1,55 @@
+import base64
+import binascii
+import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(created_at, pk):
+    raw = f'{created_at.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split('|')
+        return datetime.datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor('Invalid cursor.')
+
+
+def get_page_size(value, default=None, maximum=None):
+    if value in (None, ''):
+        return default or settings.DRUGS_PAGE_SIZE
+    page_size = int(value)
+    if page_size < 1:
+        raise ValueError('Page size must be a positive integer.')
+    return min(page_size, maximum or settings.DRUGS_MAX_PAGE_SIZE)
+
+
+class KeysetPaginator:
+    """
+    Pages through a queryset ordered by (created_at, id), the same order as Drug.Meta.ordering.
+    Each page is a single indexed range query, so its cost does not depend on how deep the page is.
+    """
+
+    def __init__(self, queryset, page_size):
+        self.queryset = queryset.order_by('created_at', 'id')
+        self.page_size = page_size
+
+    def paginate(self, cursor=None):
+        queryset = self.queryset
+        if cursor:
+            created_at, pk = decode_cursor(cursor)
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+        rows = list(queryset[:self.page_size + 1])
+        has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].pk) if has_next else None
+        return rows, next_cursor
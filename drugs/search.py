@@ -0,0 +1,100 @@
+import re
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, When
+
+from .models import Drug, DrugSearchToken
+
+# Field -> weight of a token found in it. A token found in several fields gets the sum.
+SEARCH_FIELDS = {
+    'drug_name': 8,
+    'active_substance': 4,
+    'brand': 4,
+    'manufacturer': 2,
+    'category': 1,
+}
+MAX_QUERY_TERMS = 8
+# A token equal to the last, incomplete term counts this many times its weight, so "para" ranks "Para" first.
+EXACT_MATCH_BOOST = 2
+TOKEN_MAX_LENGTH = DrugSearchToken._meta.get_field('token').max_length
+
+_token_re = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return [token[:TOKEN_MAX_LENGTH] for token in _token_re.findall(text.lower())]
+
+
+def tokens_for(values):
+    """Maps every token of a drug to its weight; values is a dict (or row) with the SEARCH_FIELDS keys."""
+    weights = {}
+    for field, weight in SEARCH_FIELDS.items():
+        for token in set(tokenize(values.get(field) or '')):
+            weights[token] = weights.get(token, 0) + weight
+    return weights
+
+
+def build_tokens(drug_rows):
+    return [
+        DrugSearchToken(drug_id=row['id'], token=token, weight=weight)
+        for row in drug_rows
+        for token, weight in tokens_for(row).items()
+    ]
+
+
+def index_drugs(drugs):
+    rows = [{'id': drug.pk, **{field: getattr(drug, field) for field in SEARCH_FIELDS}} for drug in drugs]
+    with transaction.atomic():
+        DrugSearchToken.objects.filter(drug_id__in=[row['id'] for row in rows]).delete()
+        DrugSearchToken.objects.bulk_create(build_tokens(rows), batch_size=1000)
+
+
+def rebuild_index(batch_size=2000):
+    DrugSearchToken.objects.all().delete()
+    batch = []
+    for row in Drug.objects.values('id', *SEARCH_FIELDS).iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) == batch_size:
+            DrugSearchToken.objects.bulk_create(build_tokens(batch), batch_size=1000)
+            batch = []
+    DrugSearchToken.objects.bulk_create(build_tokens(batch), batch_size=1000)
+
+
+def parse_query(query):
+    terms = list(dict.fromkeys(tokenize(query)))
+    return terms[:MAX_QUERY_TERMS]
+
+
+def _prefix_q(prefix):
+    # A range instead of LIKE 'prefix%' so every backend can answer it from the token index.
+    return Q(token__gte=prefix, token__lt=prefix + '\uffff')
+
+
+def search(query, offset=0, limit=20):
+    """
+    Returns up to limit + 1 drug ids matching every term of the query, best match first. All terms but the
+    last must match a whole token; the last one is matched as a prefix so results follow the user's typing.
+    """
+    terms = parse_query(query)
+    if not terms:
+        return []
+    *words, prefix = terms
+    conditions = [Q(token=word) for word in words] + [_prefix_q(prefix)]
+    condition = conditions[0]
+    for other in conditions[1:]:
+        condition |= other
+    # Counted per term, since one token can match several terms, e.g. "para" matches both "para" and "par".
+    term_counts = {f'term_{i}': Count('pk', filter=term) for i, term in enumerate(conditions)}
+    matches = (
+        DrugSearchToken.objects.filter(condition)
+        .values('drug_id')
+        .annotate(
+            **term_counts,
+            score=Sum(Case(
+                When(token=prefix, then=F('weight') * EXACT_MATCH_BOOST), default=F('weight'), output_field=IntegerField(),
+            )),
+        )
+        .filter(**{f'{name}__gt': 0 for name in term_counts})
+        .order_by('-score', 'drug_id')
+    )
+    return list(matches.values_list('drug_id', flat=True)[offset:offset + limit + 1])
@@ -1,13 +1,15 @@
-import datetime
-import decimal
 from rest_framework import serializers
+from .images import variant_urls
 from .models import Drug
+from .validators import check_expiration_date, check_price, check_image, check_count, check_letters
 
 
 class DrugSerializer(serializers.ModelSerializer):
+    images = serializers.SerializerMethodField()
+
     class Meta:
         model = Drug
-        fields = ('id', 'drug_name', 'description', 'price', 'image', 'created_at', 'quantity', 'category', 'manufacturer_country', 'manufacturer', 'active_substance', 'type', 'dozens', 'expiration_date', 'brand', 'seller')
+        fields = ('id', 'drug_name', 'description', 'price', 'image', 'images', 'created_at', 'updated_at', 'quantity', 'category', 'manufacturer_country', 'manufacturer', 'active_substance', 'type', 'dozens', 'expiration_date', 'brand', 'seller')
         extra_kwargs = {
             'id': {'read_only': True},
             'drug_name': {'required': True},
@@ -15,6 +17,7 @@ class DrugSerializer(serializers.ModelSerializer):
             'price': {'required': True},
             'image': {'required': True},
             'created_at': {'read_only': True},
+            'updated_at': {'read_only': True},
             'quantity': {'required': True},
             'category': {'required': True},
             'manufacturer_country': {'required': True},
@@ -27,61 +30,38 @@ class DrugSerializer(serializers.ModelSerializer):
             'seller': {'read_only': True},
         }
 
+    def get_images(self, obj):
+        return variant_urls(obj.image_variants)
+
     def validate_expiration_date(self, value):
-        if value < datetime.date.today():
-            raise serializers.ValidationError("Expiration date must be greater than today.")
-        return value
+        return check_expiration_date(value)
     
 
     def validate_price(self, value):
-        if not isinstance(value, decimal.Decimal):
-            raise serializers.ValidationError("Price must be a number.")
-        if value < 0:
-            raise serializers.ValidationError("Price must be greater than 0.")
-        return value
+        return check_price(value)
     
 
     def validate_image(self, value):
-        IMAGE_FILE_TYPES = ['png', 'jpg', 'jpeg']
-        IMAGE_MAX_SIZE = 5242880
-        if not value.name.endswith(tuple(IMAGE_FILE_TYPES)):
-            raise serializers.ValidationError("Image must be a PNG, JPG, or JPEG file.")
-        if value.size > IMAGE_MAX_SIZE:
-            raise serializers.ValidationError("Image must be less than 5MB.")
-        return value
+        return check_image(value)
     
     
     def validate_quantity(self, value):
-        if not isinstance(value, int):
-            raise serializers.ValidationError("Quantity must be an integer.")
-        if value < 0:
-            raise serializers.ValidationError("Quantity must be greater than 0.")
-        return value
+        return check_count(value, 'Quantity')
     
 
     def validate_dozens(self, value):
-        if not isinstance(value, int):
-            raise serializers.ValidationError("Dozens must be an integer.")
-        if value < 0:
-            raise serializers.ValidationError("Dozens must be greater than 0.")
-        return value
+        return check_count(value, 'Dozens')
     
 
     def validate_manufacturer_country(self, value):
-        if not value.isalpha():
-            raise serializers.ValidationError("Manufacturer country must contain only letters.")
-        return value   
+        return check_letters(value, 'Manufacturer country')   
     
 
     def validate_manufacturer(self, value):
-        if not value.isalpha():
-            raise serializers.ValidationError("Manufacturer must contain only letters.")
-        return value
+        return check_letters(value, 'Manufacturer')
 
     def validate_category(self, value):
-        if not value.isalpha():
-            raise serializers.ValidationError("Category must contain only letters.")
-        return value
+        return check_letters(value, 'Category')
 
     def create(self, validated_data):
         drug = Drug.objects.create(**validated_data)
@@ -116,61 +96,35 @@ class DrugUpdateSerializer(serializers.ModelSerializer):
         }
 
     def validate_price(self, value):
-        if not isinstance(value, decimal.Decimal):
-            raise serializers.ValidationError("Price must be a number.")
-        if value < 0:
-            raise serializers.ValidationError("Price must be greater than 0.")
-        return value
+        return check_price(value)
     
 
     def validate_image(self, value):
-        IMAGE_FILE_TYPES = ['png', 'jpg', 'jpeg']
-        IMAGE_MAX_SIZE = 5242880
-        if not value.name.endswith(tuple(IMAGE_FILE_TYPES)):
-            raise serializers.ValidationError("Image must be a PNG, JPG, or JPEG file.")
-        if value.size > IMAGE_MAX_SIZE:
-            raise serializers.ValidationError("Image must be less than 5MB.")
-        return value
+        return check_image(value)
     
 
     def validate_quantity(self, value):
-        if not isinstance(value, int):
-            raise serializers.ValidationError("Quantity must be an integer.")
-        if value < 0:
-            raise serializers.ValidationError("Quantity must be greater than 0.")
-        return value
+        return check_count(value, 'Quantity')
     
 
     def validate_dozens(self, value):
-        if not isinstance(value, int):
-            raise serializers.ValidationError("Dozens must be an integer.")
-        if value < 0:
-            raise serializers.ValidationError("Dozens must be greater than 0.")
-        return value
+        return check_count(value, 'Dozens')
     
 
     def validate_manufacturer_country(self, value):
-        if not value.isalpha():
-            raise serializers.ValidationError("Manufacturer country must contain only letters.")
-        return value
+        return check_letters(value, 'Manufacturer country')
     
 
     def validate_manufacturer(self, value):
-        if not value.isalpha():
-            raise serializers.ValidationError("Manufacturer must contain only letters.")
-        return value
+        return check_letters(value, 'Manufacturer')
     
 
     def validate_expiration_date(self, value):
-        if value < datetime.date.today():
-            raise serializers.ValidationError("Expiration date must be greater than today.")
-        return value
+        return check_expiration_date(value)
     
 
     def validate_category(self, value):
-        if not value.isalpha():
-            raise serializers.ValidationError("Category must contain only letters.")
-        return value
+        return check_letters(value, 'Category')
     
 
     def update(self, instance, validated_data):
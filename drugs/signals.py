@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver, Signal
+
+from . import changes, facets, fragments, images
+from .cache import bump, drug_namespaces, seller_namespace, category_namespace
+from .models import Drug, DrugChange
+from .search import index_drugs
+
+# Sent with drugs=[...] after queryset updates that bypass post_save, e.g. the stock decrement at checkout. Those
+# record their DrugChange rows themselves, inside the transaction of the update.
+drugs_updated = Signal()
+
+
+@receiver(pre_save, sender=Drug)
+def remember_previous_drug(sender, instance, **kwargs):
+    instance._previous = None
+    if not instance._state.adding and instance.pk:
+        instance._previous = Drug.objects.filter(pk=instance.pk).values('seller_id', 'image', *facets.FACETS).first()
+
+
+# Versions are bumped after the commit: bumped before it, a request could still read the old rows and cache them
+# under the new version.
+@receiver(post_save, sender=Drug)
+def invalidate_saved_drug(sender, instance, **kwargs):
+    namespaces = drug_namespaces(instance)
+    previous = getattr(instance, '_previous', None)
+    if previous:
+        namespaces += [seller_namespace(previous['seller_id']), category_namespace(previous['category'])]
+    transaction.on_commit(lambda: bump(*namespaces))
+
+
+@receiver(post_save, sender=Drug)
+def reindex_saved_drug(sender, instance, **kwargs):
+    index_drugs([instance])
+
+
+@receiver(post_save, sender=Drug)
+def count_saved_drug_facets(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_previous', None)
+    facets.apply(facets.diff(previous, facets.facet_values(instance)))
+
+
+@receiver(post_save, sender=Drug)
+def render_saved_drug(sender, instance, **kwargs):
+    transaction.on_commit(lambda: fragments.store([instance]))
+
+
+@receiver(post_save, sender=Drug)
+def process_saved_drug_image(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_previous', None)
+    if not instance.image or instance.image.name == Drug._meta.get_field('image').default:
+        return
+    if previous is None or previous['image'] != instance.image.name:
+        transaction.on_commit(lambda: images.enqueue([instance.pk]))
+
+
+@receiver(post_save, sender=Drug)
+def log_saved_drug(sender, instance, created, **kwargs):
+    changes.record([instance.pk], DrugChange.ACTION_CREATED if created else DrugChange.ACTION_UPDATED)
+
+
+@receiver(post_delete, sender=Drug)
+def invalidate_deleted_drug(sender, instance, **kwargs):
+    namespaces = drug_namespaces(instance)
+    transaction.on_commit(lambda: bump(*namespaces))
+
+
+@receiver(post_delete, sender=Drug)
+def count_deleted_drug_facets(sender, instance, **kwargs):
+    facets.apply(facets.diff(facets.facet_values(instance), None))
+
+
+@receiver(post_delete, sender=Drug)
+def log_deleted_drug(sender, instance, **kwargs):
+    changes.record([instance.pk], DrugChange.ACTION_DELETED)
+
+
+@receiver(drugs_updated)
+def invalidate_updated_drugs(sender, drugs, **kwargs):
+    namespaces = [namespace for drug in drugs for namespace in drug_namespaces(drug)]
+    transaction.on_commit(lambda: bump(*namespaces))
@@ -0,0 +1,43 @@
+import datetime
+from decimal import Decimal
+
+SYLLABLES = ['am', 'ox', 'ci', 'lin', 'par', 'ce', 'ta', 'mol', 'ibu', 'pro', 'fen', 'lo', 'ra', 'ti', 'dine', 'met',
+             'for', 'min', 'aze', 'tro', 'my', 'cin', 'vas', 'sta', 'tin', 'zol', 'pam', 'dol', 'neo', 'flu']
+COUNTRIES = ['Uzbekistan', 'Germany', 'India', 'France', 'Switzerland', 'Turkey', 'Korea', 'Hungary']
+TYPES = ['Tablet', 'Capsule', 'Syrup', 'Injection', 'Ointment', 'Drops']
+
+
+def word(rng, syllables):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(syllables)).capitalize()
+
+
+class Vocabulary:
+    """
+    Synthetic catalog values for benchmarks. Names, substances, brands, manufacturers and categories come from
+    fixed size pools, so filters and searches match realistic numbers of drugs whatever the catalog size.
+    """
+
+    def __init__(self, rng):
+        self.names = [word(rng, 3) for _ in range(20000)]
+        self.substances = [word(rng, 4) for _ in range(2000)]
+        self.brands = [word(rng, 2) for _ in range(500)]
+        self.manufacturers = [word(rng, 2) for _ in range(200)]
+        self.categories = [word(rng, 3) for _ in range(40)]
+
+    def drug(self, rng, today=None):
+        """The field values of one drug, as drugs.importer.validate_row() returns them."""
+        today = today or datetime.date.today()
+        return {
+            'drug_name': f'{rng.choice(self.names)} {rng.randint(1, 1000)}',
+            'description': 'Synthetic drug.',
+            'price': Decimal(rng.randint(100, 100000)) / 100,
+            'quantity': rng.randint(1000, 100000),
+            'expiration_date': today + datetime.timedelta(days=rng.randint(30, 1500)),
+            'brand': rng.choice(self.brands),
+            'category': rng.choice(self.categories),
+            'manufacturer_country': rng.choice(COUNTRIES),
+            'manufacturer': rng.choice(self.manufacturers),
+            'active_substance': rng.choice(self.substances),
+            'type': rng.choice(TYPES),
+            'dozens': rng.randint(1, 10),
+        }
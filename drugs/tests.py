@@ -1,3 +1,1058 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import re
+import tempfile
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, router
+from django.http import HttpResponse
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from pharmacy_marketplce import cache_backends, metrics
+from pharmacy_marketplce.async_views import async_reads
+from pharmacy_marketplce.cache_backends import TwoTierCache
+from pharmacy_marketplce.databases import database_config
+from pharmacy_marketplce.parsers import FastJSONParser
+from pharmacy_marketplce.renderers import FastJSONRenderer
+from pharmacy_marketplce.replicas import ReplicaReadsMiddleware, cache_timeout, reading_from
+from users.models import CustomUser
+from . import async_views, cache as catalog_cache, export, facets, fragments, images, representation
+from .importer import import_drugs
+from .models import Drug, DrugChange
+from .pagination import encode_cursor, decode_cursor, InvalidCursor
+from .serializers import DrugSerializer
+from .views import DrugDetailView, DrugGetCategoriesView, ListDrugView
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'tiered': {
+        'BACKEND': 'pharmacy_marketplce.cache_backends.TwoTierCache',
+        'LOCATION': 'default',
+    },
+}
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def clear_caches():
+    # Clearing "default" alone would leave the in-process tier of "tiered" in place.
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+def create_seller(username='seller', phone='+998900000001'):
+    return CustomUser.objects.create_user(
+        username=username, password='secret-pass', phone=phone, role='seller', business_name='Pharma',
+    )
+
+
+def create_drug(seller, **kwargs):
+    data = {
+        'drug_name': 'Aspirin',
+        'description': 'Pain reliever and fever reducer.',
+        'price': Decimal('5.99'),
+        'quantity': 50,
+        'expiration_date': datetime.date.today() + datetime.timedelta(days=365),
+        'brand': 'Bayer',
+        'category': 'Analgesic',
+        'manufacturer_country': 'Germany',
+        'manufacturer': 'Bayer',
+        'active_substance': 'Acetylsalicylic Acid',
+        'type': 'Tablet',
+        'dozens': 10,
+        'seller': seller,
+    }
+    data.update(kwargs)
+    return Drug.objects.create(**data)
+
+
+class QueryPlanAssertionsMixin:
+    """
+    Fails when a query a URL issues reads a whole table, or sorts the rows it found instead of reading them in
+    index order. The plans are SQLite's EXPLAIN QUERY PLAN of the queries the view actually ran, uncached.
+    """
+
+    def query_plans(self, url):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plans are checked on SQLite.')
+        clear_caches()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200, url)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                if query['sql'].startswith('SELECT'):
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plans.append((query['sql'], [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+    def ordered_walk(self, sql, table, line):
+        """
+        Whether this scan reads `table` in its query's ORDER BY order, through an index or by integer primary key,
+        and stops at the LIMIT, e.g. the first page of the catalog.
+        """
+        order_by = re.search(r' ORDER BY (.*?)(?: LIMIT |$)', sql)
+        if ' LIMIT ' not in sql or order_by is None:
+            return False
+        ordered = re.findall(rf'"{table}"\."(\w+)"', order_by.group(1))
+        index = re.search(r'USING (?:COVERING )?INDEX (\w+)', line)
+        if index is None:
+            walked = []
+        elif index.group(1).startswith('sqlite_autoindex_'):
+            return False
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(f'PRAGMA index_info("{index.group(1)}")')
+                walked = [row[2] for row in cursor.fetchall()]
+        # Index entries end with the rowid, so an index also walks its ties in primary key order.
+        walked.append('id')
+        return bool(ordered) and ordered == walked[:len(ordered)]
+
+    def assertIndexedPlans(self, url, allow_sort=False, scans=()):
+        """scans names small tables that are meant to be read whole; allow_sort is for range filters."""
+        for sql, plan in self.query_plans(url):
+            sorted_in_memory = any('TEMP B-TREE' in line for line in plan)
+            for line in plan:
+                scan = re.match(r'SCAN (?!CONSTANT ROW)(\w+)', line)
+                if (scan and scan.group(1) not in scans
+                        and (sorted_in_memory or not self.ordered_walk(sql, scan.group(1), line))):
+                    self.fail(f'{url} reads all of {scan.group(1)}: {line}\n{sql}')
+                if 'TEMP B-TREE FOR ORDER BY' in line and not allow_sort:
+                    self.fail(f'{url} sorts its rows: {plan}\n{sql}')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.seller = create_seller()
+
+
+class CursorTests(TestCase):
+    def test_round_trip(self):
+        created_at = datetime.datetime(2024, 6, 5, 12, 28, 1, 123456, tzinfo=datetime.timezone.utc)
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 42)), (created_at, 42))
+
+    def test_garbage_is_rejected(self):
+        for cursor in ('not-a-cursor', '!!!', encode_cursor(datetime.datetime(2024, 1, 1), 1)[:-3]):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+
+class ListDrugViewPaginationTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.drugs = [create_drug(self.seller, drug_name=f'Drug{i}') for i in range(7)]
+
+    def test_walks_whole_catalog_in_order(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'page_size': 3}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get('/drugs/', params)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()['results']), 3)
+            seen.extend(drug['id'] for drug in response.json()['results'])
+            cursor = response.json()['next']
+            if cursor is None:
+                break
+        self.assertEqual(seen, [drug.id for drug in self.drugs])
+
+    def test_page_size_is_capped(self):
+        with self.settings(DRUGS_MAX_PAGE_SIZE=2):
+            response = self.client.get('/drugs/', {'page_size': 100})
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_rejects_bad_parameters(self):
+        self.assertEqual(self.client.get('/drugs/', {'page_size': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/drugs/', {'page_size': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get('/drugs/', {'cursor': 'garbage'}).status_code, 400)
+
+
+class VersionedCacheTests(CatalogTestCase):
+    def test_bump_changes_only_dependent_keys(self):
+        catalog_key = catalog_cache.make_key('drugs-page', [catalog_cache.CATALOG])
+        seller_key = catalog_cache.make_key('seller-drugs', [catalog_cache.seller_namespace(1)])
+        catalog_cache.bump(catalog_cache.CATALOG)
+        self.assertNotEqual(catalog_cache.make_key('drugs-page', [catalog_cache.CATALOG]), catalog_key)
+        self.assertEqual(catalog_cache.make_key('seller-drugs', [catalog_cache.seller_namespace(1)]), seller_key)
+
+    def test_drug_writes_bump_every_namespace(self):
+        drug = create_drug(self.seller)
+        namespaces = catalog_cache.drug_namespaces(drug)
+        before = catalog_cache.get_versions(namespaces)
+        with self.captureOnCommitCallbacks(execute=True):
+            drug.quantity = 10
+            drug.save()
+            # Not before the commit, or a read in between would cache the old rows under the new versions.
+            self.assertEqual(catalog_cache.get_versions(namespaces), before)
+        after = catalog_cache.get_versions(namespaces)
+        self.assertTrue(all(old != new for old, new in zip(before, after)))
+
+    def test_category_change_bumps_old_category(self):
+        drug = create_drug(self.seller, category='Analgesic')
+        old_namespace = catalog_cache.category_namespace('Analgesic')
+        before = catalog_cache.get_versions([old_namespace])
+        with self.captureOnCommitCallbacks(execute=True):
+            drug.category = 'Antibiotic'
+            drug.save()
+        self.assertNotEqual(catalog_cache.get_versions([old_namespace]), before)
+
+    def test_cached_views_see_writes(self):
+        drug = create_drug(self.seller, quantity=5)
+        self.assertEqual(self.client.get(f'/drugs/{drug.pk}/').json()['quantity'], 5)
+        self.assertEqual(self.client.get('/drugs/').json()['results'][0]['quantity'], 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Drug.objects.get(pk=drug.pk).delete()
+        self.assertEqual(self.client.get(f'/drugs/{drug.pk}/').status_code, 404)
+        self.assertEqual(self.client.get('/drugs/').json()['results'], [])
+
+
+class StampedeProtectionTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        catalog_cache.reset_stats()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_hit_after_miss(self):
+        self.assertEqual(catalog_cache.get_or_compute('key', self.compute), 1)
+        self.assertEqual(catalog_cache.get_or_compute('key', self.compute, beta=0), 1)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(catalog_cache.get_stats()['misses'], 1)
+        self.assertEqual(catalog_cache.get_stats()['hits'], 1)
+
+    def test_waiters_get_stale_value_while_locked(self):
+        catalog_cache.get_or_compute('key-v1', self.compute, stale_key='key-stale')
+        catalog_cache.cache.add('lock:key-v2', 1)
+        self.assertEqual(catalog_cache.get_or_compute('key-v2', self.compute, stale_key='key-stale'), 1)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(catalog_cache.get_stats()['stale'], 1)
+
+    def test_waiters_without_stale_value_wait_for_lock_holder(self):
+        catalog_cache.cache.add('lock:key', 1)
+        catalog_cache.cache.set('key', (42, 0.01, float('inf')))
+        self.assertEqual(catalog_cache.get_or_compute('key', self.compute, beta=0), 42)
+        catalog_cache.cache.delete('key')
+        with mock.patch.object(catalog_cache, 'LOCK_MAX_WAIT', 0.1):
+            self.assertEqual(catalog_cache.get_or_compute('key', self.compute), 1)
+        self.assertEqual(catalog_cache.get_stats()['lock_waits'], 1)
+
+    def test_expiring_entry_is_refreshed_early(self):
+        catalog_cache.cache.set('key', ('old', 10.0, 0))
+        self.assertEqual(catalog_cache.get_or_compute('key', self.compute), 1)
+        self.assertEqual(catalog_cache.get_stats()['early_refreshes'], 1)
+
+
+class DrugSearchTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.aspirin = create_drug(self.seller, drug_name='Aspirin Cardio', active_substance='Acetylsalicylic Acid', brand='Bayer')
+        self.aspicam = create_drug(self.seller, drug_name='Aspicam', active_substance='Meloxicam', brand='Egis', manufacturer='Egis')
+        self.ibuprofen = create_drug(self.seller, drug_name='Nurofen', active_substance='Ibuprofen', brand='Reckitt', manufacturer='Reckitt')
+
+    def ids(self, **params):
+        response = self.client.get('/drugs/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [drug['id'] for drug in response.json()['results']]
+
+    def test_prefix_match_is_ranked_by_field_weight(self):
+        self.assertEqual(self.ids(query='asp'), [self.aspirin.pk, self.aspicam.pk])
+        self.assertEqual(self.ids(query='analgesic'), [self.aspirin.pk, self.aspicam.pk, self.ibuprofen.pk])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.ids(query='aspirin card'), [self.aspirin.pk])
+        self.assertEqual(self.ids(query='nurofen asp'), [])
+
+    def test_index_follows_writes(self):
+        self.ibuprofen.drug_name = 'Aspinurofen'
+        self.ibuprofen.save()
+        self.assertIn(self.ibuprofen.pk, self.ids(query='aspin'))
+        self.aspirin.delete()
+        self.assertEqual(self.ids(query='cardio'), [])
+
+    def test_pagination(self):
+        first = self.client.get('/drugs/search/', {'query': 'analgesic', 'page_size': 2}).json()
+        second = self.client.get('/drugs/search/', {'query': 'analgesic', 'page_size': 2, 'page': first['next']}).json()
+        self.assertEqual(len(first['results']), 2)
+        self.assertEqual([drug['id'] for drug in second['results']], [self.ibuprofen.pk])
+        self.assertIsNone(second['next'])
+
+    def test_one_token_can_match_several_terms(self):
+        para = create_drug(self.seller, drug_name='Para')
+        self.assertEqual(self.ids(query='para par'), [para.pk])
+
+    def test_exact_match_is_ranked_first(self):
+        forte = create_drug(self.seller, drug_name='Paracetamol Forte')
+        para = create_drug(self.seller, drug_name='Para')
+        self.assertEqual(self.ids(query='para'), [para.pk, forte.pk])
+
+    def test_empty_query_is_rejected(self):
+        self.assertEqual(self.client.get('/drugs/search/', {'query': ' ?! '}).status_code, 400)
+
+    def test_pages_are_bounded(self):
+        for page in ('0', '99999999999999999999', str(settings.DRUG_SEARCH_MAX_PAGE + 1), 'x'):
+            self.assertEqual(self.client.get('/drugs/search/', {'query': 'asp', 'page': page}).status_code, 400)
+        self.assertEqual(self.ids(query='asp', page=settings.DRUG_SEARCH_MAX_PAGE), [])
+        self.assertEqual(self.ids(query='asp', page_size='99999999999999999999'), [self.aspirin.pk, self.aspicam.pk])
+
+
+class FacetTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.aspirin = create_drug(self.seller, category='Analgesic', brand='Bayer', price=Decimal('5.00'))
+        self.amoxil = create_drug(self.seller, category='Antibiotic', brand='GSK', price=Decimal('12.00'))
+        self.nurofen = create_drug(
+            self.seller, category='Analgesic', brand='Reckitt', price=Decimal('8.00'),
+            expiration_date=datetime.date.today() + datetime.timedelta(days=30),
+        )
+
+    def test_counts_follow_writes(self):
+        self.assertEqual(self.client.get('/drugs/facets/').data['category'], {'Analgesic': 2, 'Antibiotic': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.nurofen.category = 'Antipyretic'
+            self.nurofen.save()
+            self.amoxil.delete()
+            # Until the commit, reads keep the counts cached under the old version.
+            self.assertEqual(self.client.get('/drugs/facets/').data['category'], {'Analgesic': 2, 'Antibiotic': 1})
+        counts = self.client.get('/drugs/facets/').data
+        self.assertEqual(counts['category'], {'Analgesic': 1, 'Antipyretic': 1})
+        self.assertEqual(counts['brand'], {'Bayer': 1, 'Reckitt': 1})
+
+    def test_categories_are_served_from_the_store(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/drugs/categories/').data, ['Analgesic', 'Antibiotic'])
+        with self.assertNumQueries(0):
+            self.client.get('/drugs/categories/')
+
+    def test_rebuild_matches_incremental_counts(self):
+        before = facets.get_counts()
+        facets.rebuild()
+        self.assertEqual(facets.get_counts(), before)
+
+    def test_list_filters(self):
+        def ids(**params):
+            return [drug['id'] for drug in self.client.get('/drugs/', params).json()['results']]
+
+        self.assertEqual(ids(category='Analgesic'), [self.aspirin.pk, self.nurofen.pk])
+        self.assertEqual(ids(category='Analgesic', max_price='6'), [self.aspirin.pk])
+        self.assertEqual(ids(min_price='7.5'), [self.amoxil.pk, self.nurofen.pk])
+        expires_before = (datetime.date.today() + datetime.timedelta(days=60)).isoformat()
+        self.assertEqual(ids(expires_before=expires_before), [self.nurofen.pk])
+
+    def test_bad_filters_are_rejected(self):
+        self.assertEqual(self.client.get('/drugs/', {'min_price': 'cheap'}).status_code, 400)
+        self.assertEqual(self.client.get('/drugs/', {'min_price': 'NaN'}).status_code, 400)
+        self.assertEqual(self.client.get('/drugs/', {'max_price': 'Infinity'}).status_code, 400)
+        self.assertEqual(self.client.get('/drugs/', {'max_price': '1e1000'}).status_code, 200)
+        self.assertEqual(self.client.get('/drugs/', {'expires_after': '31.12.2030'}).status_code, 400)
+
+
+class ImportDrugsTests(CatalogTestCase):
+    header = 'drug_name,description,price,quantity,expiration_date,brand,category,manufacturer_country,manufacturer,active_substance,type,dozens\n'
+
+    def row(self, **overrides):
+        values = {
+            'drug_name': 'Aspirin', 'description': 'Pain reliever.', 'price': '5.99', 'quantity': '50',
+            'expiration_date': (datetime.date.today() + datetime.timedelta(days=365)).isoformat(), 'brand': 'Bayer',
+            'category': 'Analgesic', 'manufacturer_country': 'Germany', 'manufacturer': 'Bayer',
+            'active_substance': 'Acetylsalicylic Acid', 'type': 'Tablet', 'dozens': '10',
+        }
+        values.update(overrides)
+        return ','.join(values[column] for column in self.header.strip().split(',')) + '\n'
+
+    def test_imported_drugs_are_logged_as_changes(self):
+        import_drugs(io.StringIO(self.header + self.row() + self.row(drug_name='Ibuprofen')), self.seller)
+        self.assertEqual(
+            sorted(DrugChange.objects.values_list('drug_id', 'action')),
+            [(pk, 'created') for pk in sorted(Drug.objects.values_list('pk', flat=True))],
+        )
+
+    def test_valid_rows_are_created_and_indexed(self):
+        stream = io.StringIO(self.header + self.row() + self.row(drug_name='Ibuprofen', category='NSAID'))
+        result = import_drugs(stream, self.seller, batch_size=1)
+        self.assertEqual((result.rows, result.created, result.failed), (2, 2, 0))
+        drug = Drug.objects.get(drug_name='Ibuprofen')
+        self.assertEqual(drug.price, Decimal('5.99'))
+        self.assertEqual(drug.seller, self.seller)
+        self.assertEqual(self.client.get('/drugs/search/', {'query': 'ibu'}).json()['results'][0]['id'], drug.pk)
+        self.assertEqual(facets.get_counts()['category'], {'Analgesic': 1, 'NSAID': 1})
+
+    def test_invalid_rows_are_reported_with_serializer_messages(self):
+        errors = {}
+        stream = io.StringIO(
+            self.header
+            + self.row(price='free')
+            + self.row(quantity='-1', category='Pain Reliever')
+            + self.row(expiration_date='2000-01-01')
+            + self.row(drug_name='')
+            + self.row()
+        )
+        result = import_drugs(stream, self.seller, on_error=lambda line, row_errors: errors.update({line: row_errors}))
+        self.assertEqual((result.created, result.failed), (1, 4))
+        self.assertEqual(errors, {
+            2: {'price': 'Price must be a number.'},
+            3: {'quantity': 'Quantity must be greater than 0.', 'category': 'Category must contain only letters.'},
+            4: {'expiration_date': 'Expiration date must be greater than today.'},
+            5: {'drug_name': 'This field is required.'},
+        })
+
+    def test_jsonl(self):
+        rows = [
+            {'drug_name': 'Aspirin', 'description': 'Pain reliever.', 'price': 5.99, 'quantity': 50, 'dozens': 10,
+             'expiration_date': (datetime.date.today() + datetime.timedelta(days=365)).isoformat(),
+             'category': 'Analgesic', 'manufacturer_country': 'Germany', 'manufacturer': 'Bayer',
+             'active_substance': 'Acetylsalicylic Acid'},
+            ['not', 'an', 'object'],
+        ]
+        stream = io.StringIO('\n'.join(json.dumps(row) for row in rows))
+        result = import_drugs(stream, self.seller, fmt='jsonl')
+        self.assertEqual((result.created, result.failed), (1, 1))
+
+    def test_upload_endpoint(self):
+        self.client.force_authenticate(self.seller)
+        upload = SimpleUploadedFile('drugs.csv', (self.header + self.row() + self.row(price='x')).encode())
+        response = self.client.post('/drugs/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 1))
+        self.assertEqual(response.data['errors'], [{'line': 3, 'errors': {'price': 'Price must be a number.'}}])
+
+    def test_image_column_is_ignored(self):
+        header = self.header.replace('dozens\n', 'dozens,image\n')
+        stream = io.StringIO(header + self.row().replace('\n', ',../../etc/passwd\n'))
+        with mock.patch('drugs.images.enqueue') as enqueue:
+            self.assertEqual(import_drugs(stream, self.seller).created, 1)
+        self.assertEqual(Drug.objects.get().image.name, Drug._meta.get_field('image').default)
+        enqueue.assert_not_called()
+
+    def test_file_that_is_not_utf8_imports_nothing(self):
+        self.client.force_authenticate(self.seller)
+        # The bad byte comes after a full batch of valid rows.
+        content = (self.header + self.row() * 2500).encode() + self.row(description='Caf\xe9.').encode('latin-1')
+        upload = SimpleUploadedFile('drugs.csv', content)
+        response = self.client.post('/drugs/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Drug.objects.exists())
+
+    def test_buyers_cannot_import(self):
+        buyer = CustomUser.objects.create_user(username='buyer', password='secret-pass', phone='+998900000009', role='buyer')
+        self.client.force_authenticate(buyer)
+        upload = SimpleUploadedFile('drugs.csv', (self.header + self.row()).encode())
+        self.assertEqual(self.client.post('/drugs/import/', {'file': upload}, format='multipart').status_code, 403)
+
+
+class ExportDrugsTests(CatalogTestCase):
+    def export(self, **params):
+        response = self.client.get('/drugs/export/', params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_seller_exports_own_drugs_as_csv(self):
+        mine = create_drug(self.seller, drug_name='Aspirin, 500mg')
+        create_drug(create_seller('other', '+998900000009'))
+        self.client.force_authenticate(self.seller)
+        lines = self.export().splitlines()
+        self.assertEqual(lines[0].split(','), list(export.DRUG_COLUMNS))
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith(f'{mine.pk},"Aspirin, 500mg",'))
+
+    def test_admin_filters_ndjson_by_seller_and_date(self):
+        admin = CustomUser.objects.create_user(username='admin', password='x', phone='+998900000000', role='admin')
+        old = create_drug(self.seller)
+        Drug.objects.filter(pk=old.pk).update(created_at=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc))
+        recent = create_drug(self.seller)
+        create_drug(create_seller('other', '+998900000009'))
+        self.client.force_authenticate(admin)
+        rows = [json.loads(line) for line in self.export(output='ndjson', seller=self.seller.pk, created_after='2021-01-01').splitlines()]
+        self.assertEqual([row['id'] for row in rows], [recent.pk])
+        self.assertEqual(rows[0]['price'], '5.99')
+        self.assertEqual(len(self.export(output='ndjson', created_before='2020-01-01').splitlines()), 1)
+
+    def test_rejects_buyers_and_bad_parameters(self):
+        buyer = CustomUser.objects.create_user(username='buyer', password='x', phone='+998900000002', role='buyer')
+        self.client.force_authenticate(buyer)
+        self.assertEqual(self.client.get('/drugs/export/').status_code, 403)
+        self.client.force_authenticate(self.seller)
+        self.assertEqual(self.client.get('/drugs/export/', {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/drugs/export/', {'created_after': 'yesterday'}).status_code, 400)
+
+    async def test_exports_stream_asynchronously_under_asgi(self):
+        mine = await sync_to_async(create_drug)(self.seller)
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.seller)}'}
+        response = await AsyncClient().get('/drugs/export/', {'output': 'ndjson'}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        rows = [json.loads(chunk) async for chunk in response.streaming_content]
+        self.assertEqual([row['id'] for row in rows], [mine.pk])
+
+    def test_large_exports_are_sent_in_chunks(self):
+        self.assertEqual(list(export.encode_rows(('a',), [], 'ndjson')), [])
+        chunks = list(export.encode_rows(('a', 'b'), (('x' * 100, i) for i in range(2000)), 'csv'))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks).count('\n'), 2001)
+
+
+@override_settings(DRUG_IMAGE_WORKERS=0)
+class DrugImageTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = self.settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.storage = default_storage
+
+    def upload(self, name='photo.png', size=(1200, 800), color='red'):
+        output = io.BytesIO()
+        Image.new('RGBA', size, color).save(output, 'PNG')
+        return self.storage.save(f'images/drugs/{name}', ContentFile(output.getvalue()))
+
+    def test_variants_are_created_after_commit_and_exposed(self):
+        name = self.upload()
+        with self.captureOnCommitCallbacks(execute=True):
+            drug = create_drug(self.seller, image=name)
+        drug.refresh_from_db()
+        self.assertEqual(set(drug.image_variants), set(images.VARIANTS))
+        with self.storage.open(drug.image_variants['thumbnail']) as thumbnail:
+            self.assertEqual(Image.open(thumbnail).size, (160, 160))
+        with self.storage.open(drug.image_variants['medium_webp']) as medium:
+            self.assertEqual(Image.open(medium).size, (640, 427))
+        data = self.client.get(f'/drugs/{drug.pk}/').json()
+        self.assertEqual(data['images']['thumbnail_webp'], '/media/' + drug.image_variants['thumbnail_webp'])
+
+    def test_identical_uploads_share_derivatives(self):
+        first, second = self.upload('a.png'), self.upload('b.png')
+        self.assertNotEqual(first, second)
+        self.assertEqual(images.generate_variants(first), images.generate_variants(second))
+
+    def test_unchanged_image_is_not_reprocessed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            drug = create_drug(self.seller, image=self.upload())
+        with mock.patch.object(images, 'process_drug') as process, self.captureOnCommitCallbacks(execute=True):
+            drug.quantity = 1
+            drug.save()
+        process.assert_not_called()
+
+    def test_backfill_processes_each_image_once(self):
+        name = self.upload()
+        drugs = [create_drug(self.seller, image=name) for _ in range(3)]
+        with mock.patch.object(images, 'render', wraps=images.render) as render:
+            call_command('generate_drug_images', workers=1, stdout=io.StringIO())
+        self.assertEqual(render.call_count, len(images.VARIANTS))
+        for drug in drugs:
+            drug.refresh_from_db()
+            self.assertEqual(set(drug.image_variants), set(images.VARIANTS))
+
+    def test_missing_file_is_skipped(self):
+        drug = create_drug(self.seller, image='images/drugs/missing.jpg')
+        with self.assertLogs('drugs.images', 'WARNING'):
+            self.assertIsNone(images.process_drug(drug.pk))
+
+    def test_worker_processes_queue(self):
+        drug = create_drug(self.seller, image=self.upload())
+        worker = images.ImageWorker(threads=2)
+        with mock.patch.object(images, 'process_drug') as process:
+            worker.enqueue(drug.pk)
+            worker.queue.join()
+        process.assert_called_once_with(drug.pk)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TwoTierCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.cache = caches['tiered']
+        self.cache.reset_stats()
+
+    def other_process(self):
+        # Same L2 and channel, but its own in-process tier, like another worker would have.
+        other = TwoTierCache('default', {})
+        other.l1 = cache_backends._Tier1(100)
+        self.addCleanup(cache_backends._local_channels[other.channel].pop, other.l1.origin, None)
+        other.get('warm-up')
+        return other
+
+    def test_reads_are_served_from_l1_after_l2(self):
+        caches['default'].set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertEqual(self.cache.get_many(['key', 'missing']), {'key': 'value'})
+        stats = self.cache.stats()
+        self.assertEqual((stats['l2_hits'], stats['l1_hits'], stats['misses']), (1, 1, 1))
+        self.assertAlmostEqual(stats['l1_hit_rate'], 1 / 3)
+
+    def test_writes_invalidate_other_processes(self):
+        other = self.other_process()
+        self.cache.set('key', 1)
+        self.assertEqual(other.get('key'), 1)
+        self.cache.set('key', 2)
+        self.assertEqual(other.get('key'), 2)
+        self.cache.incr('key')
+        self.assertEqual(other.get('key'), 3)
+        self.cache.delete('key')
+        self.assertIsNone(other.get('key'))
+
+    def test_value_read_before_an_invalidation_is_not_cached(self):
+        caches['default'].set('key', 'old')
+        l2_get = caches['default'].get
+
+        def racing_get(*args, **kwargs):
+            value = l2_get(*args, **kwargs)
+            self.cache.l1.discard(['other-key'])  # an invalidation arrives while we read
+            return value
+
+        with mock.patch.object(caches['default'], 'get', racing_get):
+            self.assertEqual(self.cache.get('key'), 'old')
+        self.assertEqual(self.cache.stats()['l1_entries'], 0)
+
+    def test_l1_is_bounded_and_expires(self):
+        small = TwoTierCache('default', {'OPTIONS': {'L1_MAX_ENTRIES': 2, 'L1_TIMEOUT': 60, 'CHANNEL': 'small'}})
+        for key in 'abc':
+            small.set(key, key)
+        self.assertEqual(list(small.l1.entries), [':1:b', ':1:c'])
+        with mock.patch.object(cache_backends.time, 'monotonic', return_value=time.monotonic() + 61):
+            small.get('b')
+        self.assertEqual(small.stats()['l2_hits'], 1)
+
+    def test_pubsub_message_from_another_process(self):
+        self.cache.set('key', 1)
+        self.cache._receive({'origin': self.cache.l1.origin, 'keys': [':1:key']})
+        self.assertEqual(self.cache.stats()['l1_entries'], 1)
+        self.cache._receive({'origin': 'another-process', 'keys': [':1:key'], 'clear': False})
+        self.assertEqual(self.cache.stats()['l1_entries'], 0)
+
+
+class DrugFragmentTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.drugs = [create_drug(self.seller, drug_name=f'Drug {i}', description='Ünïcode text') for i in range(3)]
+
+    def test_responses_match_drf_rendering(self):
+        expected = JSONRenderer().render({'results': DrugSerializer(self.drugs, many=True).data, 'next': None})
+        self.assertEqual(self.client.get('/drugs/').content, expected)
+        self.assertEqual(self.client.get('/drugs/').content, expected)
+        self.assertEqual(
+            self.client.get(f'/drugs/{self.drugs[0].pk}/').content, JSONRenderer().render(DrugSerializer(self.drugs[0]).data),
+        )
+
+    def test_cached_list_page_needs_no_queries(self):
+        self.client.get('/drugs/')
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get('/drugs/').json()['results']), 3)
+
+    def test_fragment_is_refreshed_on_save(self):
+        drug = self.drugs[0]
+        self.client.get(f'/drugs/{drug.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            drug.quantity = 7
+            drug.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(f'/drugs/{drug.pk}/').json()['quantity'], 7)
+
+    def test_deleted_drugs_are_left_out(self):
+        ids = [drug.pk for drug in self.drugs]
+        fragments.get_fragments(ids)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drugs[1].delete()
+        self.assertEqual([drug['id'] for drug in json.loads(fragments.join(ids))], [ids[0], ids[2]])
+
+
+class DrugRepresentationTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        create_drug(self.seller, drug_name='Plain')
+        create_drug(self.seller, price=Decimal('1234567.5'), image='images/drugs/Ünï cöde (1).jpg', brand='')
+        Drug.objects.filter(pk=create_drug(self.seller).pk).update(image='')
+        variants = {'thumbnail': 'images/drugs/derived/ab/abc/thumbnail-160x160cq80.jpg'}
+        create_drug(self.seller, image_variants=variants)
+
+    def assertMatchesSerializer(self):
+        drugs = Drug.objects.order_by('id')
+        expected = JSONRenderer().render(DrugSerializer(drugs, many=True).data)
+        self.assertEqual(fragments.encode(representation.drugs.many(drugs.values(*representation.drugs.columns))), expected)
+
+    def test_matches_serializer(self):
+        self.assertMatchesSerializer()
+
+    @override_settings(TIME_ZONE='UTC')
+    def test_matches_serializer_in_utc(self):
+        self.assertMatchesSerializer()
+
+    @override_settings(MEDIA_URL='https://cdn.example.com/media/')
+    def test_matches_serializer_with_absolute_media_url(self):
+        self.assertMatchesSerializer()
+
+    def test_fragments_from_rows_match_rendered_instances(self):
+        drugs = Drug.objects.order_by('id')
+        self.assertEqual(fragments.render_rows(drugs.values(*representation.drugs.columns)), fragments.render(drugs))
+
+
+class FastJSONTests(TestCase):
+    data = {
+        'price': Decimal('5.99'),
+        'created_at': datetime.datetime(2024, 6, 5, 12, 28, 1, 123456, tzinfo=datetime.timezone.utc),
+        'local': datetime.datetime(2024, 6, 5, 17, 28, tzinfo=datetime.timezone(datetime.timedelta(hours=5))),
+        'expiration_date': datetime.date(2025, 1, 1),
+        'text': 'Ünïcode \u2028 line separator',
+        'list': [None, True, 1.5],
+    }
+
+    def test_renders_like_drf(self):
+        self.assertTrue(FastJSONRenderer().fast)
+        self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+    def test_what_orjson_refuses_is_left_to_drf(self):
+        data = {'big': 2 ** 70}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render({1: 'one'}), JSONRenderer().render({1: 'one'}))
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(b'{"big": 1180591620717411303424}')), data)
+
+    def test_indent_is_left_to_drf(self):
+        self.assertEqual(
+            FastJSONRenderer().render(self.data, 'application/json; indent=4'),
+            JSONRenderer().render(self.data, 'application/json; indent=4'),
+        )
+
+    def test_falls_back_without_orjson(self):
+        with mock.patch('pharmacy_marketplce.renderers.orjson', None), mock.patch('pharmacy_marketplce.parsers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+            self.assertEqual(FastJSONParser().parse(io.BytesIO(b'{"a": [1, 2.5]}')), {'a': [1, 2.5]})
+
+    def test_parses_like_drf(self):
+        body = JSONRenderer().render(self.data)
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), json.loads(body))
+        with self.assertRaisesMessage(Exception, 'JSON parse error - Expecting value'):
+            FastJSONParser().parse(io.BytesIO(b'{"a": }'))
+
+
+class ConditionalGetTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.drug = create_drug(self.seller)
+
+    def test_unchanged_list_is_not_sent_again(self):
+        etag = self.client.get('/drugs/').headers['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/drugs/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.client.get('/drugs/?page_size=1', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_drug(self.seller, drug_name='Other')
+        response = self.client.get('/drugs/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_unchanged_drug_is_not_sent_again(self):
+        url = f'/drugs/{self.drug.pk}/'
+        response = self.client.get(url)
+        etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drug.quantity = 7
+            self.drug.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).json()['quantity'], 7)
+
+    def test_queryset_updates_move_updated_at(self):
+        before = self.drug.updated_at
+        images._store_variants(Drug.objects.filter(pk=self.drug.pk), {'thumbnail': 'thumbnail.jpg'})
+        self.drug.refresh_from_db()
+        self.assertGreater(self.drug.updated_at, before)
+
+
+@override_settings(DRUG_CHANGES_SETTLE_SECONDS=0)
+class DrugChangesTests(CatalogTestCase):
+    def changes(self, since, **params):
+        response = self.client.get('/drugs/changes/', {'since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_feed_returns_the_last_change_of_each_drug(self):
+        start = self.client.get('/drugs/changes/').json()['next']
+        kept = create_drug(self.seller, drug_name='Kept')
+        deleted = create_drug(self.seller, drug_name='Deleted')
+        kept.quantity = 3
+        kept.save()
+        self.client.force_authenticate(self.seller)
+        self.assertEqual(self.client.delete(f'/drugs/delete/{deleted.pk}/').status_code, 200)
+
+        feed = self.changes(start)
+        self.assertEqual(
+            [(change['id'], change['action']) for change in feed['results']], [(kept.pk, 'updated'), (deleted.pk, 'deleted')],
+        )
+        self.assertEqual(feed['results'][0]['drug'], json.loads(JSONRenderer().render(DrugSerializer(kept).data)))
+        self.assertIsNone(feed['results'][1]['drug'])
+        self.assertFalse(feed['more'])
+        self.assertEqual(self.changes(feed['next']), {'results': [], 'next': feed['next'], 'more': False})
+
+    def test_batches(self):
+        start = self.client.get('/drugs/changes/').json()['next']
+        drugs = [create_drug(self.seller, drug_name=f'Drug {i}') for i in range(3)]
+        seen, since, more = [], start, True
+        while more:
+            feed = self.changes(since, page_size=2)
+            seen += [change['id'] for change in feed['results']]
+            since, more = feed['next'], feed['more']
+        self.assertEqual(seen, [drug.pk for drug in drugs])
+
+    def test_recent_changes_wait_to_settle(self):
+        start = self.client.get('/drugs/changes/').json()['next']
+        create_drug(self.seller)
+        with self.settings(DRUG_CHANGES_SETTLE_SECONDS=60):
+            self.assertEqual(self.changes(start)['results'], [])
+        self.assertEqual(len(self.changes(start)['results']), 1)
+
+    def test_feed_stops_at_the_first_change_that_has_not_settled(self):
+        start = self.client.get('/drugs/changes/').json()['next']
+        settled, unsettled, later = (create_drug(self.seller, drug_name=f'Drug {i}') for i in range(3))
+        DrugChange.objects.filter(drug_id=unsettled.pk).update(changed_at=timezone.now() + datetime.timedelta(minutes=1))
+        feed = self.changes(start)
+        self.assertEqual([change['id'] for change in feed['results']], [settled.pk])
+        self.assertFalse(feed['more'])
+        self.assertEqual([change['id'] for change in self.changes(feed['next'])['results']], [])
+        DrugChange.objects.filter(drug_id=unsettled.pk).update(changed_at=timezone.now())
+        self.assertEqual([change['id'] for change in self.changes(feed['next'])['results']], [unsettled.pk, later.pk])
+
+    def test_pruned_cursor_is_gone(self):
+        for i in range(3):
+            create_drug(self.seller, drug_name=f'Drug {i}')
+        call_command('prune_drug_changes', days=0, stdout=io.StringIO())
+        self.assertEqual(DrugChange.objects.count(), 1)
+        self.assertEqual(self.client.get('/drugs/changes/', {'since': 0}).status_code, 410)
+        self.assertEqual(self.changes(DrugChange.objects.get().pk - 1)['results'][0]['action'], 'created')
+
+
+class AsyncReadViewTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.drugs = [create_drug(self.seller, drug_name=f'Drug{i}', category=f'Category{i % 2}') for i in range(3)]
+        self.factory = AsyncRequestFactory()
+
+    def async_get(self, view, path, *args, **extra):
+        return async_to_sync(view)(self.factory.get(path, **extra), *args)
+
+    def assertSameResponse(self, view, path, *args, **extra):
+        expected = self.client.get(path, **extra)
+        response = self.async_get(view, path, *args, **extra)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        # Vary is left out: the client adds the middleware's part of it.
+        for header in ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Allow', 'WWW-Authenticate'):
+            self.assertEqual(response.headers.get(header), expected.headers.get(header), header)
+        return response
+
+    def test_responses_match_drf_views(self):
+        list_view = async_reads(async_views.list_drugs, ListDrugView.as_view())
+        detail_view = async_reads(async_views.drug_detail, DrugDetailView.as_view())
+        categories_view = async_reads(async_views.drug_categories, DrugGetCategoriesView.as_view())
+        cursor = self.client.get('/drugs/?page_size=2').json()['next']
+        self.assertSameResponse(list_view, '/drugs/', data={'page_size': 2})
+        self.assertSameResponse(list_view, '/drugs/', data={'page_size': 2, 'cursor': cursor, 'category': 'Category0'})
+        self.assertSameResponse(list_view, '/drugs/', data={'page_size': 'x'})
+        self.assertSameResponse(list_view, '/drugs/', headers={'Authorization': 'Bearer invalid'})
+        self.assertSameResponse(detail_view, f'/drugs/{self.drugs[0].pk}/', self.drugs[0].pk)
+        self.assertSameResponse(detail_view, '/drugs/0/', 0)
+        self.assertSameResponse(categories_view, '/drugs/categories/')
+
+    def test_cached_reads_do_not_query(self):
+        view = async_reads(async_views.drug_detail, DrugDetailView.as_view())
+        path = f'/drugs/{self.drugs[0].pk}/'
+        etag = self.async_get(view, path, self.drugs[0].pk).headers['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.async_get(view, path, self.drugs[0].pk).status_code, 200)
+            self.assertEqual(self.async_get(view, path, self.drugs[0].pk, headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_writes_and_browsable_api_go_to_drf_view(self):
+        view = async_reads(async_views.list_drugs, ListDrugView.as_view())
+        self.assertEqual(async_to_sync(view)(self.factory.post('/drugs/')).status_code, 405)
+        view = async_reads(async_views.drug_categories, DrugGetCategoriesView.as_view())
+        response = self.async_get(view, '/drugs/categories/', headers={'Accept': 'text/html'})
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+
+@override_settings(DRUG_CHANGES_SETTLE_SECONDS=0)
+class QueryPlanTests(QueryPlanAssertionsMixin, CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        other = create_seller('other', '+998900000009')
+        for i in range(4):
+            create_drug(self.seller if i % 2 else other, drug_name=f'Drug{i}', category=f'Category{i % 2}')
+        self.client.force_authenticate(self.seller)
+
+    def test_catalog_reads_use_indexes(self):
+        drug = Drug.objects.first()
+        cursor = self.client.get('/drugs/?page_size=2').json()['next']
+        for url in [
+            '/drugs/', f'/drugs/?page_size=2&cursor={cursor}', '/drugs/?category=Category1', '/drugs/?type=Tablet',
+            '/drugs/?brand=Bayer', '/drugs/?manufacturer_country=Germany', f'/drugs/{drug.pk}/', '/drugs/my_drugs/',
+            '/drugs/export/', '/drugs/changes/', '/drugs/changes/?since=0',
+        ]:
+            self.assertIndexedPlans(url)
+
+    def test_range_filters_and_search_only_sort_what_they_found(self):
+        for url in ['/drugs/?min_price=1&max_price=10', '/drugs/?expires_after=2000-01-01', '/drugs/search/?query=dru']:
+            self.assertIndexedPlans(url, allow_sort=True)
+
+    def test_only_scans_in_order_by_order_stop_at_the_limit(self):
+        sql = 'SELECT * FROM "drugs_drug" ORDER BY "drugs_drug"."created_at" DESC, "drugs_drug"."id" DESC LIMIT 21'
+        self.assertTrue(self.ordered_walk(sql, 'drugs_drug', 'SCAN drugs_drug USING INDEX drugs_drug_created_26c0a5_idx'))
+        self.assertFalse(self.ordered_walk(sql, 'drugs_drug', 'SCAN drugs_drug'))
+        self.assertFalse(self.ordered_walk(sql, 'drugs_drug', 'SCAN drugs_drug USING INDEX drugs_drug_price_fc0d78_idx'))
+        self.assertFalse(self.ordered_walk('SELECT * FROM "drugs_drug" LIMIT 21', 'drugs_drug', 'SCAN drugs_drug'))
+        self.assertTrue(self.ordered_walk('SELECT * FROM "drugs_drug" ORDER BY "drugs_drug"."id" ASC LIMIT 21',
+                                          'drugs_drug', 'SCAN drugs_drug'))
+
+    def test_facets_read_the_counts_table(self):
+        for url in ['/drugs/categories/', '/drugs/facets/']:
+            self.assertIndexedPlans(url, scans=('drugs_drugfacetcount',))
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'], DATABASE_REPLICA_CACHE_TIMEOUT=30)
+class ReplicaRoutingTests(CatalogTestCase):
+    def route(self, method, path, status=200, token=None):
+        """The database the view serving this request would read from."""
+        seen = []
+
+        def view(request):
+            seen.append(router.db_for_read(Drug))
+            return HttpResponse(status=status)
+
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        ReplicaReadsMiddleware(view)(RequestFactory().generic(method, path, headers=headers))
+        return seen[0]
+
+    def test_read_only_views_read_from_a_replica(self):
+        self.assertEqual(self.route('GET', '/drugs/'), 'replica_1')
+        self.assertEqual(self.route('GET', '/drugs/1/'), 'replica_1')
+        self.assertEqual(self.route('GET', '/users/orders/1/', token='a'), 'replica_1')
+        self.assertEqual(self.route('GET', '/drugs/my_drugs/', token='a'), 'default')
+        self.assertEqual(self.route('POST', '/users/orders/', status=201, token='a'), 'default')
+        self.assertEqual(router.db_for_read(Drug), 'default')
+
+    def test_clients_read_their_own_writes_from_the_primary(self):
+        self.route('POST', '/users/orders/', status=400, token='a')
+        self.assertEqual(self.route('GET', '/users/orders/', token='a'), 'replica_1')
+        self.route('POST', '/users/orders/', status=201, token='a')
+        self.assertEqual(self.route('GET', '/users/orders/', token='a'), 'default')
+        self.assertEqual(self.route('GET', '/users/orders/', token='b'), 'replica_1')
+
+    def test_cache_entries_filled_from_a_replica_expire_early(self):
+        self.assertEqual(cache_timeout(600), 600)
+        with reading_from('replica_1'):
+            self.assertEqual(cache_timeout(600), 30)
+            self.assertEqual(cache_timeout(None), 30)
+
+    def test_database_urls(self):
+        config = database_config('postgres://shop:p%40ss@db:5432/pharmacy?sslmode=require', conn_max_age=60)
+        self.assertEqual(
+            {key: config[key] for key in ('ENGINE', 'NAME', 'USER', 'PASSWORD', 'HOST', 'PORT', 'OPTIONS', 'CONN_MAX_AGE')},
+            {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'pharmacy', 'USER': 'shop', 'PASSWORD': 'p@ss',
+             'HOST': 'db', 'PORT': '5432', 'OPTIONS': {'sslmode': 'require'}, 'CONN_MAX_AGE': 60},
+        )
+        self.assertEqual(database_config('sqlite:////data/db.sqlite3')['NAME'], '/data/db.sqlite3')
+        with self.assertRaises(ValueError):
+            database_config('oracle://db/pharmacy')
+
+
+@override_settings(METRICS_SAMPLE_RATE=1)
+class MetricsTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        self.drug = create_drug(self.seller)
+
+    def scrape(self, **headers):
+        response = self.client.get('/metrics', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_requests_are_recorded_by_route(self):
+        self.client.get('/drugs/')
+        self.client.get('/drugs/')
+        self.client.get(f'/drugs/{self.drug.pk}/')
+        self.client.get('/drugs/nothing-here/')
+        samples = self.scrape()
+        self.assertEqual(samples['http_requests_total{route="drugs/",method="GET",status="200"}'], 2)
+        self.assertEqual(samples['http_requests_total{route="unmatched",method="GET",status="404"}'], 1)
+        self.assertEqual(samples['http_request_duration_seconds_count{route="drugs/<int:pk>/",method="GET"}'], 1)
+        self.assertEqual(samples['http_request_duration_seconds_bucket{route="drugs/",method="GET",le="+Inf"}'], 2)
+        self.assertGreater(samples['http_response_size_bytes_sum{route="drugs/<int:pk>/"}'], 0)
+        # The first list request renders the page from the database, the second finds it in the cache.
+        self.assertEqual(samples['http_request_db_queries_bucket{route="drugs/",le="0"}'], 1)
+        self.assertGreater(samples['http_request_db_seconds_sum{route="drugs/"}'], 0)
+        self.assertGreater(samples['http_request_cache_hits_total{route="drugs/"}'], 0)
+        self.assertGreater(samples['http_request_cache_misses_total{route="drugs/"}'], 0)
+        self.assertGreater(samples['http_request_serialize_seconds_sum{route="drugs/"}'], 0)
+
+    async def test_async_requests_count_the_queries_of_their_threads(self):
+        clear_caches()
+        await self.async_client.get(f'/drugs/{self.drug.pk}/')
+        histogram = metrics.registry.histograms['http_request_db_queries', ('drugs/<int:pk>/',)]
+        self.assertEqual(histogram.count, 1)
+        self.assertGreater(histogram.sum, 0)
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_only_timed(self):
+        self.client.get('/drugs/')
+        samples = self.scrape()
+        self.assertEqual(samples['http_request_duration_seconds_count{route="drugs/",method="GET"}'], 1)
+        self.assertNotIn('http_requests_sampled_total{route="drugs/"}', samples)
+        self.assertNotIn('http_request_db_queries_count{route="drugs/"}', samples)
+
+    def test_other_workers_are_merged(self):
+        self.client.get('/drugs/')
+        snapshot = metrics.registry.snapshot()
+        caches['default'].set('metrics:worker:other:1', snapshot)
+        caches['default'].set(metrics.WORKERS_KEY, {'other:1': time.time()})
+        samples = self.scrape()
+        self.assertEqual(samples['http_requests_total{route="drugs/",method="GET",status="200"}'], 2)
+        self.assertEqual(samples['http_request_duration_seconds_count{route="drugs/",method="GET"}'], 2)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertIn('http_requests_total', str(self.scrape(Authorization='Bearer scrape-token')))
+
+    def test_histogram_precision(self):
+        histogram = metrics.Histogram(metrics.SECONDS)
+        for value in (0.00005, 0.0123, 0.0123, 0.0123, 2.5, 500):
+            histogram.record(value)
+        self.assertEqual(histogram.percentile(50), 0.0128)
+        self.assertLessEqual(abs(histogram.percentile(80) - 2.5) / 2.5, 0.25)
+        self.assertEqual(histogram.percentile(100), float('inf'))
+        self.assertEqual(histogram.percentile(1), metrics.SECONDS[0])
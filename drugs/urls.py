@@ -1,13 +1,28 @@
+from django.conf import settings
 from django.urls import path
 
-from .views import CreateDrugView, UpdateDrugView, DeleteDrugView, ListDrugView, DrugDetailView, DrugGetCategoriesView, DrugSellersDrugsView
+from pharmacy_marketplce.async_views import async_reads
+from . import async_views
+from .views import CreateDrugView, UpdateDrugView, DeleteDrugView, ListDrugView, DrugDetailView, DrugGetCategoriesView, DrugSellersDrugsView, DrugSearchView, \
+    DrugFacetsView, ImportDrugsView, ExportDrugsView, DrugChangesView
+
+list_view, detail_view, categories_view = ListDrugView.as_view(), DrugDetailView.as_view(), DrugGetCategoriesView.as_view()
+if settings.ASYNC_READ_VIEWS:
+    list_view = async_reads(async_views.list_drugs, list_view)
+    detail_view = async_reads(async_views.drug_detail, detail_view)
+    categories_view = async_reads(async_views.drug_categories, categories_view)
 
 urlpatterns = [
-    path('', ListDrugView.as_view()),
-    path('<int:pk>/', DrugDetailView.as_view()),
+    path('', list_view),
+    path('<int:pk>/', detail_view),
     path('create/', CreateDrugView.as_view()),
+    path('import/', ImportDrugsView.as_view()),
+    path('export/', ExportDrugsView.as_view()),
     path('update/<int:pk>/', UpdateDrugView.as_view()),
     path('delete/<int:pk>/', DeleteDrugView.as_view()),
-    path('categories/', DrugGetCategoriesView.as_view()),
+    path('categories/', categories_view),
+    path('facets/', DrugFacetsView.as_view()),
     path('my_drugs/', DrugSellersDrugsView.as_view()),
+    path('search/', DrugSearchView.as_view()),
+    path('changes/', DrugChangesView.as_view()),
 ]
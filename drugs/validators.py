@@ -0,0 +1,43 @@
+import datetime
+import decimal
+
+from rest_framework import serializers
+
+IMAGE_FILE_TYPES = ['png', 'jpg', 'jpeg']
+IMAGE_MAX_SIZE = 5242880
+
+
+def check_expiration_date(value, today=None):
+    if value < (today or datetime.date.today()):
+        raise serializers.ValidationError("Expiration date must be greater than today.")
+    return value
+
+
+def check_price(value):
+    if not isinstance(value, decimal.Decimal):
+        raise serializers.ValidationError("Price must be a number.")
+    if value < 0:
+        raise serializers.ValidationError("Price must be greater than 0.")
+    return value
+
+
+def check_image(value):
+    if not value.name.endswith(tuple(IMAGE_FILE_TYPES)):
+        raise serializers.ValidationError("Image must be a PNG, JPG, or JPEG file.")
+    if value.size > IMAGE_MAX_SIZE:
+        raise serializers.ValidationError("Image must be less than 5MB.")
+    return value
+
+
+def check_count(value, label):
+    if not isinstance(value, int):
+        raise serializers.ValidationError(f"{label} must be an integer.")
+    if value < 0:
+        raise serializers.ValidationError(f"{label} must be greater than 0.")
+    return value
+
+
+def check_letters(value, label):
+    if not value.isalpha():
+        raise serializers.ValidationError(f"{label} must contain only letters.")
+    return value
@@ -1,13 +1,23 @@
+import hashlib
+import io
+
+from django.conf import settings
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from pharmacy_marketplce.conditional import make_etag, not_modified, set_validators
+from . import changes, export, facets, fragments
+from .importer import check_utf8, import_drugs, FORMATS
+from .filters import parse_filters, filters_digest, InvalidFilter
 from .models import Drug
+from .cache import CATALOG, make_key, get_or_compute, seller_namespace
+from .search import parse_query, search
+from .pagination import KeysetPaginator, InvalidCursor, decode_cursor, get_page_size
 from .serializers import DrugSerializer, DrugUpdateSerializer
 from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from django.core.cache import cache
 
 
 class CreateDrugView(APIView):
@@ -23,7 +33,6 @@ class CreateDrugView(APIView):
         }
     )
     def post(self, request):
-        cache.delete('drugs')
         try:
             request_user = request.user
         except Exception as e:
@@ -54,8 +63,6 @@ class UpdateDrugView(APIView):
         }
     )
     def put(self, request, pk):
-        cache.delete('drugs')
-        cache.delete(f'drug-{pk}')
         try:
             request_user = request.user
         except Exception as e:
@@ -86,8 +93,6 @@ class DeleteDrugView(APIView):
         }
     )
     def delete(self, request, pk):
-        cache.delete('drugs')
-        cache.delete(f'drug-{pk}')
         try:
             request_user = request.user
         except Exception as e:
@@ -104,8 +109,58 @@ class DeleteDrugView(APIView):
         return Response({'message': 'Drug deleted successfully.'})
 
 
+class InvalidListParams(Exception):
+    pass
+
+
+def parse_list_params(query_params):
+    """(page_size, cursor, filter lookups) of a drug list request; InvalidListParams carries the 400 message."""
+    try:
+        page_size = get_page_size(query_params.get('page_size'))
+    except ValueError:
+        raise InvalidListParams('Page size must be a positive integer.')
+    cursor = query_params.get('cursor')
+    try:
+        if cursor:
+            decode_cursor(cursor)
+        lookups = parse_filters(query_params)
+    except (InvalidCursor, InvalidFilter) as e:
+        raise InvalidListParams(str(e))
+    return page_size, cursor, lookups
+
+
+def list_key_parts(lookups, cursor, page_size):
+    return fragments.FORMAT, filters_digest(lookups), cursor or 'first', page_size
+
+
+def list_stale_key(lookups, cursor, page_size):
+    return 'drugs-page:stale:' + ':'.join(str(part) for part in list_key_parts(lookups, cursor, page_size))
+
+
+def list_page_builder(lookups, cursor, page_size):
+    def build_page():
+        queryset = Drug.objects.filter(**lookups).only('id', 'created_at')
+        drugs, next_cursor = KeysetPaginator(queryset, page_size).paginate(cursor)
+        return fragments.page([drug.pk for drug in drugs], next_cursor)
+    return build_page
+
+
 class ListDrugView(APIView):
+    replica_reads = True
+
     @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('cursor', openapi.IN_QUERY, description='Opaque cursor from the previous page', type=openapi.TYPE_STRING),
+            openapi.Parameter('page_size', openapi.IN_QUERY, description='Number of drugs per page', type=openapi.TYPE_INTEGER),
+            openapi.Parameter('category', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter('type', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter('manufacturer_country', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter('brand', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter('min_price', openapi.IN_QUERY, type=openapi.TYPE_NUMBER),
+            openapi.Parameter('max_price', openapi.IN_QUERY, type=openapi.TYPE_NUMBER),
+            openapi.Parameter('expires_after', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+            openapi.Parameter('expires_before', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+        ],
         responses={
             200: openapi.Response('List of drugs fetched successfully.'),
             400: openapi.Response('Bad Request'),
@@ -113,21 +168,29 @@ class ListDrugView(APIView):
         }
     )
     def get(self, request):
-        cache_key = 'drugs'
-        data = cache.get(cache_key)
-        if data:
-            return Response(data)
-        else:
-            try:
-                drugs = Drug.objects.all()
-            except Exception as e:
-                return Response({'error': 'An error occurred.', 'message': str(e)}, status=500)
-            serializer = DrugSerializer(drugs, many=True)
-            cache.set(cache_key, serializer.data, timeout=600)  # 10 minutes
-            return Response(serializer.data)
+        try:
+            page_size, cursor, lookups = parse_list_params(request.query_params)
+        except InvalidListParams as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        cache_key = make_key('drugs-page', [CATALOG], *list_key_parts(lookups, cursor, page_size))
+        # The key changes with every catalog write, which makes it a validator that costs nothing to compute.
+        etag = make_etag(cache_key)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        try:
+            body = get_or_compute(
+                cache_key, list_page_builder(lookups, cursor, page_size), timeout=600,  # 10 minutes
+                stale_key=list_stale_key(lookups, cursor, page_size),
+            )
+        except Exception as e:
+            return Response({'error': 'An error occurred.', 'message': str(e)}, status=500)
+        return set_validators(fragments.json_response(body), etag)
 
 
 class DrugDetailView(APIView):
+    replica_reads = True
+
     @swagger_auto_schema(
         responses={
             200: openapi.Response('Drug details fetched successfully.'),
@@ -136,36 +199,63 @@ class DrugDetailView(APIView):
         }
     )
     def get(self, request, pk):
-        cache_key = f'drug-{pk}'
-        data = cache.get(cache_key)
-        if data:
-            return Response(data)
         try:
-            drug = Drug.objects.get(pk=pk)
-        except Drug.DoesNotExist:
-            return Response({'error': 'Drug not found.'}, status=404)
+            fragment = fragments.get_fragment(pk)
         except Exception as e:
             return Response({'error': 'An error occurred.', 'message': str(e)}, status=500)
-        serializer = DrugSerializer(drug)
-        cache.set(cache_key, serializer.data, timeout=600)  # 10 minutes
-        return Response(serializer.data)
+        if fragment is None:
+            return Response({'error': 'Drug not found.'}, status=404)
+        body, etag, last_modified = fragment
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        return set_validators(fragments.json_response(body), etag, last_modified)
 
 
 class DrugSearchView(APIView):
+    replica_reads = True
+
     @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('query', openapi.IN_QUERY, description='Words to search for; the last one may be incomplete', type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('page', openapi.IN_QUERY, description='Page number', type=openapi.TYPE_INTEGER),
+            openapi.Parameter('page_size', openapi.IN_QUERY, description='Number of drugs per page', type=openapi.TYPE_INTEGER),
+        ],
         responses={
             200: openapi.Response('List of drugs fetched successfully.'),
             400: openapi.Response('Bad Request')
         }
     )
     def get(self, request):
-        query = request.query_params.get('query')
-        drugs = Drug.objects.filter(name__icontains=query)
-        serializer = DrugSerializer(drugs, many=True)
-        return Response(serializer.data)
+        try:
+            page = int(request.query_params.get('page', 1))
+            page_size = get_page_size(request.query_params.get('page_size'))
+        except ValueError:
+            return Response({'error': 'Page and page size must be positive integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        if page < 1:
+            return Response({'error': 'Page and page size must be positive integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        if page > settings.DRUG_SEARCH_MAX_PAGE:
+            return Response({'error': f'Page must be at most {settings.DRUG_SEARCH_MAX_PAGE}.'}, status=status.HTTP_400_BAD_REQUEST)
+        terms = parse_query(request.query_params.get('query', ''))
+        if not terms:
+            return Response({'error': 'Query must contain at least one letter or digit.'}, status=status.HTTP_400_BAD_REQUEST)
+        query = ' '.join(terms)
+        cache_key = make_key('drug-search', [CATALOG], fragments.FORMAT, hashlib.md5(query.encode()).hexdigest(), page, page_size)
+
+        def build_results():
+            ids = search(query, offset=(page - 1) * page_size, limit=page_size)
+            return fragments.page(ids[:page_size], page + 1 if len(ids) > page_size else None)
+
+        try:
+            body = get_or_compute(cache_key, build_results, timeout=600)  # 10 minutes
+        except Exception as e:
+            return Response({'error': 'An error occurred.', 'message': str(e)}, status=500)
+        return fragments.json_response(body)
     
 
 class DrugGetCategoriesView(APIView):
+    replica_reads = True
+
     @swagger_auto_schema(
         responses={
             200: openapi.Response('List of drug categories fetched successfully.'),
@@ -173,10 +263,23 @@ class DrugGetCategoriesView(APIView):
         }
     )
     def get(self, request):
-        categories = Drug.objects.values_list('category', flat=True).distinct()
+        categories = sorted(facets.get_counts()['category'])
         return Response(categories)
 
 
+class DrugFacetsView(APIView):
+    replica_reads = True
+
+    @swagger_auto_schema(
+        responses={
+            200: openapi.Response('Number of drugs per category, type, manufacturer country and brand.'),
+            400: openapi.Response('Bad Request')
+        }
+    )
+    def get(self, request):
+        return Response(facets.get_counts())
+
+
 class DrugSellersDrugsView(APIView):
     permission_classes = (IsAuthenticated,)
     @swagger_auto_schema(
@@ -195,6 +298,132 @@ class DrugSellersDrugsView(APIView):
             return Response({'error': 'An error occurred.', 'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         if request_user.role == 'buyer':
             return Response({'error': 'You do not have any drugs, because you are a buyer.'}, status=status.HTTP_403_FORBIDDEN)
-        drugs = Drug.objects.filter(seller=request_user)
-        serializer = DrugSerializer(drugs, many=True)
-        return Response(serializer.data)
+        cache_key = make_key('seller-drugs', [seller_namespace(request_user.pk)], fragments.FORMAT)
+        body = get_or_compute(
+            cache_key, lambda: fragments.join(list(Drug.objects.filter(seller=request_user).values_list('id', flat=True))),
+            timeout=600,
+        )  # 10 minutes
+        return fragments.json_response(body)
+
+
+
+class ImportDrugsView(APIView):
+    parser_classes = (MultiPartParser, FormParser)
+    permission_classes = (IsAuthenticated,)
+    max_reported_errors = 100
+
+    @swagger_auto_schema(
+        operation_summary='Import drugs',
+        operation_description='Bulk import of drugs from a CSV or JSON lines file. Invalid rows are skipped and reported.',
+        manual_parameters=[
+            openapi.Parameter('file', openapi.IN_FORM, type=openapi.TYPE_FILE, required=True),
+            openapi.Parameter('format', openapi.IN_FORM, type=openapi.TYPE_STRING, enum=list(FORMATS)),
+        ],
+        responses={
+            201: openapi.Response('Drugs imported.'),
+            400: openapi.Response('Bad Request'),
+            403: openapi.Response('Forbidden'),
+        }
+    )
+    def post(self, request):
+        try:
+            request_user = request.user
+        except Exception as e:
+            return Response({'error': 'An error occurred.', 'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if request_user.role == 'buyer':
+            return Response({'error': 'You do not have permission to import drugs.'}, status=status.HTTP_403_FORBIDDEN)
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'A file is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('format') or ('jsonl' if upload.name.endswith(('.jsonl', '.ndjson')) else 'csv')
+        if fmt not in FORMATS:
+            return Response({'error': f'Format must be one of {", ".join(FORMATS)}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        errors = []
+
+        def on_error(line, row_errors):
+            if len(errors) < self.max_reported_errors:
+                errors.append({'line': line, 'errors': row_errors})
+
+        try:
+            # Checked before the first batch is written, so that a bad file imports nothing.
+            check_utf8(upload.file)
+        except UnicodeDecodeError:
+            return Response({'error': 'The file must be UTF-8 encoded.'}, status=status.HTTP_400_BAD_REQUEST)
+        result = import_drugs(io.TextIOWrapper(upload.file, encoding='utf-8', newline=''), request_user, fmt=fmt, on_error=on_error)
+        return Response({**result.as_dict(), 'errors': errors}, status=status.HTTP_201_CREATED)
+
+
+class ExportDrugsView(APIView):
+    permission_classes = (IsAuthenticated,)
+    @swagger_auto_schema(
+        operation_summary='Export drugs',
+        operation_description='Streams drugs as CSV or NDJSON. Sellers export their own drugs, admins may pick a seller.',
+        manual_parameters=[
+            openapi.Parameter('output', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=list(export.FORMATS)),
+            openapi.Parameter('seller', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+            openapi.Parameter('created_after', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+            openapi.Parameter('created_before', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+        ],
+        responses={
+            200: openapi.Response('Drugs exported.'),
+            400: openapi.Response('Bad Request'),
+            403: openapi.Response('Forbidden'),
+        }
+    )
+    def get(self, request):
+        try:
+            request_user = request.user
+        except Exception as e:
+            return Response({'error': 'An error occurred.', 'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if request_user.role == 'buyer':
+            return Response({'error': 'You do not have permission to export drugs.'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            fmt = export.parse_format(request.query_params)
+            lookups = export.parse_date_range(request.query_params)
+            seller_id = export.parse_seller(request.query_params)
+        except export.InvalidExport as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if request_user.role != 'admin':
+            seller_id = request_user.pk
+        rows = export.drug_rows(seller_id, **lookups)
+        return export.streaming_response(request, export.DRUG_COLUMNS, rows, fmt, 'drugs')
+
+
+class DrugChangesView(APIView):
+    @swagger_auto_schema(
+        operation_description='Catalog changes after the sequence number `since`, oldest first, for keeping a local '
+                              'copy of the catalog in sync. Without `since` only the latest sequence number is '
+                              'returned in `next`: read it, download the catalog, then poll from it. Each result is '
+                              'the last change of a drug in the batch with the drug as it is now, or null if it was '
+                              'deleted. Keep polling with `since=next` while `more` is true.',
+        manual_parameters=[
+            openapi.Parameter('since', openapi.IN_QUERY, description='Sequence number from the previous batch', type=openapi.TYPE_INTEGER),
+            openapi.Parameter('page_size', openapi.IN_QUERY, description='Maximum number of changes per batch', type=openapi.TYPE_INTEGER),
+        ],
+        responses={
+            200: openapi.Response('Changes fetched successfully.'),
+            400: openapi.Response('Bad Request'),
+            410: openapi.Response('Changes after `since` were pruned; download the catalog again.'),
+        }
+    )
+    def get(self, request):
+        try:
+            page_size = get_page_size(
+                request.query_params.get('page_size'), settings.DRUG_CHANGES_PAGE_SIZE, settings.DRUG_CHANGES_MAX_PAGE_SIZE,
+            )
+            since = request.query_params.get('since')
+            since = None if since in (None, '') else int(since)
+            if since is not None and since < 0:
+                raise ValueError
+        except ValueError:
+            return Response({'error': 'Since must be a non-negative integer and page size a positive one.'}, status=status.HTTP_400_BAD_REQUEST)
+        if since is None:
+            return Response({'results': [], 'next': changes.latest(), 'more': False})
+        try:
+            body = changes.feed(since, page_size)
+        except changes.ChangesPruned as e:
+            return Response({'error': str(e)}, status=status.HTTP_410_GONE)
+        except Exception as e:
+            return Response({'error': 'An error occurred.', 'message': str(e)}, status=500)
+        return fragments.json_response(body)
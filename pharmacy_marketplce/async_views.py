@@ -0,0 +1,73 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+
+from users.authentication import CachedJWTAuthentication
+from .renderers import FastJSONRenderer
+
+_renderer = FastJSONRenderer()
+_authentication = CachedJWTAuthentication()
+
+
+def json_response(data, status=200):
+    return HttpResponse(_renderer.render(data), status=status, content_type='application/json')
+
+
+async def authenticate(request, required=True):
+    """
+    Returns (user, None), or (None, response) with the 401 DRF would send for this request. Like DRF, an invalid
+    token is rejected even when the view does not need a user; then the user is None if there is no token.
+    """
+    if _authentication.get_header(request) is None:
+        if not required:
+            return None, None
+        detail = exceptions.NotAuthenticated.default_detail
+    else:
+        try:
+            user, _ = await sync_to_async(_authentication.authenticate)(request) or (None, None)
+        except exceptions.AuthenticationFailed as e:
+            detail = e.detail
+        else:
+            if user is not None or not required:
+                return user, None
+            detail = exceptions.NotAuthenticated.default_detail
+    response = json_response(detail if isinstance(detail, (list, dict)) else {'detail': detail}, status=401)
+    response.headers['WWW-Authenticate'] = _authentication.authenticate_header(request)
+    return None, response
+
+
+def _wants_browsable_api(request):
+    if 'text/html' in request.META.get('HTTP_ACCEPT', ''):
+        return True
+    # Parsing the query string only when it could ask for ?format=api.
+    return 'format=' in request.META.get('QUERY_STRING', '') and request.GET.get('format') == 'api'
+
+
+def async_reads(async_view, sync_view):
+    """
+    A URL view serving GET and HEAD with async_view and every other method, as well as the browsable API, with
+    the DRF view sync_view. The async responses get the Allow and Vary headers DRF would add, and the DRF view's
+    class stays visible to the schema generator.
+    """
+    return async_methods(async_view, sync_view, ('GET', 'HEAD'))
+
+
+def async_methods(async_view, sync_view, methods):
+    """async_reads() for any methods, e.g. POST to a view that waits on something other than the database."""
+    view = sync_view.cls(**sync_view.initkwargs)
+    view.setup(None)  # adds head(), which as_view() views have
+    headers = view.default_response_headers
+    sync_view_async = sync_to_async(sync_view)
+
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in methods or _wants_browsable_api(request):
+            return await sync_view_async(request, *args, **kwargs)
+        response = await async_view(request, *args, **kwargs)
+        for name, value in headers.items():
+            response.headers.setdefault(name, value)
+        return response
+
+    wrapper.cls = sync_view.cls
+    wrapper.initkwargs = sync_view.initkwargs
+    return csrf_exempt(wrapper)
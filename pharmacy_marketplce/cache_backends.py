@@ -0,0 +1,387 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter, OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+from pharmacy_marketplce.metrics import record_cache, timed_cache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+RESUBSCRIBE_DELAY = 1
+
+
+class _Tier1:
+    """Process-wide LRU shared by every thread's instance of a TwoTierCache alias."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.pid = os.getpid()
+        self.origin = uuid.uuid4().hex
+        self.subscriber = None
+        # Bumped by every invalidation, so a value read from L2 before an invalidation is not cached after it.
+        self.generation = 0
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] <= now:
+                del self.entries[key]
+                return _MISSING
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, expires_at, generation=None):
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['l1_evictions'] += 1
+
+    def discard(self, keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+# redis.asyncio clients are bound to the event loop that created them: loop -> {L2 alias: client}.
+_async_clients = weakref.WeakKeyDictionary()
+# Stand-in for pub/sub when the second tier is not Redis: channel -> {origin: L1}, all in this process.
+_local_channels = {}
+
+
+class TwoTierCache(BaseCache):
+    """
+    A bounded in-process LRU (L1) in front of another configured cache (L2, normally Redis).
+
+    Reads are served from L1 when possible and fall back to L2; writes go to both. Every write is announced on a
+    Redis pub/sub channel so the other processes drop their L1 copy of the key. L1 entries also expire after
+    L1_TIMEOUT seconds, which bounds staleness if an invalidation message is ever lost. L1 keeps the objects
+    themselves rather than pickles, so callers must not mutate what they get back.
+
+        'tiered': {
+            'BACKEND': 'pharmacy_marketplce.cache_backends.TwoTierCache',
+            'LOCATION': 'default',  # alias of the L2 cache
+            'OPTIONS': {'L1_MAX_ENTRIES': 1000, 'L1_TIMEOUT': 5, 'CHANNEL': 'cache-invalidation'},
+        }
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.l2_alias = location or 'default'
+        self.l1_timeout = options.get('L1_TIMEOUT', 5)
+        self.channel = options.get('CHANNEL', f'cache-invalidation:{self.l2_alias}')
+        with _tiers_lock:
+            name = (self.channel, self.l2_alias)
+            if name not in _tiers:
+                _tiers[name] = _Tier1(options.get('L1_MAX_ENTRIES', 1000))
+            self.l1 = _tiers[name]
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    # Invalidation messages
+
+    def _redis(self):
+        try:
+            from django_redis import get_redis_connection
+            from django_redis.cache import RedisCache
+        except ImportError:
+            return None
+        if not isinstance(self.l2, RedisCache):
+            return None
+        return get_redis_connection(self.l2_alias)
+
+    def _ensure_subscriber(self):
+        l1 = self.l1
+        if l1.pid != os.getpid():
+            # Forked: the parent's entries may already be stale and its subscriber thread did not survive.
+            l1.clear()
+            l1.pid, l1.origin, l1.subscriber = os.getpid(), uuid.uuid4().hex, None
+        if l1.subscriber is not None:
+            return
+        with l1.lock:
+            if l1.subscriber is not None:
+                return
+            client = self._redis()
+            if client is None:
+                _local_channels.setdefault(self.channel, {})[l1.origin] = l1
+                l1.subscriber = 'local'
+                return
+            l1.subscriber = threading.Thread(
+                target=self._listen, args=(client,), name=f'cache-invalidation-{self.channel}', daemon=True,
+            )
+            l1.subscriber.start()
+
+    def _listen(self, client):
+        while True:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                # Anything published while we were not listening is lost, so start from an empty L1.
+                self.l1.clear()
+                for message in pubsub.listen():
+                    self._receive(json.loads(message['data']))
+            except Exception:
+                logger.warning('Cache invalidation subscriber on %s failed, resubscribing', self.channel, exc_info=True)
+                self.l1.clear()
+                time.sleep(RESUBSCRIBE_DELAY)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+    def _receive(self, message):
+        if message.get('origin') == self.l1.origin:
+            return
+        if message.get('clear'):
+            self.l1.clear()
+        else:
+            self.l1.discard(message['keys'])
+        self.l1.count('invalidations_received')
+
+    def _publish(self, keys=(), clear=False):
+        message = {'origin': self.l1.origin, 'keys': list(keys), 'clear': clear}
+        client = self._redis()
+        if client is None:
+            for origin, l1 in list(_local_channels.get(self.channel, {}).items()):
+                if origin != self.l1.origin:
+                    l1.clear() if clear else l1.discard(message['keys'])
+            return
+        try:
+            client.publish(self.channel, json.dumps(message))
+        except Exception:
+            # L1_TIMEOUT still bounds how long other processes can serve the old value.
+            logger.warning('Could not publish cache invalidation on %s', self.channel, exc_info=True)
+
+    # L1 helpers
+
+    def _l1_key(self, key, version):
+        # No validate_key(): L2 checks the key anyway, and this runs for every key of every get_many.
+        return self.make_key(key, version=version)
+
+    def _l1_expiry(self, timeout):
+        timeout = self.l1_timeout if timeout is DEFAULT_TIMEOUT or timeout is None else min(timeout, self.l1_timeout)
+        return time.monotonic() + timeout
+
+    def _store(self, key, value, timeout=DEFAULT_TIMEOUT, generation=None):
+        if timeout is not None and timeout is not DEFAULT_TIMEOUT and timeout <= 0:
+            self.l1.discard([key])
+        else:
+            self.l1.set(key, value, self._l1_expiry(timeout), generation)
+
+    # Cache API
+
+    @timed_cache
+    def get(self, key, default=None, version=None):
+        self._ensure_subscriber()
+        l1_key = self._l1_key(key, version)
+        value = self.l1.get(l1_key, time.monotonic())
+        if value is not _MISSING:
+            self.l1.count('l1_hits')
+            record_cache(hits=1)
+            return value
+        generation = self.l1.generation
+        value = self.l2.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self.l1.count('misses')
+            record_cache(misses=1)
+            return default
+        self.l1.count('l2_hits')
+        record_cache(hits=1)
+        self._store(l1_key, value, generation=generation)
+        return value
+
+    def _l1_get_many(self, keys, version):
+        """Returns the values found in L1 and the keys to look up in L2."""
+        self._ensure_subscriber()
+        now = time.monotonic()
+        found, remote = {}, []
+        for key in keys:
+            value = self.l1.get(self._l1_key(key, version), now)
+            if value is _MISSING:
+                remote.append(key)
+            else:
+                found[key] = value
+        self.l1.count('l1_hits', len(found))
+        record_cache(hits=len(found))
+        return found, remote
+
+    def _l1_fill(self, remote, fetched, version, generation):
+        self.l1.count('l2_hits', len(fetched))
+        self.l1.count('misses', len(remote) - len(fetched))
+        record_cache(hits=len(fetched), misses=len(remote) - len(fetched))
+        for key, value in fetched.items():
+            self._store(self._l1_key(key, version), value, generation=generation)
+
+    @timed_cache
+    def get_many(self, keys, version=None):
+        found, remote = self._l1_get_many(keys, version)
+        if remote:
+            generation = self.l1.generation
+            fetched = self.l2.get_many(remote, version=version)
+            self._l1_fill(remote, fetched, version, generation)
+            found.update(fetched)
+        return found
+
+    @timed_cache
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._ensure_subscriber()
+        self.l2.set(key, value, timeout=timeout, version=version)
+        l1_key = self._l1_key(key, version)
+        self._store(l1_key, value, timeout)
+        self._publish([l1_key])
+
+    @timed_cache
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._ensure_subscriber()
+        if not self.l2.add(key, value, timeout=timeout, version=version):
+            return False
+        l1_key = self._l1_key(key, version)
+        self._store(l1_key, value, timeout)
+        self._publish([l1_key])
+        return True
+
+    @timed_cache
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._ensure_subscriber()
+        failed = self.l2.set_many(data, timeout=timeout, version=version)
+        l1_keys = []
+        for key, value in data.items():
+            l1_key = self._l1_key(key, version)
+            self._store(l1_key, value, timeout)
+            l1_keys.append(l1_key)
+        self._publish(l1_keys)
+        return failed
+
+    @timed_cache
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout=timeout, version=version)
+
+    @timed_cache
+    def delete(self, key, version=None):
+        self._ensure_subscriber()
+        deleted = self.l2.delete(key, version=version)
+        l1_key = self._l1_key(key, version)
+        self.l1.discard([l1_key])
+        self._publish([l1_key])
+        return deleted
+
+    @timed_cache
+    def delete_many(self, keys, version=None):
+        self._ensure_subscriber()
+        self.l2.delete_many(keys, version=version)
+        l1_keys = [self._l1_key(key, version) for key in keys]
+        self.l1.discard(l1_keys)
+        self._publish(l1_keys)
+
+    @timed_cache
+    def incr(self, key, delta=1, version=None):
+        self._ensure_subscriber()
+        value = self.l2.incr(key, delta, version=version)
+        l1_key = self._l1_key(key, version)
+        self._store(l1_key, value)
+        self._publish([l1_key])
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self):
+        self._ensure_subscriber()
+        self.l2.clear()
+        self.l1.clear()
+        self._publish(clear=True)
+
+    # Async reads. An L1 hit never leaves the event loop. L1 misses are read with redis.asyncio when L2 is Redis,
+    # straight from memory when it is LocMemCache, and through the L2 backend's own async API otherwise. Writes
+    # only happen on misses, so the async views leave them to the sync methods.
+
+    def _async_redis(self):
+        from django_redis.cache import RedisCache
+        from django_redis.client import DefaultClient
+        from redis import asyncio as aioredis
+
+        loop = asyncio.get_running_loop()
+        clients = _async_clients.setdefault(loop, {})
+        if self.l2_alias not in clients:
+            l2 = self.l2
+            if not isinstance(l2, RedisCache) or type(l2.client) is not DefaultClient:
+                clients[self.l2_alias] = None
+            else:
+                clients[self.l2_alias] = aioredis.Redis.from_url(l2.client._server[0])
+        return clients[self.l2_alias]
+
+    async def _l2_aget_many(self, keys, version):
+        l2 = self.l2
+        if isinstance(l2, LocMemCache):
+            return l2.get_many(keys, version=version)
+        try:
+            client = self._async_redis()
+        except ImportError:
+            client = None
+        if client is None:
+            return await l2.aget_many(keys, version=version)
+        values = await client.mget([str(l2.client.make_key(key, version=version)) for key in keys])
+        return {key: l2.client.decode(value) for key, value in zip(keys, values) if value is not None}
+
+    @timed_cache
+    async def aget_many(self, keys, version=None):
+        found, remote = self._l1_get_many(keys, version)
+        if remote:
+            generation = self.l1.generation
+            fetched = await self._l2_aget_many(remote, version)
+            self._l1_fill(remote, fetched, version, generation)
+            found.update(fetched)
+        return found
+
+    async def aget(self, key, default=None, version=None):
+        return (await self.aget_many([key], version=version)).get(key, default)
+
+    def stats(self):
+        with self.l1.lock:
+            stats = dict(self.l1.stats)
+            stats['l1_entries'] = len(self.l1.entries)
+        lookups = sum(stats.get(name, 0) for name in ('l1_hits', 'l2_hits', 'misses'))
+        stats['l1_hit_rate'] = stats.get('l1_hits', 0) / lookups if lookups else 0.0
+        stats['l2_hit_rate'] = stats.get('l2_hits', 0) / lookups if lookups else 0.0
+        return stats
+
+    def reset_stats(self):
+        with self.l1.lock:
+            self.l1.stats.clear()
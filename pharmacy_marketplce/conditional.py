@@ -0,0 +1,35 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    """A strong ETag from whatever identifies one version of a response, e.g. a cache key with versions in it."""
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def set_validators(response, etag=None, last_modified=None, private=False):
+    """
+    Adds ETag/Last-Modified, and asks caches to revalidate before reusing the response. private=True keeps
+    shared caches from storing per-user responses at all.
+    """
+    if etag:
+        response.headers['ETag'] = etag
+    if last_modified:
+        response.headers['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, no_cache=True, private=private or None)
+    return response
+
+
+def not_modified(request, etag=None, last_modified=None, private=False):
+    """
+    The 304 Not Modified (or 412) response when the request's If-None-Match/If-Modified-Since say the client's
+    copy is current, otherwise None. Views call it with validators that are cheap to get, before building the body.
+    """
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is not None and response.status_code == 304:
+        set_validators(response, etag, last_modified, private)
+    return response
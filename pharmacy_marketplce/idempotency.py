@@ -0,0 +1,110 @@
+import functools
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05
+_PENDING = 'pending'
+
+
+def _cache_key(request, key):
+    user = request.user.pk if request.user and request.user.is_authenticated else 'anonymous'
+    scope = f'{user}\n{request.method}\n{request.path}\n{key}'
+    return f'idempotency:{hashlib.sha256(scope.encode()).hexdigest()}'
+
+
+def _fingerprint(request):
+    return hashlib.sha256(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _replay(entry):
+    response = Response(entry['data'], status=entry['status'])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+class _Hold:
+    """
+    Keeps the pending entry of a running request for IDEMPOTENCY_LOCK_TIMEOUT seconds past its last refresh, from
+    a background thread, so that a request running longer than that still holds its key while its worker lives.
+    """
+
+    def __init__(self, cache, cache_key):
+        self.cache, self.cache_key = cache, cache_key
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.refresh, name='idempotency-hold', daemon=True)
+        self.thread.start()
+
+    def refresh(self):
+        timeout = settings.IDEMPOTENCY_LOCK_TIMEOUT
+        while not self.stopped.wait(timeout / 3):
+            self.cache.touch(self.cache_key, timeout)
+
+    def release(self):
+        # Stopped before the entry is replaced, so a last refresh cannot shorten the stored response's timeout.
+        self.stopped.set()
+        self.thread.join()
+
+
+def idempotent(method):
+    """
+    Makes an APIView method safe to retry with an Idempotency-Key header. The first request with a key runs the
+    method and its status and data are kept in the default cache for IDEMPOTENCY_TIMEOUT seconds; retries with
+    the same key, user and body get them back without running it again, and retries arriving while it still
+    runs wait up to IDEMPOTENCY_WAIT seconds for them, then get a 409 with Retry-After. Server errors are not
+    kept, so those can be retried.
+
+    The running request holds the key for as long as it runs, and for at most IDEMPOTENCY_LOCK_TIMEOUT seconds
+    after its worker dies.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return method(self, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({'error': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        cache = caches['default']
+        cache_key, fingerprint = _cache_key(request, key), _fingerprint(request)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+        while not cache.add(cache_key, {'state': _PENDING, 'fingerprint': fingerprint},
+                            timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            entry = cache.get(cache_key)
+            if entry is None:
+                continue  # the first request failed or its hold expired, so this one runs
+            if entry['fingerprint'] != fingerprint:
+                return Response({'error': f'This {HEADER} was used with a different request.'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if entry['state'] != _PENDING:
+                return _replay(entry)
+            if time.monotonic() >= deadline:
+                return Response({'error': f'A request with this {HEADER} is still in progress.'},
+                                status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+            time.sleep(POLL_INTERVAL)
+
+        hold = _Hold(cache, cache_key)
+        try:
+            response = method(self, request, *args, **kwargs)
+        except BaseException:
+            hold.release()
+            cache.delete(cache_key)
+            raise
+        hold.release()
+        if response.status_code >= 500 or getattr(response, 'data', None) is None:
+            cache.delete(cache_key)
+        else:
+            cache.set(cache_key, {'state': 'done', 'fingerprint': fingerprint, 'status': response.status_code,
+                                  'data': response.data}, timeout=settings.IDEMPOTENCY_TIMEOUT)
+        return response
+
+    return wrapper
@@ -0,0 +1,175 @@
+import asyncio
+import concurrent.futures
+import itertools
+import multiprocessing
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+
+class LoadResult:
+    def __init__(self, duration):
+        self.duration = duration
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = Counter()
+
+    def merge(self, other):
+        """Adds the requests of another LoadResult that ran over the same period, e.g. in another process."""
+        self.duration = max(self.duration, other.duration)
+        self.latencies += other.latencies
+        self.statuses.update(other.statuses)
+        self.errors.update(other.errors)
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    @property
+    def rate(self):
+        return self.requests / self.duration
+
+    def percentile(self, percent):
+        """Latency in ms below which percent of the requests finished."""
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))] * 1000
+
+    def summary(self):
+        statuses = ', '.join(f'{status}: {count}' for status, count in sorted(self.statuses.items()))
+        errors = ', '.join(f'{error}: {count}' for error, count in self.errors.most_common()) or 'none'
+        if not self.latencies:
+            return f'no responses, errors {errors}'
+        return (f'{self.requests} requests in {self.duration:.1f} s, {self.rate:.0f} req/s, '
+                f'p50 {self.percentile(50):.1f} ms, p99 {self.percentile(99):.1f} ms, '
+                f'max {self.percentile(100):.1f} ms; statuses {statuses}; errors {errors}')
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError('connection closed')
+    status = int(status_line.split()[1])
+    length, close = None, status_line.startswith(b'HTTP/1.0')
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'connection':
+            close = value == b'close'
+        elif name == b'transfer-encoding' and value == b'chunked':
+            raise ValueError('chunked responses are not supported')
+    if length is None:
+        await reader.read()
+        close = True
+    else:
+        await reader.readexactly(length)
+    return status, close
+
+
+async def _client(host, port, requests, deadline, results, timeout):
+    writer = None
+    try:
+        while time.monotonic() < deadline:
+            name, data = next(requests)
+            result = results[name]
+            if writer is None:
+                try:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+                except (OSError, asyncio.TimeoutError) as e:
+                    result.errors[f'connect: {type(e).__name__}'] += 1
+                    await asyncio.sleep(0.1)
+                    continue
+            start = time.monotonic()
+            try:
+                writer.write(data)
+                status, close = await asyncio.wait_for(_read_response(reader), timeout)
+            except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                result.errors[type(e).__name__] += 1
+                writer.close()
+                writer = None
+                continue
+            result.latencies.append(time.monotonic() - start)
+            result.statuses[status] += 1
+            if close:
+                writer.close()
+                writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def http_request(netloc, method, path, headers=(), body=None):
+    """The bytes of one HTTP/1.1 request; a body is sent as JSON."""
+    lines = [f'{method} {path} HTTP/1.1', f'Host: {netloc}', 'Accept: application/json', *headers]
+    if body is not None:
+        lines += ['Content-Type: application/json', f'Content-Length: {len(body)}']
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b'')
+
+
+def _address(url):
+    parts = urlsplit(url)
+    if parts.scheme != 'http':
+        raise ValueError('Only http:// URLs are supported.')
+    return parts.hostname, parts.port or 80, parts.netloc, parts.path.rstrip('/')
+
+
+async def drive(url, requests, connections=100, duration=10.0, timeout=30.0):
+    """
+    Like run(), for mixed traffic: requests yields (name, request bytes) pairs, e.g. built with http_request(),
+    and the result is a LoadResult per name.
+    """
+    host, port, _, _ = _address(url)
+    results = defaultdict(lambda: LoadResult(duration))
+    start = time.monotonic()
+    await asyncio.gather(*[
+        _client(host, port, requests, start + duration, results, timeout) for _ in range(connections)
+    ])
+    for result in results.values():
+        result.duration = time.monotonic() - start
+    return dict(results)
+
+
+async def run(url, paths, connections=100, duration=10.0, headers=(), timeout=30.0):
+    """
+    Keeps `connections` keep-alive connections busy with GET requests for `duration` seconds, cycling through
+    `paths` (relative to url), and returns a LoadResult. Each connection sends its next request as soon as the
+    previous response is in, so the rate is what the server sustains at that concurrency.
+    """
+    _, _, netloc, base = _address(url)
+    requests = itertools.cycle([('', http_request(netloc, 'GET', base + path, headers)) for path in paths])
+    return (await drive(url, requests, connections, duration, timeout)).get('', LoadResult(duration))
+
+
+def _drive_process(url, make_requests, index, connections, duration, warmup, timeout):
+    _, _, netloc, base = _address(url)
+    if warmup:
+        asyncio.run(drive(url, make_requests(netloc, base, index), connections, warmup, timeout))
+    return asyncio.run(drive(url, make_requests(netloc, base, index), connections, duration, timeout))
+
+
+def run_processes(url, make_requests, processes=1, connections=100, duration=10.0, warmup=0.0, timeout=30.0):
+    """
+    drive() in several processes at once, so the load generator is not what limits the rate, and the results
+    merged by name. make_requests(netloc, base path, process index) returns the request iterator of a process; it
+    must be a module level function. The processes are forked, so it can use whatever the caller has loaded.
+    """
+    context = multiprocessing.get_context('fork')
+    with concurrent.futures.ProcessPoolExecutor(processes, mp_context=context) as pool:
+        futures = [
+            pool.submit(_drive_process, url, make_requests, index, connections, duration, warmup, timeout)
+            for index in range(processes)
+        ]
+        merged = {}
+        for future in futures:
+            for name, result in future.result().items():
+                if name in merged:
+                    merged[name].merge(result)
+                else:
+                    merged[name] = result
+    return merged
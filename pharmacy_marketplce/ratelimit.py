@@ -0,0 +1,143 @@
+import hashlib
+import math
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+# KEYS[1]: sorted set of the hits in the window, scored by time in ms.
+# ARGV: now (ms), window (ms), limit, member for this hit, 1 to record the hit or 0 to only look.
+# Returns {allowed, hits in the window, ms until the next hit is allowed}.
+SLIDING_WINDOW = """
+local now, window, limit = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+if count < limit then
+    if ARGV[5] == '1' then
+        redis.call('ZADD', KEYS[1], now, ARGV[4])
+        redis.call('PEXPIRE', KEYS[1], window)
+        count = count + 1
+    end
+    return {1, count, 0}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, count, tonumber(oldest[2]) + window - now}
+"""
+
+_RATE = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*([smhd])')
+_PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+def parse_rate(rate):
+    """
+    (limit, window in seconds) from DRF's rate format, which may also give the period a multiple:
+    '20/hour', '3/10min', '5/30s'.
+    """
+    match = _RATE.match(rate)
+    if match is None:
+        raise ValueError(f'Invalid rate {rate!r}, expected e.g. "20/hour" or "3/10min".')
+    limit, multiple, period = match.groups()
+    return int(limit), int(multiple or 1) * _PERIODS[period]
+
+
+class SlidingWindowLimiter:
+    """
+    Allows at most `limit` hits per key in any `window` seconds. On Redis the hits of a key are a sorted set that
+    one Lua script trims, counts and adds to, so that every worker shares the limits and concurrent hits cannot
+    both take the last place. Other cache backends, e.g. LocMemCache in tests, keep the same lists in the cache
+    under a process lock, which is exact within a single process only.
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self.lock = threading.Lock()
+        self.scripts = {}
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _script(self):
+        try:
+            from django_redis import get_redis_connection
+            from django_redis.cache import RedisCache
+        except ImportError:
+            return None
+        if not isinstance(self.cache, RedisCache):
+            return None
+        client = get_redis_connection(self.alias)
+        if client not in self.scripts:
+            self.scripts[client] = client.register_script(SLIDING_WINDOW)
+        return self.scripts[client]
+
+    def key(self, name):
+        # Hashed, so that any identifier, e.g. a phone number, makes a short and valid key.
+        return f'ratelimit:{hashlib.md5(name.encode()).hexdigest()}'
+
+    def _apply(self, name, limit, window, record):
+        now = time.time()
+        script = self._script()
+        if script is not None:
+            allowed, _, wait = script(
+                keys=[self.cache.make_key(self.key(name))],
+                args=[int(now * 1000), int(window * 1000), limit, uuid.uuid4().hex, int(record)],
+            )
+            return bool(allowed), wait / 1000
+        key = self.key(name)
+        with self.lock:
+            hits = [hit for hit in self.cache.get(key, ()) if hit > now - window]
+            if len(hits) >= limit:
+                return False, hits[0] + window - now
+            if record:
+                self.cache.set(key, [*hits, now], timeout=math.ceil(window))
+            return True, 0
+
+    def hit(self, name, limit, window):
+        """Records a hit unless over the limit. Returns (allowed, seconds until the next hit is allowed)."""
+        return self._apply(name, limit, window, record=True)
+
+    def peek(self, name, limit, window):
+        """Like hit() without recording it, for limits counting only some outcomes, e.g. failed logins."""
+        return self._apply(name, limit, window, record=False)
+
+    def reset(self, name):
+        self.cache.delete(self.key(name))
+
+
+limiter = SlidingWindowLimiter(getattr(settings, 'RATE_LIMIT_CACHE', 'default'))
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    A DRF throttle on the shared sliding window limiter, with DEFAULT_THROTTLE_RATES[scope] hits per window for
+    every identifier get_identifier() returns. By client IP unless a subclass says otherwise.
+    """
+    scope = None
+
+    def get_identifier(self, request, view):
+        return self.get_ident(request)
+
+    def allow_request(self, request, view):
+        identifier = self.get_identifier(request, view)
+        if identifier is None:
+            return True
+        limit, window = parse_rate(api_settings.DEFAULT_THROTTLE_RATES[self.scope])
+        allowed, self.retry_after = limiter.hit(f'{self.scope}:{identifier}', limit, window)
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class UserThrottle(SlidingWindowThrottle):
+    """By user, and by client IP for anonymous requests."""
+
+    def get_identifier(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
@@ -0,0 +1,41 @@
+from rest_framework.renderers import JSONRenderer
+
+from pharmacy_marketplce.metrics import timed_serialize
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer on top of orjson when it is installed, with the same output byte for byte.
+
+    Types orjson does not write the way DRF does go through DRF's own JSONEncoder.default(): Decimal, and dates
+    and times, which DRF writes with a "Z" for UTC. Pretty printing (the browsable API, "; indent=4"), ASCII only
+    output and a non-compact COMPACT_JSON setting, as well as anything orjson refuses, such as integers wider than
+    64 bits or keys that are not strings, are left to JSONRenderer. Unlike STRICT_JSON asks, orjson writes NaN and
+    infinity as null instead of failing; serializers in this project do not produce floats.
+    """
+
+    def __init__(self):
+        self.default = self.encoder_class().default
+        self.fast = orjson is not None and not self.ensure_ascii and self.compact
+
+    @timed_serialize
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.fast and self.get_indent(accepted_media_type, renderer_context or {}) is None:
+            try:
+                ret = orjson.dumps(data, default=self.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+            except orjson.JSONEncodeError:
+                pass
+            else:
+                # JSONRenderer escapes these so the output is also valid JavaScript. isascii() is much quicker than
+                # searching, and most responses are ASCII.
+                if not ret.isascii() and (b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret):
+                    ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+                return ret
+        return super().render(data, accepted_media_type, renderer_context)
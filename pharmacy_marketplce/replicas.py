@@ -0,0 +1,110 @@
+import contextlib
+import contextvars
+import hashlib
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+from django.urls import Resolver404, resolve
+
+# The replica the current request reads from, None for the primary.
+_read_alias = contextvars.ContextVar('read_alias', default=None)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class PrimaryReplicaRouter:
+    """
+    Writes, and reads outside a replica-routed request, go to the primary. ReplicaReadsMiddleware picks the
+    replica for the read-only views.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+@contextlib.contextmanager
+def reading_from(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def cache_timeout(timeout):
+    """
+    Caps the timeout of a cache entry filled from a replica. A replica that lags behind a version bump would
+    otherwise put old data under the new key for the entry's whole lifetime.
+    """
+    if _read_alias.get() is None:
+        return timeout
+    cap = settings.DATABASE_REPLICA_CACHE_TIMEOUT
+    return cap if timeout is None else min(timeout, cap)
+
+
+def _sticky_key(request):
+    credentials = request.META.get('HTTP_AUTHORIZATION')
+    return f'db-primary:{hashlib.md5(credentials.encode()).hexdigest()}' if credentials else None
+
+
+def _read_only(request):
+    try:
+        view = resolve(request.path_info).func
+    except Resolver404:
+        return False
+    return getattr(getattr(view, 'cls', view), 'replica_reads', False)
+
+
+class ReplicaReadsMiddleware:
+    """
+    Sends the reads of views with replica_reads = True to a random replica, unless the same credentials wrote
+    something in the last DATABASE_REPLICA_STICKY_SECONDS: those clients read their own writes from the primary
+    until the replicas have caught up. Not used when no replica is configured.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.replicas = list(settings.DATABASE_REPLICAS)
+        if not self.replicas:
+            raise MiddlewareNotUsed
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        key, alias = _sticky_key(request), None
+        if request.method in SAFE_METHODS:
+            if _read_only(request) and (key is None or caches['default'].get(key) is None):
+                alias = random.choice(self.replicas)
+        with reading_from(alias):
+            response = self.get_response(request)
+        if request.method not in SAFE_METHODS and key and response.status_code < 400:
+            caches['default'].set(key, 1, timeout=settings.DATABASE_REPLICA_STICKY_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        key, alias = _sticky_key(request), None
+        if request.method in SAFE_METHODS:
+            if _read_only(request) and (key is None or await caches['default'].aget(key) is None):
+                alias = random.choice(self.replicas)
+        with reading_from(alias):
+            response = await self.get_response(request)
+        if request.method not in SAFE_METHODS and key and response.status_code < 400:
+            await caches['default'].aset(key, 1, timeout=settings.DATABASE_REPLICA_STICKY_SECONDS)
+        return response
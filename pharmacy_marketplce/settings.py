@@ -2,6 +2,9 @@ from pathlib import Path
 from datetime import timedelta
 import os
 
+from corsheaders.defaults import default_headers
+from pharmacy_marketplce.databases import databases
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -39,7 +42,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'pharmacy_marketplce.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'pharmacy_marketplce.replicas.ReplicaReadsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,12 +79,22 @@ WSGI_APPLICATION = 'pharmacy_marketplce.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+# DATABASE_URL picks the primary (SQLite in WAL mode by default) and DATABASE_REPLICA_URLS, comma separated, the
+# read replicas. Connections are kept open for CONN_MAX_AGE seconds; Django 5.0 has no pool of its own, so put
+# PgBouncer in front of PostgreSQL and set DATABASE_DISABLE_SERVER_SIDE_CURSORS=1 for its transaction pooling.
+DATABASES = databases(
+    os.getenv('DATABASE_URL', f'sqlite:///{BASE_DIR / "db.sqlite3"}'),
+    [url for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url],
+    conn_max_age=int(os.getenv('CONN_MAX_AGE', 60)),
+    health_checks=True,
+    disable_server_side_cursors=os.getenv('DATABASE_DISABLE_SERVER_SIDE_CURSORS', '') not in ('', '0'),
+)
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['pharmacy_marketplce.replicas.PrimaryReplicaRouter']
+# After a write, the same client reads from the primary for this long; set it above the replicas' usual lag.
+DATABASE_REPLICA_STICKY_SECONDS = int(os.getenv('DATABASE_REPLICA_STICKY_SECONDS', 5))
+# Cache entries filled from a replica expire after at most this long, in case the replica was behind.
+DATABASE_REPLICA_CACHE_TIMEOUT = int(os.getenv('DATABASE_REPLICA_CACHE_TIMEOUT', 30))
 
 
 # Password validation
@@ -101,6 +116,29 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# The first hasher hashes new passwords; the others only verify older hashes, which are hashed again with the first
+# one at the next login. Time the costs on the production CPU with manage.py bench_login.
+PASSWORD_HASHERS = list(dict.fromkeys([
+    os.getenv('PASSWORD_HASHER', 'users.hashers.ConfigurablePBKDF2PasswordHasher'),
+    'users.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]))
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv('PASSWORD_PBKDF2_ITERATIONS', 720000))
+
+# Password hashes run in a pool of LOGIN_HASH_WORKERS threads (0 hashes in the request thread), and logins beyond
+# LOGIN_HASH_QUEUE waiting ones get a 503. A username and IP pair gets LOGIN_MAX_FAILURES_PER_USERNAME failed
+# logins, an IP LOGIN_MAX_FAILURES_PER_IP, in any LOGIN_FAILURE_WINDOW seconds, then a 429 without hashing. A verified
+# password is remembered for LOGIN_VERIFIED_TIMEOUT seconds (0 turns it off), so logging in again skips hashing.
+LOGIN_HASH_WORKERS = int(os.getenv('LOGIN_HASH_WORKERS', os.cpu_count() or 1))
+LOGIN_HASH_QUEUE = int(os.getenv('LOGIN_HASH_QUEUE', 32))
+LOGIN_MAX_FAILURES_PER_USERNAME = int(os.getenv('LOGIN_MAX_FAILURES_PER_USERNAME', 10))
+LOGIN_MAX_FAILURES_PER_IP = int(os.getenv('LOGIN_MAX_FAILURES_PER_IP', 100))
+LOGIN_FAILURE_WINDOW = int(os.getenv('LOGIN_FAILURE_WINDOW', 15 * 60))
+LOGIN_VERIFIED_TIMEOUT = int(os.getenv('LOGIN_VERIFIED_TIMEOUT', 15 * 60))
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
@@ -131,15 +169,48 @@ AUTH_USER_MODEL = 'users.CustomUser'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'users.authentication.CachedJWTAuthentication',
+    ),
+    # orjson based, falling back to DRF's JSON renderer and parser when it is not installed.
+    'DEFAULT_RENDERER_CLASSES': (
+        'pharmacy_marketplce.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'pharmacy_marketplce.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    # Sliding windows shared by the workers (pharmacy_marketplce.ratelimit); '3/10min' is 3 per 10 minutes.
+    'DEFAULT_THROTTLE_RATES': {
+        'otp-request-ip': os.getenv('THROTTLE_OTP_REQUEST_IP', '20/hour'),
+        'otp-request-phone': os.getenv('THROTTLE_OTP_REQUEST_PHONE', '3/10min'),
+        'otp-verify-ip': os.getenv('THROTTLE_OTP_VERIFY_IP', '30/hour'),
+        'otp-verify-phone': os.getenv('THROTTLE_OTP_VERIFY_PHONE', '10/hour'),
+    },
+    # Behind a proxy, set to the number of proxies so that the client IP is taken from X-Forwarded-For.
+    'NUM_PROXIES': int(os.environ['NUM_PROXIES']) if os.getenv('NUM_PROXIES') else None,
 }
 
+# Responses to requests with an Idempotency-Key (order creation) are kept for IDEMPOTENCY_TIMEOUT seconds. A retry
+# arriving while the first request runs waits up to IDEMPOTENCY_WAIT seconds for its response. The running request
+# refreshes its hold on the key while it runs, which lapses IDEMPOTENCY_LOCK_TIMEOUT seconds after its worker dies.
+IDEMPOTENCY_TIMEOUT = int(os.getenv('IDEMPOTENCY_TIMEOUT', 60 * 60 * 24))
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT', 10))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', 60))
+
+# OTP codes for password resets expire after OTP_TIMEOUT seconds, and each can be tried OTP_MAX_ATTEMPTS times.
+OTP_TIMEOUT = int(os.getenv('OTP_TIMEOUT', 60))
+OTP_MAX_ATTEMPTS = int(os.getenv('OTP_MAX_ATTEMPTS', 5))
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=24),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=30),
 }
 
+# Authenticated requests take the user from the cache; saving or deleting a user invalidates its entry at once.
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', 300))
+
 SWAGGER_SETTINGS = {
    'SECURITY_DEFINITIONS': {
        'Bearer': {
@@ -151,17 +222,59 @@ SWAGGER_SETTINGS = {
    }
 }
 
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/1')
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": os.getenv('REDIS_URL', 'redis://localhost:6379/1'),
+        "LOCATION": REDIS_URL,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
+    } if REDIS_URL != 'locmem://' else {
+        # A stand-in for Redis where there is none, e.g. for local load tests. Every process has its own cache, so
+        # run a single worker with it.
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    },
+    # In-process LRU in front of "default" for the hot catalog reads, kept coherent through Redis pub/sub.
+    "tiered": {
+        "BACKEND": "pharmacy_marketplce.cache_backends.TwoTierCache",
+        "LOCATION": "default",
+        "OPTIONS": {
+            "L1_MAX_ENTRIES": int(os.getenv('CACHE_L1_MAX_ENTRIES', 2000)),
+            "L1_TIMEOUT": int(os.getenv('CACHE_L1_TIMEOUT', 5)),
+        }
     }
 }
 
+# ASYNC_READ_VIEWS=1 serves the catalog and order reads and logins with async views. Set it only when running under
+# an ASGI server (uvicorn pharmacy_marketplce.asgi:application); under the default WSGI servers they would only add
+# an event loop per request.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', '') not in ('', '0')
+
+# Every request is timed by route for /metrics; this share of them also records its queries, cache lookups and JSON
+# rendering. Each worker stores its metrics in the default cache every METRICS_PUSH_INTERVAL seconds, so that the
+# worker answering a scrape reports all of them. With METRICS_TOKEN set, /metrics wants it as a Bearer token.
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', 0.1))
+METRICS_PUSH_INTERVAL = int(os.getenv('METRICS_PUSH_INTERVAL', 5))
+METRICS_WORKER_TIMEOUT = int(os.getenv('METRICS_WORKER_TIMEOUT', 60 * 60 * 24))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+DRUGS_PAGE_SIZE = int(os.getenv('DRUGS_PAGE_SIZE', 50))
+DRUGS_MAX_PAGE_SIZE = int(os.getenv('DRUGS_MAX_PAGE_SIZE', 200))
+# Search pages past this one are refused: each page reads and skips every match before it.
+DRUG_SEARCH_MAX_PAGE = int(os.getenv('DRUG_SEARCH_MAX_PAGE', 100))
+# Batch sizes of /drugs/changes/, and how old a change must be before it is served: a writer still inside its
+# transaction can commit a lower sequence number after a higher one has been read.
+DRUG_CHANGES_PAGE_SIZE = int(os.getenv('DRUG_CHANGES_PAGE_SIZE', 500))
+DRUG_CHANGES_MAX_PAGE_SIZE = int(os.getenv('DRUG_CHANGES_MAX_PAGE_SIZE', 2000))
+DRUG_CHANGES_SETTLE_SECONDS = float(os.getenv('DRUG_CHANGES_SETTLE_SECONDS', 2))
+# Threads creating image thumbnails in the background; 0 processes images synchronously.
+DRUG_IMAGE_WORKERS = int(os.getenv('DRUG_IMAGE_WORKERS', 2))
+
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 CORS_ALLOW_CREDENTIALS = True
 
 CORS_ALLOW_CREDENTIALS = True
\ No newline at end of file
@@ -6,6 +6,8 @@ from rest_framework import permissions
 from django.conf import settings
 from django.conf.urls.static import static
 
+from pharmacy_marketplce.metrics import metrics_view
+
 schema_view = get_schema_view(
    openapi.Info(
       title="Pharmacy Marketplace API",
@@ -21,6 +23,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls')),
     path('drugs/', include('drugs.urls')),
+    path('metrics', metrics_view, name='metrics'),
 
     re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
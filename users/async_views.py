@@ -0,0 +1,62 @@
+from rest_framework import exceptions, serializers
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from pharmacy_marketplce.async_views import authenticate, json_response
+from pharmacy_marketplce.conditional import not_modified, set_validators
+from drugs import fragments
+from .login import LoginBusy, TooManyAttempts, averify_credentials, client_ip
+from .models import OrderModel
+from .serializers import LoginSerializer, aorder_etag, arender_order, arepresent_orders
+
+
+async def order_list(request):
+    request_user, response = await authenticate(request)
+    if response is not None:
+        return response
+    try:
+        orders = await arepresent_orders(OrderModel.objects.filter(user=request_user))
+    except Exception as e:
+        return json_response({'error': 'An error occurred.', 'message': str(e)}, status=500)
+    return json_response(orders)
+
+
+async def order_detail(request, pk):
+    request_user, response = await authenticate(request)
+    if response is not None:
+        return response
+    try:
+        order = await OrderModel.objects.with_item_rows().aget(pk=pk)
+    except OrderModel.DoesNotExist:
+        return json_response({'error': 'Order not found.'}, status=404)
+    except Exception as e:
+        return json_response({'error': 'An error occurred.', 'message': str(e)}, status=500)
+    if request_user.role == 'admin' or request_user.pk == order.user_id:
+        etag = await aorder_etag(order)
+        response = not_modified(request, etag, private=True)
+        if response is not None:
+            return response
+        return set_validators(fragments.json_response(await arender_order(order)), etag, private=True)
+    return json_response('You are not authorized to view this page.', status=401)
+
+
+async def login(request):
+    """LoginView.post, waiting for the password hash without holding the worker's thread."""
+    try:
+        data = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES]).data
+        credentials = LoginSerializer().to_internal_value(data)
+        user = await averify_credentials(credentials['username'], credentials['password'], client_ip(request))
+        tokens = LoginSerializer.tokens(user)
+    except exceptions.ValidationError as e:
+        return json_response(serializers.as_serializer_error(e), status=400)
+    except exceptions.APIException as e:
+        return json_response({'detail': e.detail}, status=e.status_code)
+    except TooManyAttempts as e:
+        response = json_response({'error': str(e)}, status=429)
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    except LoginBusy as e:
+        response = json_response({'error': str(e)}, status=503)
+        response.headers['Retry-After'] = '1'
+        return response
+    return json_response(tokens)
@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import DEFERRED
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from drugs.cache import bump, cache, make_key
+from pharmacy_marketplce.replicas import cache_timeout
+from .models import CustomUser
+
+
+def user_namespace(user_id):
+    return f'user:{user_id}'
+
+
+def invalidate_user(user_id):
+    bump(user_namespace(user_id))
+
+
+def _fields():
+    # The password hash is not cached; it is loaded on access, which only password changes and logins do.
+    return [field for field in CustomUser._meta.concrete_fields if field.attname != 'password']
+
+
+def get_cached_user(user_id):
+    """
+    The user with this primary key, or None. The row is cached under a key versioned by user_namespace(), which
+    users/signals.py bumps when a user is saved or deleted, so role, is_active and password changes are seen by
+    the next request. Every call returns a new instance: the cache may hand out the same object to every thread.
+    The instance's revoke_token_hash is what CHECK_REVOKE_TOKEN compares tokens with.
+    """
+    key = make_key('auth-user', [user_namespace(user_id)])
+    row = cache.get(key)
+    if row is None:
+        row = CustomUser.objects.filter(pk=user_id).values('password', *(field.attname for field in _fields())).first()
+        if row is None:
+            return None
+        row['revoke_token_hash'] = get_md5_hash_password(row.pop('password'))
+        cache.set(key, row, timeout=cache_timeout(settings.AUTH_USER_CACHE_TIMEOUT))
+    fields = _fields()
+    # A field added since the row was cached is left deferred and loaded on access.
+    user = CustomUser.from_db(
+        DEFAULT_DB_ALIAS, [field.attname for field in fields], [row.get(field.attname, DEFERRED) for field in fields],
+    )
+    user.revoke_token_hash = row['revoke_token_hash']
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that takes the user from the cache rather than the database."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        if api_settings.USER_ID_FIELD != CustomUser._meta.pk.attname:
+            return super().get_user(validated_token)
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != user.revoke_token_hash:
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
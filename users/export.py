@@ -0,0 +1,27 @@
+from drugs.export import CHUNK_SIZE
+
+from .models import OrderItemModel
+
+# One row per order item, with the order and drug columns it needs repeated.
+ORDER_COLUMNS = (
+    'order_id', 'created_at', 'status', 'user_id', 'total_price', 'item_id', 'drug_id', 'drug_name', 'seller_id',
+    'quantity', 'price',
+)
+# An order can hold the drugs of several sellers, so a seller does not get its buyer or its total.
+SELLER_ORDER_COLUMNS = tuple(column for column in ORDER_COLUMNS if column not in ('user_id', 'total_price'))
+ORDER_FIELDS = dict(zip(ORDER_COLUMNS, (
+    'order_id', 'order__created_at', 'order__status', 'order__user_id', 'order__total_price', 'id', 'drug_id',
+    'drug__drug_name', 'drug__seller_id', 'quantity', 'price',
+)))
+
+
+def order_rows(seller_id=None, user_id=None, columns=ORDER_COLUMNS, **lookups):
+    """Order item rows; lookups use the parse_date_range() names for the order's created_at."""
+    queryset = OrderItemModel.objects.filter(
+        **{f'order__{lookup}': value for lookup, value in lookups.items()}
+    ).order_by('order_id', 'id')
+    if seller_id is not None:
+        queryset = queryset.filter(drug__seller_id=seller_id)
+    if user_id is not None:
+        queryset = queryset.filter(order__user_id=user_id)
+    return queryset.values_list(*(ORDER_FIELDS[column] for column in columns)).iterator(chunk_size=CHUNK_SIZE)
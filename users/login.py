@@ -0,0 +1,179 @@
+import asyncio
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from django.core.cache import caches
+from django.utils.crypto import salted_hmac
+from rest_framework.throttling import BaseThrottle
+
+from pharmacy_marketplce import ratelimit
+from .models import CustomUser
+
+
+class TooManyAttempts(Exception):
+    def __init__(self, retry_after):
+        super().__init__('Too many failed login attempts. Try again later.')
+        self.retry_after = retry_after
+
+
+class LoginBusy(Exception):
+    def __init__(self):
+        super().__init__('Too many logins in progress. Try again shortly.')
+
+
+def client_ip(request):
+    # As the throttles see it, with NUM_PROXIES taken into account.
+    return BaseThrottle().get_ident(request) if request is not None else ''
+
+
+class AttemptLimiter:
+    """
+    Counts failed logins in sliding windows of LOGIN_FAILURE_WINDOW seconds, per username and client IP and per
+    client IP alone, on the shared rate limiter so that every worker sees them. Over the limit a login is refused
+    before its password is hashed. Per username and IP rather than per username, so that nobody can lock a user out.
+    """
+
+    def limits(self, username, ip):
+        return {
+            f'login-failures:user:{username.lower()}\n{ip}': settings.LOGIN_MAX_FAILURES_PER_USERNAME,
+            f'login-failures:ip:{ip}': settings.LOGIN_MAX_FAILURES_PER_IP,
+        }
+
+    def check(self, username, ip):
+        for name, limit in self.limits(username, ip).items():
+            allowed, retry_after = ratelimit.limiter.peek(name, limit, settings.LOGIN_FAILURE_WINDOW)
+            if not allowed:
+                raise TooManyAttempts(math.ceil(retry_after))
+
+    def fail(self, username, ip):
+        for name, limit in self.limits(username, ip).items():
+            ratelimit.limiter.hit(name, limit, settings.LOGIN_FAILURE_WINDOW)
+
+    def succeed(self, username, ip):
+        ratelimit.limiter.reset(next(iter(self.limits(username, ip))))
+
+
+limiter = AttemptLimiter()
+
+
+class HashingPool:
+    """
+    At most LOGIN_HASH_WORKERS password hashes run at a time, so a burst of logins cannot take every CPU from the
+    other requests; with more than LOGIN_HASH_QUEUE waiting, further logins are turned away at once rather than
+    queued behind them. hashlib releases the GIL, so the hashes of several workers run in parallel.
+    """
+
+    def __init__(self):
+        self.executor = None
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def _submit(self, function, *args):
+        workers = settings.LOGIN_HASH_WORKERS
+        with self.lock:
+            if self.pending >= workers + settings.LOGIN_HASH_QUEUE:
+                raise LoginBusy()
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login-hashing')
+            self.pending += 1
+        try:
+            future = self.executor.submit(function, *args)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def run(self, function, *args):
+        if not settings.LOGIN_HASH_WORKERS:
+            return function(*args)
+        return self._submit(function, *args).result()
+
+    async def arun(self, function, *args):
+        """run() for async views, which wait for the hash without holding a thread."""
+        if not settings.LOGIN_HASH_WORKERS:
+            return await sync_to_async(function, thread_sensitive=False)(*args)
+        return await asyncio.wrap_future(self._submit(function, *args))
+
+
+pool = HashingPool()
+
+
+def _verify(password, encoded):
+    """
+    Returns (valid, encoded), the second being the password hashed again when the preferred hasher or its cost
+    changed since, e.g. a new PASSWORD_PBKDF2_ITERATIONS.
+    """
+    if encoded is None:
+        # Hash anyway, so that unknown usernames take as long as wrong passwords, as ModelBackend does.
+        make_password(password)
+        return False, None
+    if not check_password(password, encoded):
+        return False, encoded
+    preferred = get_hasher()
+    if identify_hasher(encoded).algorithm != preferred.algorithm or preferred.must_update(encoded):
+        return True, make_password(password, hasher=preferred)
+    return True, encoded
+
+
+def _verified_key(user, password):
+    # Bound to the stored hash, so a password change, or rehashing, leaves the old entries unused.
+    return f'login-verified:{salted_hmac("users.login", f"{user.pk}:{user.password}:{password}").hexdigest()}'
+
+
+def _find_user(username, password):
+    """(user or None, whether its password was verified recently)."""
+    user = CustomUser._default_manager.filter(**{CustomUser.USERNAME_FIELD: username}).first()
+    remembered = (user is not None and settings.LOGIN_VERIFIED_TIMEOUT
+                  and caches['default'].get(_verified_key(user, password)))
+    return user, bool(remembered)
+
+
+def _finish(user, username, password, ip, valid, encoded):
+    """Saves a rehashed password, remembers or counts the attempt and returns verify_credentials()'s result."""
+    valid = valid and user.is_active
+    if valid:
+        if encoded != user.password:
+            user.password = encoded
+            user.save(update_fields=['password'])
+        if settings.LOGIN_VERIFIED_TIMEOUT:
+            caches['default'].set(_verified_key(user, password), 1, timeout=settings.LOGIN_VERIFIED_TIMEOUT)
+    if not valid:
+        limiter.fail(username, ip)
+        return None
+    limiter.succeed(username, ip)
+    return user
+
+
+def verify_credentials(username, password, ip=''):
+    """
+    The active user with this username and password, or None. Works like authenticate() with ModelBackend but
+    hashes in the pool, behind the attempt limiter. A successful check is remembered for LOGIN_VERIFIED_TIMEOUT
+    seconds under an HMAC of the user, the stored hash and the password, so that logging in again skips hashing.
+    """
+    limiter.check(username, ip)
+    user, remembered = _find_user(username, password)
+    if remembered:
+        valid, encoded = True, user.password
+    else:
+        valid, encoded = pool.run(_verify, password, user.password if user is not None else None)
+    return _finish(user, username, password, ip, valid, encoded)
+
+
+async def averify_credentials(username, password, ip=''):
+    """verify_credentials() for async views: the request's thread is free while the password is hashed."""
+    await sync_to_async(limiter.check)(username, ip)
+    user, remembered = await sync_to_async(_find_user)(username, password)
+    if remembered:
+        valid, encoded = True, user.password
+    else:
+        valid, encoded = await pool.arun(_verify, password, user.password if user is not None else None)
+    return await sync_to_async(_finish)(user, username, password, ip, valid, encoded)
@@ -0,0 +1,77 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from pharmacy_marketplce import ratelimit
+from users.hashers import ConfigurablePBKDF2PasswordHasher
+from users.login import TooManyAttempts, limiter, verify_credentials
+from users.models import CustomUser
+
+USERNAME = 'bench-login'
+PASSWORD = 'bench-login-password'
+IP = '192.0.2.1'
+
+
+class Command(BaseCommand):
+    help = ('Times PBKDF2 password hashing at several iteration counts, to pick PASSWORD_PBKDF2_ITERATIONS for this '
+            'CPU, and measures logins/sec when the password is hashed, when a verified password is remembered and '
+            'when the attempt limiter refuses a flood of wrong passwords. Creates and deletes a "bench-login" user.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, nargs='+', default=[100000, 260000, 600000, 720000, 1000000])
+        parser.add_argument('--rounds', type=int, default=5, help='Hashes timed per iteration count.')
+        parser.add_argument('--logins', type=int, default=200)
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent logins.')
+
+    def time_hashes(self, iterations, rounds):
+        timings = []
+        for _ in range(rounds):
+            with override_settings(PASSWORD_PBKDF2_ITERATIONS=iterations):
+                start = time.perf_counter()
+                make_password(PASSWORD, hasher=ConfigurablePBKDF2PasswordHasher())
+                timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    def logins(self, count, threads, password, **overrides):
+        def login(number):
+            try:
+                return verify_credentials(USERNAME, password, IP) is not None
+            except TooManyAttempts:
+                return False
+
+        with override_settings(**overrides), ThreadPoolExecutor(threads) as executor:
+            for name in limiter.limits(USERNAME, IP):
+                ratelimit.limiter.reset(name)
+            login(0)  # remembers the password, or counts the first failure
+            start = time.perf_counter()
+            accepted = sum(executor.map(login, range(count)))
+            elapsed = time.perf_counter() - start
+        return count / elapsed, accepted
+
+    def handle(self, *args, **options):
+        self.stdout.write('PBKDF2-SHA256, one hash:')
+        for iterations in options['iterations']:
+            seconds = self.time_hashes(iterations, options['rounds'])
+            marker = '  <- PASSWORD_PBKDF2_ITERATIONS' if iterations == settings.PASSWORD_PBKDF2_ITERATIONS else ''
+            self.stdout.write(f'  {iterations:>8} iterations: {seconds * 1000:7.1f} ms, {1 / seconds:6.1f} hashes/s per core{marker}')
+
+        CustomUser.objects.filter(username=USERNAME).delete()
+        CustomUser.objects.create_user(username=USERNAME, password=PASSWORD, phone='+000000000000')
+        count, threads = options['logins'], options['threads']
+        try:
+            self.stdout.write(f'{count} logins, {threads} at a time, {settings.LOGIN_HASH_WORKERS} hashing workers:')
+            runs = [
+                ('hashed', PASSWORD, {'LOGIN_VERIFIED_TIMEOUT': 0}),
+                ('remembered', PASSWORD, {}),
+                ('wrong, limited', 'wrong-password', {'LOGIN_MAX_FAILURES_PER_IP': 1}),
+            ]
+            for name, password, overrides in runs:
+                rate, accepted = self.logins(count, threads, password, **overrides)
+                self.stdout.write(f'  {name:>14}: {rate:8.1f} logins/s, {accepted} accepted')
+        finally:
+            CustomUser.objects.filter(username=USERNAME).delete()
@@ -0,0 +1,59 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.test import APIRequestFactory
+
+from pharmacy_marketplce import ratelimit
+from users.throttles import OTPRequestIPThrottle, OTPRequestPhoneThrottle
+
+
+class Command(BaseCommand):
+    help = ('Times one rate limit check on the configured cache, the Lua sliding window on Redis, alone and as the '
+            'throttles of the forgot-password view, which should stay well under 1 ms.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checks', type=int, default=5000)
+        parser.add_argument('--keys', type=int, default=1000, help='Distinct identifiers the checks are spread over.')
+        parser.add_argument('--limit', type=int, default=20, help='Hits allowed per identifier and window.')
+
+    def report(self, name, timings):
+        timings.sort()
+        quantiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(
+            f'{name:>25}: mean {statistics.fmean(timings):7.1f} us, p50 {quantiles[49]:7.1f} us, '
+            f'p99 {quantiles[98]:7.1f} us, max {timings[-1]:7.1f} us'
+        )
+
+    def handle(self, *args, **options):
+        limiter, checks, keys = ratelimit.limiter, options['checks'], options['keys']
+        backend = 'Redis (Lua)' if limiter._script() is not None else type(limiter.cache).__name__
+        self.stdout.write(f'{checks} checks over {keys} keys on {backend}:')
+        names = [f'bench:{number}' for number in range(keys)]
+        try:
+            timings = []
+            for number in range(checks):
+                start = time.perf_counter()
+                limiter.hit(names[number % keys], options['limit'], 3600)
+                timings.append((time.perf_counter() - start) * 1e6)
+            self.report('hit', timings)
+
+            factory = APIRequestFactory()
+            throttles = [OTPRequestIPThrottle(), OTPRequestPhoneThrottle()]
+            timings = []
+            for number in range(checks):
+                request = factory.post('/users/forgot-password/', {'phone': f'+{number % keys:012d}'}, format='json',
+                                       REMOTE_ADDR=f'192.0.2.{number % 250}')
+                request = Request(request, parsers=[api_settings.DEFAULT_PARSER_CLASSES[0]()])
+                request.data  # parsed before timing, as DRF has done by the time the throttles run
+                start = time.perf_counter()
+                for throttle in throttles:
+                    throttle.allow_request(request, None)
+                timings.append((time.perf_counter() - start) * 1e6)
+                names.extend(f'{throttle.scope}:{throttle.get_identifier(request, None)}' for throttle in throttles)
+            self.report('forgot-password throttles', timings)
+        finally:
+            for name in set(names):
+                limiter.reset(name)
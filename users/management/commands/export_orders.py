@@ -0,0 +1,10 @@
+from drugs.management.commands import export_drugs
+from users.export import ORDER_COLUMNS, order_rows
+
+
+class Command(export_drugs.Command):
+    help = 'Streams order items to a CSV or NDJSON file without loading them into memory.'
+    columns = ORDER_COLUMNS
+
+    def rows(self, seller_id, lookups):
+        return order_rows(seller_id=seller_id, **lookups)
@@ -0,0 +1,187 @@
+import functools
+import json
+import random
+import subprocess
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Min
+from rest_framework_simplejwt.tokens import AccessToken
+
+from drugs.models import Drug, DrugFacetCount
+from pharmacy_marketplce import loadgen
+from pharmacy_marketplce.loadgen import LoadResult
+from users.models import CustomUser
+
+# name -> share of the requests
+SCENARIOS = {
+    'browse': 30,     # GET /drugs/, the first page, half of the time filtered by category
+    'detail': 30,     # GET /drugs/{id}/
+    'search': 20,     # GET /drugs/search/?query=...
+    'history': 10,    # GET /users/orders/ as a buyer
+    'checkout': 10,   # POST /users/orders/ as a buyer, one item
+}
+# Compared by --compare; rate must not drop and latencies must not grow by more than --threshold percent.
+COMPARED = (('rate', -1), ('p50_ms', 1), ('p95_ms', 1), ('p99_ms', 1))
+
+
+def scenario_requests(plan, netloc, base, index):
+    """The endless, seeded request mix of one load generating process."""
+    rng = random.Random(plan['seed'] * 1000 + index)
+    names = [name for name, weight in plan['scenarios'].items() for _ in range(weight)]
+    drugs, queries, categories, tokens = plan['drugs'], plan['queries'], plan['categories'], plan['tokens']
+    while True:
+        name = rng.choice(names)
+        method, headers, body = 'GET', (), None
+        if name == 'browse':
+            params = {'page_size': 50}
+            if categories and rng.random() < 0.5:
+                params['category'] = rng.choice(categories)
+            path = f'/drugs/?{urlencode(params)}'
+        elif name == 'detail':
+            path = f'/drugs/{rng.choice(drugs)[0]}/'
+        elif name == 'search':
+            path = f'/drugs/search/?{urlencode({"query": rng.choice(queries)})}'
+        else:
+            path, headers = '/users/orders/', (f'Authorization: Bearer {rng.choice(tokens)}',)
+            if name == 'checkout':
+                drug_id, price = rng.choice(drugs)
+                method = 'POST'
+                body = json.dumps({'items': [{'drug': drug_id, 'quantity': 1, 'price': price}]}).encode()
+        yield name, loadgen.http_request(netloc, method, base + path, headers, body)
+
+
+def summarize(result):
+    def percentile(percent):
+        return round(result.percentile(percent), 2) if result.latencies else None
+
+    return {
+        'requests': result.requests,
+        'rate': round(result.rate, 1),
+        'p50_ms': percentile(50),
+        'p95_ms': percentile(95),
+        'p99_ms': percentile(99),
+        'max_ms': percentile(100),
+        'statuses': {str(status): count for status, count in sorted(result.statuses.items())},
+        'errors': sum(result.errors.values()),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold):
+    """Lines describing the changes from baseline to current, and the names of the regressed scenarios."""
+    lines, regressed = [], []
+    for name, now in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        changes = []
+        for key, direction in COMPARED:
+            if not before[key] or now[key] is None:
+                continue
+            change = (now[key] - before[key]) / before[key] * 100
+            flag = ' !' if change * direction > threshold else ''
+            if flag and name not in regressed:
+                regressed.append(name)
+            changes.append(f'{key} {before[key]:g} -> {now[key]:g} ({change:+.1f}%){flag}')
+        if now['errors'] > before['errors']:
+            changes.append(f'errors {before["errors"]} -> {now["errors"]} !')
+            if name not in regressed:
+                regressed.append(name)
+        lines.append(f'{name:<9} ' + ', '.join(changes))
+    return lines, regressed
+
+
+class Command(BaseCommand):
+    help = ('Load tests a running server with a seeded mix of catalog browsing, drug details, search, order '
+            'history and checkout (see seed_data), from several processes, and reports throughput and p50/p95/p99 '
+            'latency per scenario as JSON. Run it with the settings, and so the database, of the server under test. '
+            '--compare shows the changes from an earlier report and fails on regressions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--processes', type=int, default=2, help='Load generating processes.')
+        parser.add_argument('--connections', type=int, default=50, help='Connections per process.')
+        parser.add_argument('--duration', type=float, default=30)
+        parser.add_argument('--warmup', type=float, default=5, help='Seconds of load before measuring.')
+        parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                            help='Run only this scenario; repeat for several. All of them by default.')
+        parser.add_argument('--sample', type=int, default=2000, help='Drugs and buyers the requests are spread over.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the report to this file.')
+        parser.add_argument('--compare', help='An earlier report to compare with.')
+        parser.add_argument('--threshold', type=float, default=10, help='Percent change counted as a regression.')
+
+    def plan(self, scenarios, sample, seed):
+        rng = random.Random(seed)
+        bounds = Drug.objects.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            raise CommandError('The catalog is empty; run seed_data first.')
+        ids = {rng.randint(bounds['low'], bounds['high']) for _ in range(sample)}
+        drugs = sorted(Drug.objects.filter(pk__in=ids).values_list('id', 'price', 'drug_name'))
+        buyers = list(
+            CustomUser.objects.filter(role=CustomUser.ROLE_BUYER, is_active=True).order_by('id')[:sample]
+        )
+        if not buyers and {'history', 'checkout'} & set(scenarios):
+            raise CommandError('There are no buyers; run seed_data first or leave out history and checkout.')
+        names = [name.split()[0].lower() for _, _, name in drugs]
+        return {
+            'seed': seed,
+            'scenarios': {name: SCENARIOS[name] for name in scenarios},
+            'drugs': [(drug_id, str(price)) for drug_id, price, _ in drugs],
+            # Whole words and prefixes, as typed in a search box.
+            'queries': [name if rng.random() < 0.6 else name[:rng.randint(3, max(3, len(name) - 1))] for name in names],
+            'categories': sorted(
+                DrugFacetCount.objects.filter(facet='category', count__gt=0).values_list('value', flat=True)
+            ),
+            'tokens': [str(AccessToken.for_user(buyer)) for buyer in buyers],
+        }
+
+    def handle(self, *args, **options):
+        scenarios = options['scenario'] or list(SCENARIOS)
+        baseline = None
+        if options['compare']:
+            # Read first: the new report may be written over it, e.g. when both are named after the commit.
+            with open(options['compare']) as earlier:
+                baseline = json.load(earlier)
+        plan = self.plan(scenarios, options['sample'], options['seed'])
+        # The load generating processes are forked and must not share the database connection.
+        connections.close_all()
+        self.stdout.write(f'{options["processes"]} processes x {options["connections"]} connections for '
+                          f'{options["duration"]:g} s against {options["url"]}...')
+        try:
+            results = loadgen.run_processes(
+                options['url'], functools.partial(scenario_requests, plan), options['processes'],
+                options['connections'], options['duration'], options['warmup'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        total = LoadResult(0)
+        for result in results.values():
+            total.merge(result)
+        report = {
+            'commit': git_commit(),
+            'config': {key: options[key] for key in ('url', 'processes', 'connections', 'duration', 'seed')},
+            'scenarios': plan['scenarios'],
+            'results': {name: summarize(results[name]) for name in scenarios if name in results},
+        }
+        report['results']['all'] = summarize(total)
+        text = json.dumps(report, indent=2, sort_keys=True)
+        self.stdout.write(text)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(text + '\n')
+        if baseline is not None:
+            lines, regressed = compare(baseline, report, options['threshold'])
+            self.stdout.write('\n'.join(lines))
+            if regressed:
+                raise CommandError(f'Regressed beyond {options["threshold"]:g}%: {", ".join(regressed)}')
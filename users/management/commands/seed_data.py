@@ -0,0 +1,106 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from drugs.importer import fast_insert, write_batch
+from drugs.models import Drug
+from drugs.synthetic import Vocabulary
+from users.models import CustomUser, OrderItemModel, OrderModel
+
+PREFIX = 'seed-'
+ORDER_STATUSES = [OrderModel.STATUS_APPROVED] * 6 + [OrderModel.STATUS_PENDING] * 3 + [OrderModel.STATUS_REJECTED]
+
+
+class Command(BaseCommand):
+    help = ('Fills an empty database with synthetic sellers, drugs and buyers with order histories, for load tests '
+            'and benchmarks. The same --seed gives the same data. Do not run against production data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sellers', type=int, default=20)
+        parser.add_argument('--drugs', type=int, default=100000, help='Millions are fine; drugs are inserted in batches.')
+        parser.add_argument('--buyers', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=20, help='Orders per buyer.')
+        parser.add_argument('--days', type=int, default=365, help='Order histories go back this many days.')
+        parser.add_argument('--password', default='seed-password', help='The password of every seeded user.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def create_users(self, role, count, password, phone_offset):
+        name = 'seller' if role == CustomUser.ROLE_SELLER else 'buyer'
+        users = [
+            CustomUser(
+                username=f'{PREFIX}{name}-{index}', first_name=name.capitalize(), last_name=str(index),
+                phone=f'+{phone_offset + index:012d}', role=role, password=password,
+                business_name=f'Seed pharmacy {index}' if role == CustomUser.ROLE_SELLER else None,
+            )
+            for index in range(count)
+        ]
+        CustomUser.objects.bulk_create(users, batch_size=1000)
+        return list(CustomUser.objects.filter(username__startswith=f'{PREFIX}{name}-').order_by('id'))
+
+    def create_drugs(self, count, sellers, batch_size, rng):
+        vocabulary = Vocabulary(rng)
+        for number, start in enumerate(range(0, count, batch_size)):
+            batch = [vocabulary.drug(rng) for _ in range(min(batch_size, count - start))]
+            write_batch(batch, sellers[number % len(sellers)])
+            self.stdout.write(f'  {start + len(batch)}/{count} drugs', ending='\r')
+        self.stdout.write('')
+
+    def create_orders(self, buyers, per_buyer, days, batch_size, rng):
+        bounds = Drug.objects.aggregate(low=Min('id'), high=Max('id'))
+        now = timezone.now()
+        plans = [
+            (buyer.pk, now - datetime.timedelta(seconds=rng.randint(0, days * 86400)), rng.choice(ORDER_STATUSES),
+             {rng.randint(bounds['low'], bounds['high']): rng.randint(1, 3) for _ in range(rng.randint(1, 4))})
+            for buyer in buyers for _ in range(per_buyer)
+        ]
+        plans.sort(key=lambda plan: plan[1])
+        orders_per_batch = max(1, batch_size // 4)
+        created = 0
+        for start in range(0, len(plans), orders_per_batch):
+            batch = plans[start:start + orders_per_batch]
+            prices = dict(Drug.objects.filter(pk__in={pk for plan in batch for pk in plan[3]}).values_list('id', 'price'))
+            # Ids that fell into a gap of the drug ids are left out.
+            batch = [(*plan[:3], {pk: quantity for pk, quantity in plan[3].items() if pk in prices}) for plan in batch]
+            batch = [plan for plan in batch if plan[3]]
+            with transaction.atomic():
+                ids = fast_insert(OrderModel, ('user', 'created_at', 'updated_at', 'status', 'total_price'), [
+                    (user_id, created_at, created_at, status,
+                     sum((prices[pk] * quantity for pk, quantity in items.items()), Decimal(0)))
+                    for user_id, created_at, status, items in batch
+                ], returning=True)
+                fast_insert(OrderItemModel, ('order', 'drug', 'quantity', 'price'), [
+                    (order_id, pk, quantity, prices[pk])
+                    for order_id, (_, _, _, items) in zip(ids, batch) for pk, quantity in items.items()
+                ])
+            created += len(ids)
+            self.stdout.write(f'  {created} orders', ending='\r')
+        self.stdout.write('')
+        return created
+
+    def handle(self, *args, **options):
+        if CustomUser.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError('This database is already seeded; seed an empty one, e.g. after migrate on a new file.')
+        if options['drugs'] and not options['sellers']:
+            raise CommandError('Drugs need at least one seller.')
+        rng = random.Random(options['seed'])
+        password = make_password(options['password'])
+        start = time.perf_counter()
+        sellers = self.create_users(CustomUser.ROLE_SELLER, options['sellers'], password, 100000000)
+        buyers = self.create_users(CustomUser.ROLE_BUYER, options['buyers'], password, 200000000)
+        self.stdout.write(f'{len(sellers)} sellers and {len(buyers)} buyers created.')
+        self.create_drugs(options['drugs'], sellers, options['batch_size'], rng)
+        orders = 0
+        if options['drugs'] and options['orders']:
+            orders = self.create_orders(buyers, options['orders'], options['days'], options['batch_size'], rng)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {options["drugs"]} drugs and {orders} orders in {time.perf_counter() - start:.1f} s. '
+            f'Every user has the password "{options["password"]}".'
+        ))
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_ordermodel_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ordermodel',
+            index=models.Index(fields=['user', '-created_at'], name='users_order_user_id_55202f_idx'),
+        ),
+        # The user index is dropped only once the composite index replacing it exists.
+        migrations.AlterField(
+            model_name='ordermodel',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -36,6 +36,26 @@ class CustomUser(AbstractUser):
         ]
 
 
+class OrderQuerySet(models.QuerySet):
+    ITEM_FIELDS = ('id', 'order_id', 'drug_id', 'quantity', 'price')
+    DRUG_FIELDS = (
+        'id', 'drug_name', 'description', 'price', 'image', 'created_at', 'updated_at', 'quantity', 'category',
+        'manufacturer_country', 'manufacturer', 'active_substance', 'type', 'dozens', 'expiration_date', 'brand', 'seller_id',
+        'image_variants',
+    )
+
+    def with_items(self):
+        """Loads items and their drugs in one extra query, however many orders there are."""
+        items = OrderItemModel.objects.select_related('drug').only(
+            *self.ITEM_FIELDS, *(f'drug__{field}' for field in self.DRUG_FIELDS)
+        )
+        return self.prefetch_related(models.Prefetch('items', queryset=items))
+
+    def with_item_rows(self):
+        """Like with_items(), for readers that take the drugs from somewhere else, e.g. the fragment cache."""
+        return self.prefetch_related(models.Prefetch('items', queryset=OrderItemModel.objects.only(*self.ITEM_FIELDS)))
+
+
 class OrderModel(models.Model):
     STATUS_PENDING = 'pending'
     STATUS_APPROVED = 'approved'
@@ -47,16 +67,23 @@ class OrderModel(models.Model):
         (STATUS_REJECTED, 'Rejected'),
     ]
 
-    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    # Indexed by (user, -created_at) below, which serves user lookups as well.
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    objects = OrderQuerySet.as_manager()
+
     def __str__(self):
         return f'Order by {self.user.username}'
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+        ]
 
 
 class OrderItemModel(models.Model):
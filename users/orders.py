@@ -0,0 +1,61 @@
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+from drugs import changes
+from drugs.models import Drug, DrugChange
+from drugs.signals import drugs_updated
+from .models import OrderModel, OrderItemModel
+
+
+class InsufficientQuantity(Exception):
+    def __init__(self, drug):
+        self.drug = drug
+        super().__init__(f'Insufficient quantity of {drug.drug_name}. Available quantity is {drug.quantity}.')
+
+
+def _check_quantities(drugs, requested):
+    for drug in drugs:
+        if drug.quantity < requested[drug.pk]:
+            raise InsufficientQuantity(drug)
+
+
+def place_order(user, items, **order_fields):
+    """
+    Creates an order and takes its items out of stock in one transaction.
+
+    The involved drugs are locked in pk order, so concurrent checkouts cannot deadlock on each other, and stock
+    is decremented by a single conditional UPDATE. If that UPDATE touches fewer rows than expected (possible on
+    backends without row locks, such as SQLite) another checkout won the race and the whole order is rolled back.
+    """
+    requested = defaultdict(int)
+    for item in items:
+        requested[item['drug'].pk] += item['quantity']
+
+    with transaction.atomic():
+        drugs = list(Drug.objects.select_for_update().filter(pk__in=requested).order_by('pk'))
+        _check_quantities(drugs, requested)
+
+        if requested:
+            updated = Drug.objects.filter(
+                reduce(or_, (Q(pk=pk, quantity__gte=quantity) for pk, quantity in requested.items()))
+            ).update(
+                quantity=Case(*(When(pk=pk, then=F('quantity') - quantity) for pk, quantity in requested.items())),
+                updated_at=timezone.now(),
+            )
+            if updated != len(requested):
+                _check_quantities(Drug.objects.filter(pk__in=requested).order_by('pk'), requested)
+                raise InsufficientQuantity(drugs[0])
+            changes.record(list(requested), DrugChange.ACTION_UPDATED)
+
+        order = OrderModel.objects.create(
+            user=user, total_price=sum(item['price'] for item in items), **order_fields,
+        )
+        OrderItemModel.objects.bulk_create([OrderItemModel(order=order, **item) for item in items])
+
+    drugs_updated.send(sender=Drug, drugs=drugs)
+    return order
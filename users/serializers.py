@@ -1,10 +1,15 @@
-from django.contrib.auth import authenticate
 from rest_framework import serializers
 
+from drugs import fragments
+from drugs.cache import aget_versions, drug_namespace, get_versions
+from drugs.representation import FastRepresentation, drug_representation
 from drugs.serializers import DrugSerializer
 from .models import CustomUser, OrderModel, OrderItemModel
+from .login import client_ip, verify_credentials
+from .orders import place_order
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.core.cache import cache
+from pharmacy_marketplce.conditional import make_etag
+from pharmacy_marketplce.metrics import timed_serialize
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -74,8 +79,11 @@ class LoginSerializer(serializers.Serializer):
         if not password:
             raise serializers.ValidationError('Password is required.')
 
-        user = authenticate(username=username, password=password)
+        return self.tokens(verify_credentials(username, password, client_ip(self.context.get('request'))))
 
+    @staticmethod
+    def tokens(user):
+        # Shared with users.async_views.login, which verifies the credentials itself.
         if user is None:
             raise serializers.ValidationError('Incorrect credentials.')
         if not user.is_active:
@@ -175,28 +183,113 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = OrderModel
-        fields = ('id', 'user', 'created_at', 'status', 'total_price', 'items')
+        fields = ('id', 'user', 'created_at', 'updated_at', 'status', 'total_price', 'items')
         extra_kwargs = {
             'id': {'read_only': True},
             'user': {'read_only': True},
             'created_at': {'read_only': True},
+            'updated_at': {'read_only': True},
             'status': {'required': False},
             'total_price': {'read_only': True},
         }
 
     def create(self, validated_data):
         items_data = validated_data.pop('items')
-        order = OrderModel.objects.create(**validated_data)
-        total_price = 0
-        for item_data in items_data:
-            OrderItemModel.objects.create(order=order, **item_data)
-            cache_key = f'drug-{item_data["drug"].id}'
-            cache.delete(cache_key)
-            total_price += item_data['price']
-        order.total_price = total_price
-        order.save()
-        cache.delete('drugs')
-        return order
+        return place_order(items=items_data, **validated_data)
+
+
+class _ItemFieldsSerializer(OrderItemSerializer):
+    class Meta(OrderItemSerializer.Meta):
+        fields = tuple(field for field in OrderItemSerializer.Meta.fields if field != 'drug_details')
+
+
+class _OrderFieldsSerializer(OrderSerializer):
+    items = None
+
+    class Meta(OrderSerializer.Meta):
+        fields = tuple(field for field in OrderSerializer.Meta.fields if field != 'items')
+
+
+@timed_serialize
+def _render_order(order, items, drugs):
+    rendered_items = [
+        fragments.encode(data)[:-1] + b',"drug_details":' + drugs.get(item.drug_id, b'null') + b'}'
+        for item, data in zip(items, _ItemFieldsSerializer(items, many=True).data)
+    ]
+    return fragments.encode(_OrderFieldsSerializer(order).data)[:-1] + b',"items":[' + b','.join(rendered_items) + b']}'
+
+
+def render_order(order):
+    """
+    The bytes JSONRenderer would produce for OrderSerializer(order).data, with every drug_details taken from the
+    cached drug fragments instead of serializing the drugs again. Items only need their own columns loaded.
+    """
+    items = list(order.items.all())
+    return _render_order(order, items, fragments.get_fragments([item.drug_id for item in items]))
+
+
+async def arender_order(order):
+    items = list(order.items.all())
+    return _render_order(order, items, await fragments.aget_fragments([item.drug_id for item in items]))
+
+
+def _order_etag(order, items, versions):
+    return make_etag(
+        fragments.FORMAT, order.pk, order.user_id, order.updated_at, order.status, order.total_price,
+        [(item.pk, item.drug_id, item.quantity, item.price) for item in items], versions,
+    )
+
+
+def order_etag(order):
+    """
+    A validator for render_order(order), from the rows it loaded anyway and the versions of the drugs, whose
+    details are part of the body. updated_at alone would miss drug changes and items removed with their drug.
+    """
+    items = list(order.items.all())
+    return _order_etag(order, items, get_versions([drug_namespace(item.drug_id) for item in items]))
+
+
+async def aorder_etag(order):
+    items = list(order.items.all())
+    return _order_etag(order, items, await aget_versions([drug_namespace(item.drug_id) for item in items]))
+
+
+_orders = FastRepresentation(OrderSerializer, exclude=('items',))
+_items = FastRepresentation(OrderItemSerializer, exclude=('drug_details',))
+_item_drugs = drug_representation(prefix='drug__')
+
+
+def _order_items(order_ids):
+    return OrderItemModel.objects.filter(order_id__in=order_ids).order_by('order_id', 'id').values(
+        'order_id', *_items.columns, *_item_drugs.columns,
+    )
+
+
+@timed_serialize
+def _represent_orders(rows, item_rows):
+    items = {}
+    item_plan, drug_plan = _items.plan(), _item_drugs.plan()
+    for row in item_rows:
+        item = _items.one(row, item_plan)
+        item['drug_details'] = _item_drugs.one(row, drug_plan)
+        items.setdefault(row['order_id'], []).append(item)
+    order_plan = _orders.plan()
+    return [{**_orders.one(row, order_plan), 'items': items.get(row['id'], [])} for row in rows]
+
+
+def represent_orders(orders):
+    """
+    OrderSerializer(orders, many=True).data, built from .values() rows: one query for the orders and one for
+    their items joined with the drugs.
+    """
+    rows = list(orders.values(*_orders.columns))
+    return _represent_orders(rows, list(_order_items([row['id'] for row in rows])) if rows else [])
+
+
+async def arepresent_orders(orders):
+    rows = [row async for row in orders.values(*_orders.columns)]
+    item_rows = [row async for row in _order_items([row['id'] for row in rows])] if rows else []
+    return _represent_orders(rows, item_rows)
 
 
 class DeleteItemFromOrderSerializer(serializers.Serializer):
@@ -1,3 +1,729 @@
-from django.test import TestCase
+import asyncio
+import io
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import redis
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection, OperationalError
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django_redis import get_redis_connection
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from drugs import cache as catalog_cache
+from drugs.models import Drug, DrugFacetCount, DrugSearchToken
+from drugs.signals import drugs_updated
+from pharmacy_marketplce import idempotency, ratelimit
+from pharmacy_marketplce.ratelimit import parse_rate
+from drugs.tests import LOCMEM_CACHES, FAST_HASHERS, QueryPlanAssertionsMixin, clear_caches, create_seller, create_drug
+from . import async_views, login as login_module
+from .authentication import CachedJWTAuthentication, get_cached_user, user_namespace
+from .export import SELLER_ORDER_COLUMNS
+from .login import pool
+from .management.commands import loadtest
+from .models import CustomUser, OrderModel, OrderItemModel
+from .orders import place_order, InsufficientQuantity
+from .serializers import OrderSerializer
+
+# The rate limiter's Lua script is tested against this Redis when one answers there; its database is not flushed.
+REDIS_TEST_URL = os.getenv('REDIS_TEST_URL', 'redis://localhost:6379/15')
+
+
+def create_buyer(username='buyer', phone='+998900000002'):
+    return CustomUser.objects.create_user(username=username, password='secret-pass', phone=phone, role='buyer')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.buyer = create_buyer()
+        seller = create_seller()
+        self.aspirin = create_drug(seller, drug_name='Aspirin', quantity=5)
+        self.ibuprofen = create_drug(seller, drug_name='Ibuprofen', quantity=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def item(self, drug, quantity):
+        return {'drug': drug.pk, 'quantity': quantity, 'price': '10.00'}
+
+    def test_decrements_stock_and_creates_items(self):
+        response = self.client.post('/users/orders/', {
+            'items': [self.item(self.aspirin, 2), self.item(self.ibuprofen, 3), self.item(self.aspirin, 1)],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertEqual(response.data['total_price'], '30.00')
+        self.aspirin.refresh_from_db()
+        self.ibuprofen.refresh_from_db()
+        self.assertEqual((self.aspirin.quantity, self.ibuprofen.quantity), (2, 0))
+
+    def test_insufficient_stock_rolls_back_everything(self):
+        response = self.client.post('/users/orders/', {
+            'items': [self.item(self.aspirin, 1), self.item(self.ibuprofen, 4)],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Insufficient quantity of Ibuprofen. Available quantity is 3.')
+        self.aspirin.refresh_from_db()
+        self.assertEqual(self.aspirin.quantity, 5)
+        self.assertFalse(OrderModel.objects.exists())
+        self.assertFalse(OrderItemModel.objects.exists())
+
+    def test_runs_in_constant_number_of_queries(self):
+        items = [{'drug': self.aspirin, 'quantity': 1, 'price': 1}, {'drug': self.ibuprofen, 'quantity': 1, 'price': 1}]
+        # savepoint, select for update, update, log changes, insert order, bulk insert items, release savepoint
+        with self.assertNumQueries(7):
+            place_order(self.buyer, items)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS, DRUG_IMAGE_WORKERS=0)
+class ConcurrentCheckoutTests(TransactionTestCase):
+    buyers = 48
+    stock = 20
+
+    def test_no_oversell_under_concurrency(self):
+        seller = create_seller()
+        drug = create_drug(seller, quantity=self.stock)
+        buyers = [create_buyer(f'buyer{i}', f'+99890100{i:04d}') for i in range(self.buyers)]
+        results = []
+        barrier = threading.Barrier(self.buyers)
+
+        def checkout(buyer):
+            barrier.wait()
+            try:
+                for attempt in itertools.count():
+                    try:
+                        place_order(buyer, [{'drug': drug, 'quantity': 1, 'price': 1}])
+                        results.append('ok')
+                        return
+                    except InsufficientQuantity:
+                        results.append('sold out')
+                        return
+                    except OperationalError:
+                        # SQLite reports lock contention instead of blocking; back off and retry like a client would.
+                        time.sleep(random.random() * 0.001 * 2 ** min(attempt, 8))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(buyer,)) for buyer in buyers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        drug.refresh_from_db()
+        self.assertEqual(drug.quantity, 0)
+        self.assertEqual(results.count('ok'), self.stock)
+        self.assertEqual(results.count('sold out'), self.buyers - self.stock)
+        self.assertEqual(OrderItemModel.objects.filter(drug=drug).count(), self.stock)
+
+
+class QueryCountAssertionsMixin:
+    """Fails when the number of queries needed to serve a URL grows with the size of the data set."""
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, url, grow, times=3):
+        self.count_queries(url)  # warm up the drug fragment cache, which costs one query when cold
+        baseline = self.count_queries(url)
+        for _ in range(times):
+            grow()
+            self.assertEqual(self.count_queries(url), baseline, f'{url} issues more queries as data grows')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class OrderQueryCountTests(QueryCountAssertionsMixin, TestCase):
+    def setUp(self):
+        clear_caches()
+        self.buyer = create_buyer()
+        seller = create_seller()
+        self.drugs = [create_drug(seller, drug_name=f'Drug{i}', quantity=1000) for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+        self.order = self.place_order()
+
+    def place_order(self):
+        return place_order(self.buyer, [{'drug': drug, 'quantity': 1, 'price': 1} for drug in self.drugs])
+
+    def test_order_list(self):
+        self.assertConstantQueries('/users/orders/', self.place_order)
+
+    def test_order_detail(self):
+        def add_items():
+            OrderItemModel.objects.bulk_create(
+                [OrderItemModel(order=self.order, drug=drug, quantity=1, price=1) for drug in self.drugs]
+            )
+        self.assertConstantQueries(f'/users/orders/{self.order.pk}/', add_items)
+
+    def test_order_detail_matches_serializer(self):
+        order = OrderModel.objects.with_items().get(pk=self.order.pk)
+        response = self.client.get(f'/users/orders/{order.pk}/')
+        self.assertEqual(response.content, JSONRenderer().render(OrderSerializer(order).data))
+
+    def test_order_list_matches_serializer(self):
+        self.place_order()
+        orders = OrderModel.objects.filter(user=self.buyer).with_items()
+        response = self.client.get('/users/orders/')
+        self.assertEqual(response.content, JSONRenderer().render(OrderSerializer(orders, many=True).data))
+
+    def test_unchanged_order_is_not_sent_again(self):
+        url = f'/users/orders/{self.order.pk}/'
+        response = self.client.get(url)
+        etag = response.headers['ETag']
+        self.assertIn('private', response.headers['Cache-Control'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # The body embeds the drugs, so a drug change is an order change too.
+        with self.captureOnCommitCallbacks(execute=True):
+            Drug.objects.filter(pk=self.drugs[0].pk).update(price=2)
+            drugs_updated.send(sender=Drug, drugs=[self.drugs[0]])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'][0]['drug_details']['price'], '2.00')
+
+    def test_order_list_query_budget(self):
+        for _ in range(5):
+            self.place_order()
+        # orders, items joined with their drugs
+        self.assertEqual(self.count_queries('/users/orders/'), 2)
+
+    def test_async_views_match_drf_views(self):
+        self.place_order()
+        factory, client = AsyncRequestFactory(), APIClient()
+        token = f'Bearer {AccessToken.for_user(self.buyer)}'
+        cases = [
+            (async_views.order_list, '/users/orders/', (), token),
+            (async_views.order_detail, f'/users/orders/{self.order.pk}/', (self.order.pk,), token),
+            (async_views.order_detail, '/users/orders/0/', (0,), token),
+            (async_views.order_list, '/users/orders/', (), None),
+            (async_views.order_list, '/users/orders/', (), 'Bearer invalid'),
+        ]
+        for view, path, args, authorization in cases:
+            headers = {'Authorization': authorization} if authorization else {}
+            expected = client.get(path, headers=headers)
+            response = async_to_sync(view)(factory.get(path, headers=headers), *args)
+            self.assertEqual(response.status_code, expected.status_code, path)
+            self.assertEqual(response.content, expected.content, path)
+            self.assertEqual(response.headers.get('ETag'), expected.headers.get('ETag'), path)
+            self.assertEqual(response.headers.get('WWW-Authenticate'), expected.headers.get('WWW-Authenticate'), path)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class OrderQueryPlanTests(QueryPlanAssertionsMixin, TestCase):
+    def setUp(self):
+        clear_caches()
+        self.buyer = create_buyer()
+        self.seller = create_seller()
+        drugs = [create_drug(self.seller, drug_name=f'Drug{i}', quantity=100) for i in range(3)]
+        for _ in range(3):
+            self.order = place_order(self.buyer, [{'drug': drug, 'quantity': 1, 'price': 1} for drug in drugs])
+        self.client = APIClient()
+
+    def test_order_reads_use_indexes(self):
+        self.client.force_authenticate(self.buyer)
+        for url in ['/users/orders/', f'/users/orders/{self.order.pk}/']:
+            self.assertIndexedPlans(url)
+
+    def test_exports_only_sort_the_users_own_items(self):
+        for user in (self.buyer, self.seller):
+            self.client.force_authenticate(user)
+            self.assertIndexedPlans('/users/orders/export/', allow_sort=True)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class OrderExportTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.buyer = create_buyer()
+        self.seller = create_seller()
+        other = create_seller('other', '+998900000009')
+        self.mine = create_drug(self.seller, quantity=10)
+        theirs = create_drug(other, quantity=10)
+        self.order = place_order(self.buyer, [{'drug': self.mine, 'quantity': 1, 'price': 1}, {'drug': theirs, 'quantity': 2, 'price': 1}])
+        self.client = APIClient()
+
+    def export(self, user, **params):
+        self.client.force_authenticate(user)
+        response = self.client.get('/users/orders/export/', params)
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_seller_sees_only_items_of_own_drugs(self):
+        rows = self.export(self.seller, output='ndjson')
+        self.assertEqual([(row['order_id'], row['drug_id'], row['quantity']) for row in rows], [(self.order.pk, self.mine.pk, 1)])
+        self.assertNotIn('user_id', rows[0])
+        self.assertNotIn('total_price', rows[0])
+        self.client.force_authenticate(self.seller)
+        header = b''.join(self.client.get('/users/orders/export/').streaming_content).decode().splitlines()[0]
+        self.assertEqual(header.split(','), list(SELLER_ORDER_COLUMNS))
+
+    def test_buyer_sees_own_orders_in_date_range(self):
+        self.assertEqual(len(self.export(self.buyer, output='ndjson')), 2)
+        self.assertEqual(self.export(self.buyer, output='ndjson', created_before='2000-01-01'), [])
+        self.assertEqual(self.export(create_buyer('someone', '+998900000003'), output='ndjson'), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class LoadTestTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        call_command('seed_data', sellers=2, drugs=40, buyers=3, orders=2, batch_size=16, stdout=io.StringIO())
+
+    def test_seed_data(self):
+        self.assertEqual(CustomUser.objects.filter(role='seller').count(), 2)
+        self.assertEqual(Drug.objects.values('seller').distinct().count(), 2)
+        self.assertEqual(Drug.objects.count(), 40)
+        self.assertTrue(DrugSearchToken.objects.exists())
+        self.assertEqual(sum(DrugFacetCount.objects.filter(facet='category').values_list('count', flat=True)), 40)
+        self.assertEqual(OrderModel.objects.count(), 6)
+        for order in OrderModel.objects.prefetch_related('items'):
+            self.assertEqual(order.total_price, sum(item.price * item.quantity for item in order.items.all()))
+        with self.assertRaises(CommandError):
+            call_command('seed_data', stdout=io.StringIO())
+
+    def test_scenario_requests_are_served(self):
+        plan = loadtest.Command().plan(list(loadtest.SCENARIOS), sample=20, seed=0)
+        requests = loadtest.scenario_requests(plan, 'testserver', '', 0)
+        client = APIClient()
+        seen = set()
+        for name, data in itertools.islice(requests, 60):
+            head, _, body = data.partition(b'\r\n\r\n')
+            request_line, *header_lines = head.decode().split('\r\n')
+            method, path, _ = request_line.split(' ')
+            headers = dict(line.split(': ', 1) for line in header_lines)
+            response = client.generic(
+                method, path, body, content_type=headers.get('Content-Type', ''),
+                headers={'Authorization': headers.get('Authorization', '')},
+            )
+            self.assertIn(response.status_code, (200, 201), (name, path, response.content))
+            seen.add(name)
+        self.assertEqual(seen, set(loadtest.SCENARIOS))
+
+    def test_compare_flags_regressions(self):
+        def report(rate, p99, errors=0):
+            result = {'rate': rate, 'p50_ms': 10, 'p95_ms': 20, 'p99_ms': p99, 'errors': errors}
+            return {'results': {'detail': result, 'search': result}}
+
+        _, regressed = loadtest.compare(report(100, 30), report(95, 32), threshold=10)
+        self.assertEqual(regressed, [])
+        lines, regressed = loadtest.compare(report(100, 30), report(80, 30), threshold=10)
+        self.assertEqual(regressed, ['detail', 'search'])
+        self.assertIn('rate 100 -> 80 (-20.0%) !', lines[0])
+        _, regressed = loadtest.compare(report(100, 30), report(100, 40), threshold=10)
+        self.assertEqual(regressed, ['detail', 'search'])
+        _, regressed = loadtest.compare(report(100, 30), report(100, 30, errors=1), threshold=10)
+        self.assertEqual(regressed, ['detail', 'search'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.buyer = create_buyer()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.buyer)}')
+
+    def me(self):
+        return self.client.get('/users/me/')
+
+    def test_steady_state_needs_no_queries(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.me().status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.me().json()['username'], 'buyer')
+
+    def test_user_changes_are_seen_at_once(self):
+        self.me()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buyer.role = 'seller'
+            self.buyer.save()
+        self.assertEqual(self.me().json()['role'], 'seller')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buyer.is_active = False
+            self.buyer.save()
+        self.assertEqual(self.me().status_code, 401)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buyer.delete()
+        self.assertEqual(self.me().json()['code'], 'user_not_found')
+
+    def test_password_change_revokes_tokens(self):
+        with mock.patch.object(jwt_settings, 'CHECK_REVOKE_TOKEN', True):
+            request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.buyer)}')
+            user, _ = CachedJWTAuthentication().authenticate(request)
+            self.assertEqual(user.pk, self.buyer.pk)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.buyer.set_password('another-pass')
+                self.buyer.save()
+            with self.assertRaisesMessage(AuthenticationFailed, "The user's password has been changed."):
+                CachedJWTAuthentication().authenticate(request)
+
+    def test_password_hash_is_not_cached(self):
+        self.me()
+        row = catalog_cache.cache.get(catalog_cache.make_key('auth-user', [user_namespace(self.buyer.pk)]))
+        self.assertNotIn(self.buyer.password, row.values())
+        user = get_cached_user(self.buyer.pk)
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertEqual(user.password, self.buyer.password)
+
+    def test_every_request_gets_its_own_user(self):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.buyer)}')
+        user, _ = CachedJWTAuthentication().authenticate(request)
+        user.role = 'admin'
+        again, _ = CachedJWTAuthentication().authenticate(request)
+        self.assertEqual(again.role, 'buyer')
+        self.assertFalse(again._state.adding)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class LoginTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.buyer = create_buyer()
+        self.client = APIClient()
+
+    def login(self, password='secret-pass', ip='127.0.0.1'):
+        return self.client.post('/users/login/', {'username': 'buyer', 'password': password}, REMOTE_ADDR=ip)
+
+    @override_settings(LOGIN_MAX_FAILURES_PER_USERNAME=2)
+    def test_failures_are_limited_before_hashing(self):
+        self.assertEqual(self.login('wrong').status_code, 400)
+        self.assertEqual(self.login('wrong').status_code, 400)
+        with mock.patch('users.login.pool.run') as run:
+            response = self.login()
+        run.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], str(settings.LOGIN_FAILURE_WINDOW))
+        # The same username from elsewhere is not locked out.
+        self.assertEqual(self.login(ip='10.0.0.2').status_code, 200)
+
+    def test_verified_password_is_not_hashed_again(self):
+        self.assertEqual(self.login().status_code, 200)
+        with mock.patch('users.login.pool.run', return_value=(False, None)) as run:
+            self.assertIn('access', self.login().json())
+            self.assertEqual(self.login('wrong').status_code, 400)
+        # Only the wrong password was hashed.
+        self.assertEqual(run.call_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buyer.is_active = False
+            self.buyer.save()
+        self.assertEqual(self.login().status_code, 400)
+
+    @override_settings(PASSWORD_HASHERS=['users.hashers.ConfigurablePBKDF2PasswordHasher'], LOGIN_VERIFIED_TIMEOUT=0)
+    def test_login_rehashes_with_the_configured_cost(self):
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            self.buyer.set_password('secret-pass')
+            self.buyer.save()
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, 200)
+        self.buyer.refresh_from_db()
+        self.assertTrue(self.buyer.password.startswith('pbkdf2_sha256$2000$'))
+        self.assertTrue(self.buyer.check_password('secret-pass'))
+
+    def test_async_view_matches_drf_view(self):
+        # Served with ASYNC_READ_VIEWS, which the tests run without.
+        factory = AsyncRequestFactory()
+        cases = [
+            ('application/json', '{"username": "buyer", "password": "secret-pass"}'),
+            ('application/json', '{"username": "buyer", "password": "wrong"}'),
+            ('application/json', '{"username": "buyer"}'),
+            ('application/json', '[]'),
+            ('application/json', '{'),
+            ('application/x-www-form-urlencoded', 'username=buyer&password=secret-pass'),
+        ]
+        for content_type, body in cases:
+            expected = self.client.post('/users/login/', body, content_type=content_type)
+            response = async_to_sync(async_views.login)(factory.post('/users/login/', body, content_type=content_type))
+            self.assertEqual(response.status_code, expected.status_code, body)
+            if expected.status_code == 200:
+                self.assertEqual(json.loads(response.content).keys(), expected.json().keys())
+            else:
+                self.assertEqual(json.loads(response.content), expected.json(), body)
+
+    @override_settings(LOGIN_HASH_WORKERS=1)
+    async def test_async_view_does_not_hold_the_request_thread(self):
+        release = threading.Event()
+        verify = login_module._verify
+
+        def slow_verify(*args):
+            release.wait(5)
+            return verify(*args)
+
+        request = AsyncRequestFactory().post(
+            '/users/login/', {'username': 'buyer', 'password': 'secret-pass'}, content_type='application/json',
+        )
+        with mock.patch('users.login._verify', slow_verify):
+            login = asyncio.ensure_future(async_views.login(request))
+            await asyncio.sleep(0.1)
+            self.assertFalse(login.done())
+            # Sync code still runs on the thread the login's database queries use.
+            self.assertEqual(await asyncio.wait_for(sync_to_async(CustomUser.objects.count)(), 2), 1)
+            release.set()
+            response = await login
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', json.loads(response.content))
+
+    @override_settings(LOGIN_HASH_WORKERS=1, LOGIN_HASH_QUEUE=0)
+    def test_busy_pool_turns_logins_away(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        thread = threading.Thread(target=pool.run, args=(block,))
+        thread.start()
+        started.wait(5)
+        try:
+            response = self.login()
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.login().status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.limiter = ratelimit.limiter
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('20/hour'), (20, 3600))
+        self.assertEqual(parse_rate('3/10min'), (3, 600))
+        self.assertEqual(parse_rate('5/30s'), (5, 30))
+        with self.assertRaises(ValueError):
+            parse_rate('5 per minute')
+
+    def test_window_slides(self):
+        with mock.patch('pharmacy_marketplce.ratelimit.time.time') as now:
+            now.return_value = 1000
+            self.assertEqual(self.limiter.hit('key', 2, 60), (True, 0))
+            now.return_value = 1030
+            self.assertEqual(self.limiter.hit('key', 2, 60), (True, 0))
+            self.assertEqual(self.limiter.hit('key', 2, 60), (False, 30))
+            self.assertEqual(self.limiter.peek('key', 2, 60), (False, 30))
+            # The first hit has left the window, the second has not.
+            now.return_value = 1061
+            self.assertEqual(self.limiter.peek('key', 2, 60), (True, 0))
+            self.assertEqual(self.limiter.hit('key', 2, 60), (True, 0))
+            self.assertFalse(self.limiter.hit('key', 2, 60)[0])
+            self.assertTrue(self.limiter.hit('other', 2, 60)[0])
+            self.limiter.reset('key')
+            self.assertTrue(self.limiter.hit('key', 2, 60)[0])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': REDIS_TEST_URL, 'KEY_PREFIX': 'tests'},
+})
+class RedisRateLimitTests(RateLimitTests):
+    """The same checks on the Lua script, against the Redis at REDIS_TEST_URL; skipped when none answers there."""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            redis.Redis.from_url(REDIS_TEST_URL, socket_connect_timeout=1).ping()
+        except redis.exceptions.ConnectionError:
+            raise unittest.SkipTest(f'No Redis at {REDIS_TEST_URL}.')
+        super().setUpClass()
+
+    def setUp(self):
+        # Not clear_caches(), which would flush the database.
+        self.limiter = ratelimit.SlidingWindowLimiter('default')
+        self.assertIsNotNone(self.limiter._script())
+        for name in ('key', 'other'):
+            self.limiter.reset(name)
+            self.addCleanup(self.limiter.reset, name)
+
+    def test_expires_with_the_window(self):
+        self.limiter.hit('key', 2, 60)
+        ttl = get_redis_connection('default').pttl(caches['default'].make_key(self.limiter.key('key')))
+        self.assertTrue(0 < ttl <= 60000, ttl)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class PasswordResetTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.buyer = create_buyer()
+        self.client = APIClient()
+
+    def request_otp(self, phone='+998900000002', ip='127.0.0.1'):
+        return self.client.post('/users/forgot-password/', {'phone': phone}, REMOTE_ADDR=ip)
+
+    def reset(self, otp, ip='127.0.0.1'):
+        return self.client.post('/users/reset-password/', {
+            'phone': '+998900000002', 'otp_code': otp, 'password': 'new-secret-pass',
+        }, REMOTE_ADDR=ip)
+
+    def test_reset_password(self):
+        otp = self.request_otp().json()['otp']
+        self.assertEqual(self.reset(str(otp)).status_code, 200)
+        self.buyer.refresh_from_db()
+        self.assertTrue(self.buyer.check_password('new-secret-pass'))
+        # A code works once.
+        self.assertEqual(self.reset(str(otp)).status_code, 400)
+
+    def test_code_is_dropped_after_too_many_attempts(self):
+        otp = self.request_otp().json()['otp']
+        wrong = '000000' if otp != 0 else '111111'
+        for _ in range(settings.OTP_MAX_ATTEMPTS):
+            self.assertEqual(self.reset(wrong).status_code, 400)
+        self.assertEqual(self.reset(str(otp)).status_code, 400)
+        self.assertEqual(self.reset('not a number').status_code, 400)
+
+    def test_otp_requests_are_throttled_by_phone_and_ip(self):
+        limit, window = parse_rate(api_settings.DEFAULT_THROTTLE_RATES['otp-request-phone'])
+        for number in range(limit):
+            self.assertEqual(self.request_otp(ip=f'10.0.0.{number}').status_code, 200)
+        response = self.request_otp(ip='10.0.1.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertLessEqual(int(response.headers['Retry-After']), window)
+        # Another phone from the same IP is still served, until the IP runs out too.
+        limit, _ = parse_rate(api_settings.DEFAULT_THROTTLE_RATES['otp-request-ip'])
+        statuses = [self.request_otp(f'+99891{number:07d}', ip='10.0.2.1').status_code for number in range(limit + 1)]
+        self.assertEqual(statuses, [200] * limit + [429])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PASSWORD_HASHERS=FAST_HASHERS)
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.buyer = create_buyer()
+        self.drug = create_drug(create_seller(), quantity=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def order(self, key, quantity=1, client=None):
+        return (client or self.client).post('/users/orders/', {
+            'items': [{'drug': self.drug.pk, 'quantity': quantity, 'price': '10.00'}],
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_gets_the_first_response(self):
+        first = self.order('key-1', 2)
+        retry = self.order('key-1', 2)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(OrderModel.objects.count(), 1)
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.quantity, 3)
+        # A new key, or no key, is a new order.
+        self.assertEqual(self.order('key-2').status_code, 201)
+        self.assertEqual(self.order(None).status_code, 201)
+        self.assertEqual(OrderModel.objects.count(), 3)
+
+    def test_errors(self):
+        self.assertEqual(self.order('key-1', 10).status_code, 400)
+        with mock.patch('users.views.OrderSerializer.save') as save:
+            self.assertEqual(self.order('key-1', 10).json()['error'], 'Insufficient quantity of Aspirin. Available quantity is 5.')
+        save.assert_not_called()
+        self.assertEqual(self.order('key-1', 1).status_code, 422)
+        self.assertEqual(self.order('x' * 256).status_code, 400)
+
+    def test_keys_are_per_user(self):
+        other = APIClient()
+        other.force_authenticate(create_buyer('other', '+998900000009'))
+        self.order('key-1')
+        self.assertNotIn('Idempotent-Replayed', self.order('key-1', client=other).headers)
+        self.assertEqual(OrderModel.objects.count(), 2)
+
+    @override_settings(IDEMPOTENCY_WAIT=0.1)
+    def test_retry_during_the_first_request_is_refused(self):
+        responses = []
+        save = OrderSerializer.save
+
+        def save_and_retry(serializer, **kwargs):
+            responses.append(self.order('key-1'))
+            return save(serializer, **kwargs)
+
+        with mock.patch('users.views.OrderSerializer.save', save_and_retry):
+            self.assertEqual(self.order('key-1').status_code, 201)
+        self.assertEqual(responses[0].status_code, 409)
+        self.assertEqual(responses[0].headers['Retry-After'], '1')
+        self.assertEqual(OrderModel.objects.count(), 1)
+
+    def test_concurrent_retry_waits_for_the_first_response(self):
+        responses = []
+        save = OrderSerializer.save
+        retry = threading.Thread(target=lambda: responses.append(self.order('key-1', client=self.retry_client())))
+
+        def save_and_retry(serializer, **kwargs):
+            retry.start()
+            time.sleep(0.1)  # the retry is polling by now
+            return save(serializer, **kwargs)
+
+        with mock.patch('users.views.OrderSerializer.save', save_and_retry):
+            first = self.order('key-1')
+        retry.join()
+        self.assertEqual((responses[0].status_code, responses[0].json()), (201, first.json()))
+        self.assertEqual(responses[0].headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(OrderModel.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_LOCK_TIMEOUT=0.2)
+    def test_slow_request_keeps_its_key(self):
+        body = {'items': [{'drug': self.drug.pk, 'quantity': 1, 'price': '10.00'}]}
+        running = SimpleNamespace(user=self.buyer, method='POST', path='/users/orders/', data=body)
+        cache_key = idempotency._cache_key(running, 'key-1')
+        entries = []
+        save = OrderSerializer.save
+
+        def slow_save(serializer, **kwargs):
+            time.sleep(0.5)  # longer than the hold
+            entries.append(caches['default'].get(cache_key))
+            return save(serializer, **kwargs)
+
+        with mock.patch('users.views.OrderSerializer.save', slow_save):
+            self.assertEqual(self.order('key-1').status_code, 201)
+        self.assertEqual(entries[0]['state'], 'pending')
+        # The stored response keeps its own timeout.
+        self.assertEqual(self.order('key-1').headers['Idempotent-Replayed'], 'true')
+
+    @override_settings(IDEMPOTENCY_WAIT=0.1)
+    async def test_retries_under_asgi(self):
+        body = {'items': [{'drug': self.drug.pk, 'quantity': 1, 'price': '10.00'}]}
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.buyer)}', 'Idempotency-Key': 'key-1'}
+        client = AsyncClient()
+
+        def order():
+            return client.post('/users/orders/', body, content_type='application/json', headers=headers)
+
+        # As another worker would leave it while it places the order.
+        running = SimpleNamespace(user=self.buyer, method='POST', path='/users/orders/', data=body)
+        cache_key = idempotency._cache_key(running, 'key-1')
+        await caches['default'].aset(cache_key, {'state': 'pending', 'fingerprint': idempotency._fingerprint(running)})
+        response = await order()
+        self.assertEqual((response.status_code, response.headers['Retry-After']), (409, '1'))
+        self.assertEqual(await OrderModel.objects.acount(), 0)
+
+        await caches['default'].adelete(cache_key)
+        first, retry = await order(), await order()
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(await OrderModel.objects.acount(), 1)
+
+    def retry_client(self):
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+        return client
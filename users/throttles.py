@@ -0,0 +1,25 @@
+from pharmacy_marketplce.ratelimit import SlidingWindowThrottle
+
+
+class PhoneThrottle(SlidingWindowThrottle):
+    """By the phone number in the request body, so that spreading requests over many IPs does not help."""
+
+    def get_identifier(self, request, view):
+        phone = request.data.get('phone') if hasattr(request.data, 'get') else None
+        return f'phone:{"".join(str(phone).split())}' if phone else None
+
+
+class OTPRequestIPThrottle(SlidingWindowThrottle):
+    scope = 'otp-request-ip'
+
+
+class OTPRequestPhoneThrottle(PhoneThrottle):
+    scope = 'otp-request-phone'
+
+
+class OTPVerifyIPThrottle(SlidingWindowThrottle):
+    scope = 'otp-verify-ip'
+
+
+class OTPVerifyPhoneThrottle(PhoneThrottle):
+    scope = 'otp-verify-phone'
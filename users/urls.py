@@ -1,19 +1,31 @@
+from django.conf import settings
 from django.urls import path
 
+from pharmacy_marketplce.async_views import async_methods, async_reads
+from . import async_views
 from .views import CreateUserView, LoginView, UserMeView, UserListView, UserDetailView, UserChangePasswordView, UserForgotPasswordView, UserResetPasswordView, \
-    OrderListCreateView, OrderDetailView, DeleteItemFromOrderView
+    OrderListCreateView, OrderDetailView, DeleteItemFromOrderView, OrderExportView
+
+order_list_view, order_detail_view = OrderListCreateView.as_view(), OrderDetailView.as_view()
+login_view = LoginView.as_view()
+if settings.ASYNC_READ_VIEWS:
+    order_list_view = async_reads(async_views.order_list, order_list_view)
+    order_detail_view = async_reads(async_views.order_detail, order_detail_view)
+    # Logins wait on password hashing in users.login.pool, which the async view does without holding a thread.
+    login_view = async_methods(async_views.login, login_view, ('POST',))
 
 urlpatterns = [
     path('', UserListView.as_view(), name='user-list'),
     path('<int:pk>/', UserDetailView.as_view(), name='user-detail'),
     path('me/', UserMeView.as_view()),
     path('signup/', CreateUserView.as_view(), name='signup'),
-    path('login/', LoginView.as_view(), name='login'),
+    path('login/', login_view, name='login'),
     path('change-password/', UserChangePasswordView.as_view(), name='change-password'),
     path('forgot-password/', UserForgotPasswordView.as_view(), name='forgot-password'),
     path('reset-password/', UserResetPasswordView.as_view(), name='reset-password'),
 
-    path('orders/', OrderListCreateView.as_view(), name='order-list-create'),
-    path('orders/<int:pk>/', OrderDetailView.as_view(), name='order-detail'),
+    path('orders/', order_list_view, name='order-list-create'),
+    path('orders/<int:pk>/', order_detail_view, name='order-detail'),
+    path('orders/export/', OrderExportView.as_view(), name='order-export'),
     path('orders/items/', DeleteItemFromOrderView.as_view(), name='order-item-delete'),
 ]
@@ -1,16 +1,37 @@
-import random
+import hashlib
+import secrets
+
+from django.conf import settings
 from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+
+
+def _otp_keys(phone):
+    digest = hashlib.sha256(phone.encode()).hexdigest()
+    return f'otp:code:{digest}', f'otp:attempts:{digest}'
 
 
 def generate_otp(phone):
-    otp = random.randint(100000, 999999)
-    cache.set(phone, otp, timeout=60)  # 1 minute
+    otp = secrets.randbelow(900000) + 100000
+    code_key, attempts_key = _otp_keys(phone)
+    cache.set_many({code_key: str(otp), attempts_key: 0}, timeout=settings.OTP_TIMEOUT)
     return otp
 
 
 def verify_otp(phone, otp):
-    otp = int(otp)
-    if cache.get(phone) == otp:
-        cache.delete(phone)
-        return True
-    return False
+    """Each code can be tried OTP_MAX_ATTEMPTS times; a correct one works once."""
+    code_key, attempts_key = _otp_keys(phone)
+    code = cache.get(code_key)
+    if code is None:
+        return False
+    try:
+        attempts = cache.incr(attempts_key)
+    except ValueError:  # expired in between
+        return False
+    if attempts > settings.OTP_MAX_ATTEMPTS:
+        cache.delete_many([code_key, attempts_key])
+        return False
+    if not constant_time_compare(str(otp).strip(), code):
+        return False
+    cache.delete_many([code_key, attempts_key])
+    return True
@@ -2,13 +2,19 @@ from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from .serializers import UserSerializer, LoginSerializer, UserChangeProfileSerializer, UserForgotPasswordSerializer, UserResetPasswordSerializer, \
-    OrderSerializer, OrderItemSerializer, DeleteItemFromOrderSerializer
+    OrderSerializer, OrderItemSerializer, DeleteItemFromOrderSerializer, order_etag, render_order, represent_orders
 from .models import CustomUser, OrderModel, OrderItemModel
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from .utils import generate_otp, verify_otp
-from drugs.models import Drug
+from .orders import InsufficientQuantity
+from .login import LoginBusy, TooManyAttempts
+from .throttles import OTPRequestIPThrottle, OTPRequestPhoneThrottle, OTPVerifyIPThrottle, OTPVerifyPhoneThrottle
+from .export import ORDER_COLUMNS, SELLER_ORDER_COLUMNS, order_rows
+from drugs import export, fragments
+from pharmacy_marketplce.conditional import not_modified, set_validators
+from pharmacy_marketplce.idempotency import idempotent
 
 
 class CreateUserView(APIView):
@@ -36,12 +42,21 @@ class LoginView(APIView):
         operation_description='For logging in a user.',
         responses={
             200: openapi.Response('Login successful.'),
-            400: openapi.Response('Bad Request')
+            400: openapi.Response('Bad Request'),
+            429: openapi.Response('Too many failed login attempts.'),
+            503: openapi.Response('Too many logins in progress.')
         }
     )
     def post(self, request):
-        serializer = LoginSerializer(data=request.data)
-        if serializer.is_valid():
+        serializer = LoginSerializer(data=request.data, context={'request': request})
+        try:
+            valid = serializer.is_valid()
+        except TooManyAttempts as e:
+            return Response({'error': str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS,
+                            headers={'Retry-After': str(e.retry_after)})
+        except LoginBusy as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+        if valid:
             return Response(serializer.validated_data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -219,13 +234,15 @@ class UserChangePasswordView(APIView):
 
 class UserForgotPasswordView(APIView):
     permission_classes = (AllowAny,)
+    throttle_classes = (OTPRequestIPThrottle, OTPRequestPhoneThrottle)
     @swagger_auto_schema(
         request_body=UserForgotPasswordSerializer,
         operation_summary='Forgot Password',
         operation_description='For sending an OTP to the user for resetting the password.',
         responses={
             200: openapi.Response('OTP sent successfully.'),
-            400: openapi.Response('Bad Request')
+            400: openapi.Response('Bad Request'),
+            429: openapi.Response('Too many requests.')
         }
     )
     def post(self, request):
@@ -239,20 +256,22 @@ class UserForgotPasswordView(APIView):
 
 class UserResetPasswordView(APIView):
     permission_classes = (AllowAny,)
+    throttle_classes = (OTPVerifyIPThrottle, OTPVerifyPhoneThrottle)
     @swagger_auto_schema(
         request_body=UserResetPasswordSerializer,
         operation_summary='Reset Password',
         operation_description='For resetting the password of the user.',
         responses={
             200: openapi.Response('Password reset successfully.'),
-            400: openapi.Response('Bad Request')
+            400: openapi.Response('Bad Request'),
+            429: openapi.Response('Too many requests.')
         }
     )
     def post(self, request):
         serializer = UserResetPasswordSerializer(data=request.data)
         if serializer.is_valid():
             phone = serializer.validated_data['phone']
-            otp = serializer.validated_data['otp']
+            otp = serializer.validated_data['otp_code']
             password = serializer.validated_data['password']
             if verify_otp(phone, otp):
                 user = CustomUser.objects.get(phone=phone)
@@ -265,6 +284,8 @@ class UserResetPasswordView(APIView):
 
 class OrderListCreateView(APIView):
     permission_classes = (IsAuthenticated,)
+    # GET only; writes always go to the primary.
+    replica_reads = True
     @swagger_auto_schema(
         operation_summary='Get order list',
         operation_description='For fetching the list of all orders.',
@@ -283,40 +304,46 @@ class OrderListCreateView(APIView):
         except Exception as e:
             return Response({'error': 'Authentication failed.', 'message': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
         try:
-            orders = OrderModel.objects.filter(user=request_user)
+            orders = represent_orders(OrderModel.objects.filter(user=request_user))
         except OrderModel.DoesNotExist:
             return Response({'error': 'No orders found.'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'error': 'An error occurred.', 'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(orders, status=status.HTTP_200_OK)
     @swagger_auto_schema(
         request_body=OrderSerializer,
         operation_summary='Create order',
         operation_description='For creating a new order.',
         responses={
             201: openapi.Response('Order created successfully.'),
-            400: openapi.Response('Bad Request')
+            400: openapi.Response('Bad Request'),
+            409: openapi.Response('A request with this Idempotency-Key is still in progress.'),
+            422: openapi.Response('The Idempotency-Key was used with a different request.')
         },
+        manual_parameters=[openapi.Parameter(
+            'Idempotency-Key', openapi.IN_HEADER, type=openapi.TYPE_STRING, required=False,
+            description='A unique value per order, e.g. a UUID. Retries with the same key get the first response '
+                        'back instead of placing the order again.',
+        )],
         tags=['Orders']
     )
+    @idempotent
     def post(self, request):
         serializer = OrderSerializer(data=request.data)
         if serializer.is_valid():
-            order = serializer.save(user=request.user)
-            for item in serializer.validated_data['items']:
-                drug = Drug.objects.get(pk=item['drug'].id)
-                if drug.quantity < item['quantity']:
-                    order.delete()
-                    return Response({f"error": f"Insufficient quantity of {drug.drug_name}. Available quantity is {drug.quantity}."}, status=status.HTTP_400_BAD_REQUEST)
-                drug.quantity -= item['quantity']
-                drug.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            try:
+                order = serializer.save(user=request.user)
+            except InsufficientQuantity as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            order = OrderModel.objects.with_items().get(pk=order.pk)
+            return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 class OrderDetailView(APIView):
     permission_classes = (IsAuthenticated,)
+    # GET only; writes always go to the primary.
+    replica_reads = True
     @swagger_auto_schema(
         operation_summary='Get order details',
         operation_description='For fetching the details of an order.',
@@ -335,14 +362,17 @@ class OrderDetailView(APIView):
         except Exception as e:
             return Response({'error': 'Authentication failed.', 'message': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
         try:
-            order = OrderModel.objects.get(pk=pk)
+            order = OrderModel.objects.with_item_rows().get(pk=pk)
         except OrderModel.DoesNotExist:
             return Response({'error': 'Order not found.'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'error': 'An error occurred.', 'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        if request_user.role == 'admin' or request_user == order.user:
-            serializer = OrderSerializer(order)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+        if request_user.role == 'admin' or request_user.pk == order.user_id:
+            etag = order_etag(order)
+            response = not_modified(request, etag, private=True)
+            if response is not None:
+                return response
+            return set_validators(fragments.json_response(render_order(order)), etag, private=True)
         return Response('You are not authorized to view this page.', status=status.HTTP_401_UNAUTHORIZED)
     @swagger_auto_schema(
         request_body=OrderSerializer,
@@ -362,7 +392,7 @@ class OrderDetailView(APIView):
         except Exception as e:
             return Response({'error': 'Authentication failed.', 'message': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
         order = OrderModel.objects.get(pk=pk)
-        if request_user.role == 'admin' or request_user == order.user:
+        if request_user.role == 'admin' or request_user.pk == order.user_id:
             serializer = OrderSerializer(order, data=request.data, partial=True)
             if serializer.is_valid():
                 serializer.save()
@@ -392,7 +422,7 @@ class OrderDetailView(APIView):
             return Response({'error': 'Order not found.'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'error': 'An error occurred.', 'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        if request_user.role == 'admin' or request_user == order.user:
+        if request_user.role == 'admin' or request_user.pk == order.user_id:
             order.delete()
             return Response('Order deleted successfully.', status=status.HTTP_200_OK)
         return Response('You are not authorized to view this page.', status=status.HTTP_401_UNAUTHORIZED)
@@ -435,11 +465,50 @@ class DeleteItemFromOrderView(APIView):
                     return Response({'error': 'Item not found.'}, status=status.HTTP_404_NOT_FOUND)
                 except Exception as e:
                     return Response({'error': 'An error occurred.', 'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                if order.user != request_user and request_user.role != 'admin':
+                if order.user_id != request_user.pk and request_user.role != 'admin':
                     return Response('This is not your order.', status=status.HTTP_401_UNAUTHORIZED)
                 order.total_price -= item.price
                 order.save()
                 item.delete()
                 return Response('Item deleted successfully.', status=status.HTTP_200_OK)
             return Response('You are not authorized to view this page.', status=status.HTTP_401_UNAUTHORIZED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class OrderExportView(APIView):
+    permission_classes = (IsAuthenticated,)
+    @swagger_auto_schema(
+        operation_summary='Export orders',
+        operation_description='Streams order items as CSV or NDJSON. Admins see every order, sellers the items of '
+                              'their drugs, without the buyer or order total, and buyers their own orders.',
+        manual_parameters=[
+            openapi.Parameter('output', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=list(export.FORMATS)),
+            openapi.Parameter('seller', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+            openapi.Parameter('created_after', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+            openapi.Parameter('created_before', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+        ],
+        responses={
+            200: openapi.Response('Orders exported.'),
+            400: openapi.Response('Bad Request'),
+            401: openapi.Response('Authentication failed.'),
+        },
+        tags=['Orders']
+    )
+    def get(self, request):
+        try:
+            request_user = request.user
+        except Exception as e:
+            return Response({'error': 'Authentication failed.', 'message': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            fmt = export.parse_format(request.query_params)
+            lookups = export.parse_date_range(request.query_params)
+            seller_id = export.parse_seller(request.query_params)
+        except export.InvalidExport as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        user_id, columns = None, ORDER_COLUMNS
+        if request_user.role == 'seller':
+            seller_id, columns = request_user.pk, SELLER_ORDER_COLUMNS
+        elif request_user.role != 'admin':
+            user_id = request_user.pk
+        rows = order_rows(seller_id=seller_id, user_id=user_id, columns=columns, **lookups)
+        return export.streaming_response(request, columns, rows, fmt, 'orders')